@@ -7,6 +7,8 @@
 *
 ***************************************************************************************
 """
+import heapq
+
 import networkx as nx
 import numpy as np
 import matplotlib.pyplot as plt
@@ -19,8 +21,15 @@ from system.plotting.helper import plot_cognitive_map_path
 from system.plotting.plotThesis import plot_grid_cell
 
 from system.bio_model.place_cell_model import PlaceCell, PlaceCellNetwork
+from system.bio_model.spatial_index import SpatialIndex
+from system.bio_model.cognitive_map_storage import save_graph, load_graph
+from system.bio_model.journal import Journal
+from system.bio_model.path_planning import ShortestPathTreeCache
+from system.bio_model.sparse_graph import SparseGraph
+from system.bio_model.hierarchical_planning import RegionHierarchy
 from system.controller.reachability_estimator.reachability_estimation import reachability_estimator_factory, \
     ReachabilityEstimator
+from system.controller.reachability_estimator.reachability_cache import CachedReachabilityEstimator
 
 
 def get_path_top() -> str:
@@ -34,20 +43,53 @@ def sample_normal(m, s):
 
 
 class CognitiveMapInterface:
-    def __init__(self, reachability_estimator: ReachabilityEstimator, load_data_from: str = None, debug: bool = True):
+    def __init__(self, reachability_estimator: ReachabilityEstimator, load_data_from: str = None, debug: bool = True,
+                 candidate_radius: float = None, candidate_k: int = None, backend: str = "networkx"):
         """ Abstract base class defining the interface for cognitive map implementations.
 
+        Nodes of the graph are dense integer ids, the place cell of a node is stored in the place_cells table.
+
         arguments:
         reachability_estimator: ReachabilityEstimator -- reachability estimator that should be used for defining
                                                          the proximity of nodes
         load_data_from: str                           -- filename of the snapshot of the cognitive map,
                                                          None if a new cognitive map is being created
         debug: bool                                   -- enables logging
+        candidate_radius: float                       -- radius around a new node in which reachability candidates
+                                                         are searched, None: no restriction
+        candidate_k: int                              -- maximal number of nearest nodes considered as reachability
+                                                         candidates of a new node, None: no restriction
+        backend: str                                  -- answers graph queries, possible values: ['networkx'
+                                                         (default): cached shortest path trees and networkx,
+                                                         'sparse': CSR mirror of the graph, see SparseGraph]
         """
+        if backend not in ("networkx", "sparse"):
+            raise ValueError("Graph backend not implemented: " + backend)
 
         self.reach_estimator = reachability_estimator
         self.node_network = nx.DiGraph()
+        self.place_cells = {}  # node id -> PlaceCell
+        self.coordinate_index = {}  # coordinates of a place cell -> node id, maps place cells of other sources to nodes
+        self.next_node_id = 0
         self.debug = debug
+        # spatial index over node coordinates, restricts reachability candidates of new nodes
+        self.spatial_index = SpatialIndex()
+        self.candidate_radius = candidate_radius
+        self.candidate_k = candidate_k
+        # number of reachability estimator calls avoided by candidate pruning
+        self.avoided_reachability_calls = 0
+        # journal of changes since the last snapshot, created by the first incremental save
+        self.journal = None
+        self.journal_compaction_size = 5000  # number of journal records after which a new snapshot is written
+        # edge attribute used as path cost, None: number of edges
+        self.path_weight = None
+        # shortest path trees rooted at goals, repaired when edges change
+        self.path_trees = ShortestPathTreeCache(self.node_network, weight=self.path_weight)
+        # CSR mirror of the graph for whole-graph queries, rebuilt lazily after changes
+        self.sparse_graph = SparseGraph(self.node_network, weight=self.path_weight)
+        self.backend = backend
+        # region partition for coarse-to-fine planning, None: paths are planned over all nodes
+        self.hierarchy = None
         if load_data_from is not None:
             self.load(filename=load_data_from)
         # threshold used for determining nodes that represents current location of the agent
@@ -65,67 +107,382 @@ class CognitiveMapInterface:
         """
         pass
 
-    def find_path(self, start: PlaceCell, goal: PlaceCell) -> [PlaceCell]:
-        """ Returns a path in the graph from start to goal nodes"""
-        try:
-            path = nx.shortest_path(self.node_network, source=start, target=goal)
-        except nx.NetworkXNoPath:
-            return None
+    def enable_hierarchical_planning(self, region_size: float = 3.0):
+        """ Plans paths coarse-to-fine over regions of the given size instead of over all nodes """
+        self.hierarchy = RegionHierarchy(self.node_network, region_size=region_size, weight=self.path_weight)
+
+    def find_path(self, start: int, goal: int) -> [int]:
+        """ Returns a shortest path in the graph from start to goal nodes, None if no path exists.
+            Paths are read off a cached shortest path tree rooted at the goal, with the sparse backend they are
+            computed on the CSR mirror of the graph.
+            With hierarchical planning enabled the path is planned coarse-to-fine over regions instead.
+        """
+        if self.hierarchy is not None:
+            if self.hierarchy.graph is not self.node_network or self.hierarchy.weight != self.path_weight:
+                self.enable_hierarchical_planning(self.hierarchy.region_size)
+            return self.hierarchy.plan(start, goal)
+        if self.backend == "sparse":
+            return self.get_sparse_graph().shortest_path(start, goal)
+        if self.path_trees.graph is not self.node_network or self.path_trees.weight != self.path_weight:
+            self.path_trees = ShortestPathTreeCache(self.node_network, weight=self.path_weight)
+        return self.path_trees.path(start, goal)
+
+    def shortcut_path(self, path: [int], max_skip: int = None) -> [int]:
+        """ Removes intermediate hops of a path that the agent can skip. Only hops along existing edges are
+            considered, so the outcome of every navigation is recorded on an edge of the map. The reachability of
+            these edges is evaluated in one batched call, then the path greedily jumps from each node to the
+            furthest reachable one.
+
+        arguments:
+        path: [int]   -- path of nodes
+        max_skip: int -- maximal number of hops replaced by one, None: no restriction
+
+        returns:
+        [int] -- path with the hops that were kept, starts and ends with the nodes of the given path
+        """
+        if path is None or len(path) < 3:
+            return path
+        pairs = [(i, j) for i in range(len(path)) for j in range(i + 2, len(path))
+                 if (max_skip is None or j - i <= max_skip) and self.node_network.has_edge(path[i], path[j])]
+        reachable, _ = self.reach_estimator.get_reachability_pairs(
+            [(self.place_cells[path[i]], self.place_cells[path[j]]) for i, j in pairs])
+        furthest = list(range(1, len(path) + 1))  # index -> furthest reachable index, the next hop by default
+        for (i, j), is_reachable in zip(pairs, reachable):
+            if is_reachable:
+                furthest[i] = max(furthest[i], j)
+        shortened = [path[0]]
+        i = 0
+        while i < len(path) - 1:
+            i = furthest[i]
+            shortened.append(path[i])
+        self.print_debug(f"shortcut path of {len(path)} nodes to {len(shortened)} nodes")
+        return shortened
+
+    def get_sparse_graph(self) -> SparseGraph:
+        """ Returns the CSR mirror of the graph, e.g. for all-pairs path statistics or connected components """
+        if self.sparse_graph.graph is not self.node_network or self.sparse_graph.weight != self.path_weight:
+            self.sparse_graph = SparseGraph(self.node_network, weight=self.path_weight)
+        return self.sparse_graph
+
+    def edge_cost(self, p: int, q: int, data: dict) -> float:
+        """ Helper function, cost of an edge on paths, the same as in the shortest path trees """
+        if self.path_weight is None:
+            return 1.0
+        return max(float(data.get(self.path_weight, 1.0)), 0.0)
+
+    def path_lengths_from(self, sources: [int]) -> dict:
+        """ Returns for every node that is reachable from one of the sources the cost of the shortest path from the
+            closest source
+        """
+        if len(sources) == 0:
+            return {}
+        if self.backend == "sparse":
+            distances = self.get_sparse_graph().multi_source_distances(sources)
+            return {node: float(distance) for node, distance in distances.items() if np.isfinite(distance)}
+        return nx.multi_source_dijkstra_path_length(self.node_network, set(sources), weight=self.edge_cost)
+
+    def connected_components(self, strongly: bool = True) -> [[int]]:
+        """ Returns the strongly (or weakly) connected components of the graph, largest first """
+        if self.backend == "sparse":
+            return self.get_sparse_graph().connected_components(strongly)
+        if strongly:
+            components = nx.strongly_connected_components(self.node_network)
+        else:
+            components = nx.weakly_connected_components(self.node_network)
+        return sorted([list(component) for component in components], key=len, reverse=True)
+
+    def reachable_nodes(self, node: int) -> set:
+        """ Returns all nodes that can be reached from the node along the edges, including itself """
+        if self.backend == "sparse":
+            return set(self.get_sparse_graph().reachable_from(node))
+        return nx.descendants(self.node_network, node) | {node}
+
+    def is_reachable(self, start: int, goal: int) -> bool:
+        """ Checks if a path from start to goal exists """
+        if self.backend == "sparse":
+            return goal in self.reachable_nodes(start)
+        return nx.has_path(self.node_network, start, goal)
+
+    def get_place_cell(self, node: int) -> PlaceCell:
+        """ Returns the place cell of a node """
+        return self.place_cells[node]
+
+    def node_id_of(self, pc: PlaceCell) -> int:
+        """ Returns the node of a place cell or None if the place cell is not part of the map.
+            Place cells that are not stored in the map are matched by their coordinates.
+        """
+        node = getattr(pc, "node_id", None)
+        if node is not None and self.place_cells.get(node) is pc:
+            return node
+        return self.coordinate_index.get(tuple(pc.env_coordinates))
+
+    def add_node_to_map(self, p: PlaceCell) -> int:
+        """ Adds a new node to the cognitive map
+
+        returns:
+        int -- id of the node, the id of the existing node if the place cell is already part of the map
+        """
+        node = self.node_id_of(p)
+        if node is not None:
+            return node
+        node = self.next_node_id
+        self.next_node_id += 1
+        p.node_id = node
+        self.place_cells[node] = p
+        self.coordinate_index[tuple(p.env_coordinates)] = node
+        self.node_network.add_node(node, pos=tuple(p.env_coordinates))
+        self.spatial_index.insert(node, p.env_coordinates)
+        self.sparse_graph.invalidate()
+        if self.hierarchy is not None and self.hierarchy.graph is self.node_network:
+            self.hierarchy.add_node(node, p.env_coordinates)
+        self.record_change("add_node", node, p)
+        return node
+
+    def remove_node_from_map(self, node: int):
+        """ Removes a node and all its edges from the cognitive map """
+        p = self.place_cells.pop(node)
+        if self.coordinate_index.get(tuple(p.env_coordinates)) == node:
+            del self.coordinate_index[tuple(p.env_coordinates)]
+        self.node_network.remove_node(node)
+        self.spatial_index.remove(node)
+        self.sparse_graph.invalidate()
+        if self.hierarchy is not None and self.hierarchy.graph is self.node_network:
+            self.hierarchy.remove_node(node)
+        self.record_change("remove_node", node)
+        if self.path_trees.graph is self.node_network:
+            self.path_trees.node_removed(node)
+        # node ids are reused by later maps, e.g. after loading
+        if self.reach_estimator is not None:
+            self.reach_estimator.forget_nodes([node])
+
+    def record_change(self, *entry):
+        """ Records a change of the map in the journal, if incremental saving is enabled """
+        if self.journal is not None:
+            self.journal.record(*entry)
+
+    def edges_changed(self, edges: [(int, int)]):
+        """ Has to be called after edges were added, updated or removed. Records their current state in the journal
+            and repairs the cached shortest path trees.
+        """
+        self.sparse_graph.invalidate()
+        if self.path_trees.graph is self.node_network:
+            for p, q in edges:
+                self.path_trees.edge_changed(p, q)
+        if self.hierarchy is not None and self.hierarchy.graph is self.node_network:
+            for p, q in edges:
+                self.hierarchy.edge_changed(p, q)
+        if self.journal is None:
+            return
+        for p, q in edges:
+            if self.node_network.has_edge(p, q):
+                self.journal.record("set_edge", p, q, dict(self.node_network.edges[p, q]))
+            else:
+                self.journal.record("remove_edge", p, q)
+
+    def rebuild_spatial_index(self):
+        """ Rebuilds the spatial index from the nodes of the graph """
+        self.spatial_index.clear()
+        for node in self.node_network.nodes:
+            self.spatial_index.insert(node, self.place_cells[node].env_coordinates)
+
+    def get_candidate_nodes(self, node: int, radius: float = None, k: int = None,
+                            calls_per_candidate: int = 1) -> [int]:
+        """ Returns the nodes that are close enough to the given node to be considered for a connection.
+            Counts the reachability estimator calls avoided by the restriction.
+
+        arguments:
+        node: int                -- node to find candidates for
+        radius: float            -- maximal distance of candidates, None: no restriction
+        k: int                   -- maximal number of nearest candidates, None: no restriction
+        calls_per_candidate: int -- number of estimator calls the caller performs per candidate
 
-        return path
+        returns:
+        [int] -- candidate nodes excluding the given node
+        """
+        return self.get_candidate_nodes_at(self.place_cells[node].env_coordinates, radius=radius, k=k,
+                                           calls_per_candidate=calls_per_candidate, exclude=node)
+
+    def get_candidate_nodes_at(self, coordinates, radius: float = None, k: int = None,
+                               calls_per_candidate: int = 1, exclude: int = None) -> [int]:
+        """ Returns the nodes that are close enough to the given location to be considered for a connection.
+            Counts the reachability estimator calls avoided by the restriction.
+
+        arguments:
+        coordinates              -- [x, y] location to find candidates for
+        radius: float            -- maximal distance of candidates, None: no restriction
+        k: int                   -- maximal number of nearest candidates, None: no restriction
+        calls_per_candidate: int -- number of estimator calls the caller performs per candidate
+        exclude: int             -- node that is not returned as a candidate, None: all nodes are considered
+
+        returns:
+        [int] -- candidate nodes
+        """
+        if len(self.spatial_index) != self.node_network.number_of_nodes():
+            self.rebuild_spatial_index()
+        excluded = exclude is not None and exclude in self.node_network
+        if k is not None and excluded:
+            k += 1  # the excluded node is its own nearest node
+        candidates = [q for q in self.spatial_index.query(coordinates, radius=radius, k=k) if q != exclude]
+        if k is not None and excluded:
+            candidates = candidates[:k - 1]
+        nr_other_nodes = self.node_network.number_of_nodes() - (1 if excluded else 0)
+        self.avoided_reachability_calls += (nr_other_nodes - len(candidates)) * calls_per_candidate
+        return candidates
+
+    def find_duplicate(self, pc: PlaceCell, merge_distance: float, min_firing: float) -> int:
+        """ Returns a node that represents the same location as the place cell, None if there is none.
+            A node is a duplicate if it is closer than merge_distance and fires at least min_firing
+            at the grid cell state of the place cell.
+        """
+        if len(self.spatial_index) != self.node_network.number_of_nodes():
+            self.rebuild_spatial_index()
+        candidates = self.spatial_index.query_nearest(pc.env_coordinates, k=len(self.spatial_index),
+                                                      radius=merge_distance) if len(self.spatial_index) else []
+        for node in candidates:
+            if self.place_cells[node].compute_firing(pc.gc_connections) >= min_firing:
+                return node
+        return None
+
+    def merge_graph(self, graph: nx.DiGraph, place_cells: dict, merge_distance: float = 0.1,
+                    min_firing: float = 0.9) -> dict:
+        """ Adds the nodes and edges of another cognitive map, e.g. one built by another exploration worker.
+            Place cells that duplicate an existing node are mapped to that node, the others are added.
 
-    def add_node_to_map(self, p: PlaceCell):
-        """ Adds a new node to the cognitive map """
-        self.node_network.add_node(p, pos=tuple(p.env_coordinates))
+        arguments:
+        graph: nx.DiGraph     -- graph of the other map
+        place_cells: dict     -- node id -> PlaceCell of the other map
+        merge_distance: float -- maximal distance between duplicate place cells in meters
+        min_firing: float     -- minimal firing of an existing node at the grid cell state of a duplicate
 
-    def add_edge_to_map(self, p: PlaceCell, q: PlaceCell, w: float = 1, **kwargs):
+        returns:
+        dict -- node of the other map -> node of this map
+        """
+        mapping = {}
+        for node in graph.nodes:
+            pc = place_cells[node]
+            duplicate = self.find_duplicate(pc, merge_distance, min_firing)
+            mapping[node] = duplicate if duplicate is not None else self.add_node_to_map(pc)
+        self.print_debug(f"merged {len(mapping)} nodes, {len(mapping) - len(set(mapping.values()))} duplicates")
+
+        changed = []
+        for p, q, data in graph.edges(data=True):
+            p_new, q_new = mapping[p], mapping[q]
+            if p_new != q_new and not self.node_network.has_edge(p_new, q_new):
+                self.node_network.add_edge(p_new, q_new, **data)
+                changed.append((p_new, q_new))
+        self.edges_changed(changed)
+        return mapping
+
+    def add_edge_to_map(self, p: int, q: int, w: float = 1, **kwargs):
         """ Adds a new directed weighted edge to the cognitive map with given weight and parameters
 
         arguments:
-        p: PlaceCell -- source node of the edge
-        q: PlaceCell -- target node of the edge
-        w: float     -- weight of the edge
-        **kwargs     -- parameters of the edge
+        p: int   -- source node of the edge
+        q: int   -- target node of the edge
+        w: float -- weight of the edge
+        **kwargs -- parameters of the edge
         """
         self.node_network.add_edge(p, q, weight=w, **kwargs)
+        self.edges_changed([(p, q)])
 
-    def add_bidirectional_edge_to_map_no_weight(self, p: PlaceCell, q: PlaceCell, **kwargs):
+    def add_bidirectional_edge_to_map_no_weight(self, p: int, q: int, **kwargs):
         """ Adds a new bidirectional edge to the cognitive map with given parameters
 
         arguments:
-        p: PlaceCell -- first node of the edge
-        q: PlaceCell -- second node of the edge
-        **kwargs     -- parameters of the edge
+        p: int   -- first node of the edge
+        q: int   -- second node of the edge
+        **kwargs -- parameters of the edge
         """
         self.node_network.add_edge(p, q, **kwargs)
         self.node_network.add_edge(q, p, **kwargs)
+        self.edges_changed([(p, q), (q, p)])
 
     def add_bidirectional_edge_to_map(self, p, q, w=1, **kwargs):
         """ Adds a new bidirectional weighted edge to the cognitive map with given parameters
 
         arguments:
-        p: PlaceCell -- first node of the edge
-        q: PlaceCell -- second node of the edge
-        w: float     -- weight of the edge
-        **kwargs     -- parameters of the edge
+        p: int   -- first node of the edge
+        q: int   -- second node of the edge
+        w: float -- weight of the edge
+        **kwargs -- parameters of the edge
         """
         self.node_network.add_edge(p, q, weight=w, **kwargs)
         self.node_network.add_edge(q, p, weight=w, **kwargs)
+        self.edges_changed([(p, q), (q, p)])
 
     def save(self, filename: str, relative_folder: str = "data/cognitive_map"):
         """ Stores the current state of the node_network to the file
 
         arguments:
-        filename: str        -- filename of the snapshot
+        filename: str        -- filename of the snapshot, filenames ending with .cmap are stored in the compact
+                                format (CSR adjacency and a place cell store), all others are pickled
         relative_folder: str -- relative folder (counting from the folder of the current file) of the snapshot file
         """
         directory = os.path.join(get_path_top(), "data/cognitive_map")
         if not os.path.exists(directory):
             os.makedirs(directory)
-        nx.write_gpickle(self.node_network, os.path.join(directory, filename))
+        save_graph(self.node_network, self.place_cells, os.path.join(directory, filename))
+        self.save_reachability_cache(os.path.join(directory, filename))
+        # the snapshot contains all changes of the journal
+        if os.path.exists(os.path.join(directory, filename) + ".journal"):
+            os.remove(os.path.join(directory, filename) + ".journal")
+        if self.journal is not None and self.journal.filepath == os.path.join(directory, filename) + ".journal":
+            self.journal.clear()
+
+    def save_incremental(self, filename: str, relative_folder: str = "data/cognitive_map"):
+        """ Appends the changes since the last save to the journal of the snapshot instead of rewriting it.
+            The first call and every call after journal_compaction_size records write a new snapshot.
+
+        arguments:
+        filename: str        -- filename of the snapshot
+        relative_folder: str -- relative folder (counting from the folder of the current file) of the snapshot file
+        """
+        directory = os.path.join(get_path_top(), "data/cognitive_map")
+        filepath = os.path.join(directory, filename)
+        if (self.journal is None or self.journal.filepath != filepath + ".journal" or
+                len(self.journal) >= self.journal_compaction_size or not os.path.exists(filepath)):
+            CognitiveMapInterface.save(self, filename, relative_folder=relative_folder)
+            self.journal = Journal(filepath + ".journal")
+            return
+        self.journal.flush()
+
+    def replay_journal(self, filepath: str):
+        """ Applies the changes of the journal of a snapshot to the loaded map """
+        for entry in Journal(filepath).read():
+            operation = entry[0]
+            if operation == "add_node":
+                node, pc = entry[1], entry[2]
+                self.place_cells[node] = pc
+                self.node_network.add_node(node, pos=tuple(pc.env_coordinates))
+            elif operation == "remove_node":
+                self.place_cells.pop(entry[1], None)
+                if entry[1] in self.node_network:
+                    self.node_network.remove_node(entry[1])
+            elif operation == "set_edge":
+                p, q, attributes = entry[1], entry[2], entry[3]
+                if p in self.node_network and q in self.node_network:
+                    self.node_network.add_edge(p, q)
+                    self.node_network.edges[p, q].clear()
+                    self.node_network.edges[p, q].update(attributes)
+            elif operation == "remove_edge":
+                if self.node_network.has_edge(entry[1], entry[2]):
+                    self.node_network.remove_edge(entry[1], entry[2])
+
+    def save_reachability_cache(self, map_filepath: str):
+        """ Stores the reachability cache of the estimator next to the snapshot of the map, if the estimator is cached.
+            Entries of nodes that are no longer part of the map are dropped.
+        """
+        if isinstance(self.reach_estimator, CachedReachabilityEstimator):
+            self.reach_estimator.prune(list(self.place_cells.values()))
+            self.reach_estimator.save(map_filepath + ".reach_cache")
+
+    def load_reachability_cache(self, map_filepath: str):
+        """ Loads the reachability cache stored next to the snapshot of the map, if the estimator is cached """
+        if isinstance(self.reach_estimator, CachedReachabilityEstimator):
+            self.reach_estimator.load(map_filepath + ".reach_cache")
 
     def load(self, filename: str, relative_folder: str = "data/cognitive_map"):
-        """ Loads the state of the node_network from the file
+        """ Loads the state of the node_network from the file. Place cells of compact snapshots are read lazily.
 
         arguments:
         filename: str        -- filename of the snapshot
@@ -135,7 +492,18 @@ class CognitiveMapInterface:
         directory = os.path.join(get_path_top(), relative_folder)
         if not os.path.exists(directory):
             raise ValueError("cognitive map not found")
-        self.node_network = nx.read_gpickle(os.path.join(directory, filename))
+        self.node_network, self.place_cells = load_graph(os.path.join(directory, filename))
+        if self.reach_estimator is not None:
+            self.reach_estimator.forget_nodes()
+        # recover changes saved incrementally after the snapshot
+        self.replay_journal(os.path.join(directory, filename) + ".journal")
+        self.coordinate_index = {}
+        for node, pc in self.place_cells.items():
+            pc.node_id = node
+            self.coordinate_index[tuple(pc.env_coordinates)] = node
+        self.next_node_id = max(self.place_cells, default=-1) + 1
+        self.rebuild_spatial_index()
+        self.load_reachability_cache(os.path.join(directory, filename))
         if self.debug:
             self.draw()
 
@@ -143,12 +511,11 @@ class CognitiveMapInterface:
         """ Plot the cognitive map
 
         arguments:
-        with_labels: bool -- flag to include node indices as labels
+        with_labels: bool -- flag to include node ids as labels
         """
         pos = nx.get_node_attributes(self.node_network, 'pos')
         if with_labels:
-            node_list = list(self.node_network.nodes)
-            nx.draw(self.node_network, pos, labels={i: str(node_list.index(i)) for i in node_list})
+            nx.draw(self.node_network, pos, labels={i: str(i) for i in self.node_network.nodes})
         else:
             nx.draw(self.node_network, pos, node_color='#0065BD', node_size=120, edge_color='#4A4A4A80', width=2)
         plt.show()
@@ -162,13 +529,13 @@ class CognitiveMapInterface:
         """ Performs map processing after one full topological navigation cycle """
         pass
 
-    def postprocess_vector_navigation(self, node_p: PlaceCell, node_q: PlaceCell, observation_q: PlaceCell,
+    def postprocess_vector_navigation(self, node_p: int, node_q: int, observation_q: PlaceCell,
                                       observation_p: PlaceCell, success: bool):
         """ Performs map processing after one full vector navigation
 
         arguments:
-        node_p: PlaceCell        -- source node in the graph on the start of the vector navigation
-        node_q: PlaceCell        -- estimated target node in the graph
+        node_p: int              -- source node in the graph on the start of the vector navigation
+        node_q: int              -- estimated target node in the graph
         observation_q: PlaceCell -- actual location of the agent on the start of the vector navigation
         observation_p: PlaceCell -- actual location of the agent after vector navigation
         success: bool            -- indicates if the agent reached the target graph node
@@ -178,7 +545,7 @@ class CognitiveMapInterface:
 
 class CognitiveMap(CognitiveMapInterface):
     def __init__(self, reachability_estimator=None, mode="exploration", connection=("all", "delayed"),
-                 load_data_from=None, debug=False):
+                 load_data_from=None, debug=False, candidate_radius=None, candidate_k=None, backend="networkx"):
         """ Baseline cognitive map representation of the environment.
         
         arguments:
@@ -195,9 +562,15 @@ class CognitiveMap(CognitiveMapInterface):
         load_data_from: str                           -- filename of the snapshot of the cognitive map, None if a new
                                                          cognitive map is being created
         debug: bool                                   -- enables logging
+        candidate_radius: float                       -- radius in which reachability candidates are searched when
+                                                         connecting all nodes, None: no restriction
+        candidate_k: int                              -- maximal number of nearest nodes considered as reachability
+                                                         candidates, None: no restriction
+        backend: str                                  -- answers graph queries, 'networkx' (default) or 'sparse'
 
         """
-        super().__init__(reachability_estimator, load_data_from=load_data_from, debug=debug)
+        super().__init__(reachability_estimator, load_data_from=load_data_from, debug=debug,
+                         candidate_radius=candidate_radius, candidate_k=candidate_k, backend=backend)
 
         self.connection = connection
 
@@ -205,57 +578,82 @@ class CognitiveMap(CognitiveMapInterface):
 
         self.radius = 5  # radius in which node connection is calculated
 
-    def update_reachabilities(self):
-        """ Update reachability between the nodes. """
-        nr_nodes = len(list(self.node_network.nodes))
-        for i, p in enumerate(list(self.node_network.nodes)):
-            self.print_debug("currently updating node " + str(i))
-            progress_str = "Progress: " + str(int((i + 1) * 100 / nr_nodes)) + "%"
-            print(progress_str)
+        # nodes whose reachability to other nodes has not been calculated since they were added or changed
+        self.dirty_nodes = set()
 
-            for q in list(self.node_network.nodes):
+    def _get_candidates(self, p: int, calls_per_candidate: int = 1) -> [int]:
+        """ Helper function, returns the nodes whose reachability with p should be calculated """
+        radius = self.radius if self.connection[0] == "radius" else self.candidate_radius
+        return self.get_candidate_nodes(p, radius=radius, k=self.candidate_k, calls_per_candidate=calls_per_candidate)
 
-                if q == p:
-                    continue
+    def _apply_reachabilities(self, pairs: [(int, int)], remove_unreachable: bool):
+        """ Helper function, evaluates reachability of all pairs in one batched call and updates the edges
 
-                if self.connection[0] == "radius" and np.linalg.norm(
-                        q.env_coordinates - p.env_coordinates) > self.radius:
-                    # No connection above radius
-                    continue
+        arguments:
+        pairs: [(int, int)]      -- directed (source, target) node pairs
+        remove_unreachable: bool -- if True: edges between unreachable pairs are removed
+        """
+        self.print_debug("calculating reachability of " + str(len(pairs)) + " pairs")
+        reachable, reachability_factors = self.reach_estimator.get_reachability_pairs(
+            [(self.place_cells[p], self.place_cells[q]) for p, q in pairs])
+        changed = []
+        for (p, q), is_reachable, reachability_factor in zip(pairs, reachable, reachability_factors):
+            if is_reachable:
+                self.node_network.add_weighted_edges_from([(p, q, reachability_factor)])
+                changed.append((p, q))
+            elif remove_unreachable and self.node_network.has_edge(p, q):
+                self.node_network.remove_edges_from([(p, q)])
+                changed.append((p, q))
+        self.edges_changed(changed)
+
+    def mark_dirty(self, node: int):
+        """ Marks a node whose place cell changed, its reachabilities are recalculated on the next update """
+        self.dirty_nodes.add(node)
+
+    def update_reachabilities(self, full: bool = False):
+        """ Update reachability between the nodes. Only pairs involving a dirty node are recalculated,
+            edges between clean nodes keep their attributes.
 
-                reachable, reachability_factor = self.reach_estimator.get_reachability(p, q)
-                if reachable:
-                    self.node_network.add_weighted_edges_from([(p, q, reachability_factor)])
-                else:
-                    self.node_network.remove_edges_from([(p, q, reachability_factor)])
+        arguments:
+        full: bool -- if True: all pairs are recalculated, e.g. after the reachability estimator changed
+        """
+        if full:
+            self.dirty_nodes = set(self.node_network.nodes)
+        dirty = [p for p in self.node_network.nodes if p in self.dirty_nodes]
+        pairs = []
+        seen = set()
+        for p in dirty:
+            for q in self._get_candidates(p, calls_per_candidate=2):
+                for pair in [(p, q), (q, p)]:
+                    if pair not in seen:
+                        seen.add(pair)
+                        pairs.append(pair)
+        self.print_debug(f"updating reachabilities of {len(dirty)} dirty nodes")
+        self._apply_reachabilities(pairs, remove_unreachable=True)
+        self.dirty_nodes = set()
 
     def _connect_single_node(self, p):
         """ Calculate reachability of node p with other nodes """
-        for q in list(self.node_network.nodes):
-
-            if q == p:
-                continue
-
-            if self.connection[0] == "radius" and np.linalg.norm(q.env_coordinates - p.env_coordinates) > self.radius:
-                # No connection above radius
-                continue
+        pairs = []
+        for q in self._get_candidates(p, calls_per_candidate=2):
+            pairs += [(p, q), (q, p)]
+        self._apply_reachabilities(pairs, remove_unreachable=False)
 
-            reachable_pq, reachability_factor_pq = self.reach_estimator.get_reachability(p, q)
-            reachable_qp, reachability_factor_qp = self.reach_estimator.get_reachability(q, p)
-
-            if reachable_pq:
-                self.node_network.add_weighted_edges_from([(p, q, reachability_factor_pq)])
-            if reachable_qp:
-                self.node_network.add_weighted_edges_from([(q, p, reachability_factor_qp)])
-
-    def add_node_to_map(self, p: PlaceCell):
-        super().add_node_to_map(p)
+    def add_node_to_map(self, p: PlaceCell) -> int:
+        node = super().add_node_to_map(p)
 
         if self.connection[1] == "instant":
             # Connect the new node to all other nodes in the graph
             self.print_debug("connecting new node")
-            self._connect_single_node(p)
+            self._connect_single_node(node)
             self.print_debug("connecting finished")
+        else:
+            self.dirty_nodes.add(node)
+        return node
+
+    def remove_node_from_map(self, node: int):
+        super().remove_node_from_map(node)
+        self.dirty_nodes.discard(node)
 
     def track_vector_movement(self, pc_firing: [float], created_new_pc: bool, pc: PlaceCell, **kwargs):
         """Keeps track of curren/t place cell firing and creation of new place cells"""
@@ -278,19 +676,20 @@ class CognitiveMap(CognitiveMapInterface):
             if self.mode == "navigation" and self.prior_idx_pc_firing:
                 # If we have entered place cell p after being in place cell q during
                 # navigation, q is definitely reachable and the edge gets updated accordingly.
-                q = list(self.node_network.nodes)[self.prior_idx_pc_firing]
-                pc = list(self.node_network.nodes)[idx_pc_active]
+                # place cells are added to the map in the order of their creation, their index is the node id
+                q = self.prior_idx_pc_firing
+                pc = idx_pc_active
                 self.node_network.add_weighted_edges_from([(q, pc, 1)])
+                self.edges_changed([(q, pc)])
 
             self.prior_idx_pc_firing = idx_pc_active
 
     def save(self, relative_folder="data/cognitive_map", filename=None):
         CognitiveMapInterface.save(self, filename, relative_folder=relative_folder)
-        directory = os.path.join(get_path_top(), relative_folder)
 
-        if self.connection[1] == "delayed":
+        if self.connection[1] == "delayed" and self.dirty_nodes:
             self.update_reachabilities()
-            nx.write_gpickle(self.node_network, os.path.join(directory, filename))
+            CognitiveMapInterface.save(self, filename, relative_folder=relative_folder)
 
     def test_place_cell_network(self, env, gc_network, from_data=False):
         """ Test the drift error of place cells stored in the cognitive map """
@@ -313,7 +712,7 @@ class CognitiveMap(CognitiveMapInterface):
         else:
             env.mode = "linear_lookahead"
             # decode goal vectors from current position to every place cell on the cognitive map 
-            node_list = list(self.node_network.nodes)
+            node_list = [self.place_cells[node] for node in self.node_network.nodes]
             nodes_length = len(node_list)
             for i, p in enumerate(node_list):
                 print("Decoding goal vector to place Cell", i, "out of", nodes_length)
@@ -383,7 +782,10 @@ class LifelongCognitiveMap(CognitiveMapInterface):
             add_edges: bool = True,
             remove_edges: bool = True,
             remove_nodes: bool = True,
-            add_nodes: bool = True
+            add_nodes: bool = True,
+            candidate_radius: float = None,
+            candidate_k: int = None,
+            backend: str = "networkx"
     ):
         """ Implements a cognitive map with lifelong learning algorithm.
 
@@ -397,9 +799,15 @@ class LifelongCognitiveMap(CognitiveMapInterface):
         remove_edges: bool                            -- defines if edge cleanup is enabled
         remove_nodes: bool                            -- defines if node cleanup is enabled
         add_nodes: bool                               -- defines if node addition is enabled
+        candidate_radius: float                       -- radius around a new node in which reachability candidates
+                                                         are searched, None: no restriction
+        candidate_k: int                              -- maximal number of nearest nodes considered as reachability
+                                                         candidates of a new node, None: no restriction
+        backend: str                                  -- answers graph queries, 'networkx' (default) or 'sparse'
         """
 
-        super().__init__(reachability_estimator, load_data_from=load_data_from, debug=debug)
+        super().__init__(reachability_estimator, load_data_from=load_data_from, debug=debug,
+                         candidate_radius=candidate_radius, candidate_k=candidate_k, backend=backend)
         # values used for probabilistic calculations
         self.sigma = 0.015
         self.sigma_squared = self.sigma ** 2
@@ -414,6 +822,11 @@ class LifelongCognitiveMap(CognitiveMapInterface):
 
         self.min_node_degree_for_deletion = 4
         self.max_number_unique_neighbors_for_deletion = 2
+        # paths are planned on the learned edge weights
+        self.path_weight = "weight"
+        # prefilters of duplicate candidates, None: disabled
+        self.max_distance_for_deletion = None  # maximal distance between duplicates in meters
+        self.min_firing_for_deletion = None  # minimal firing of a place cell at the grid cell state of its duplicate
 
     def track_vector_movement(self, pc_firing: [float], created_new_pc: bool, pc: PlaceCell, **kwargs) -> PlaceCell:
         """ Incorporate changes to the map after each vector navigation tryout. Adds nodes during exploration phase and
@@ -433,10 +846,9 @@ class LifelongCognitiveMap(CognitiveMapInterface):
         exploration_phase = kwargs.get('exploration_phase', True)
         pc_network = kwargs.get('pc_network', None)
         if exploration_phase and created_new_pc:
-            is_mergeable, mergeable_values = self.is_mergeable(pc)
-            if is_mergeable:
+            merged, _ = self.merge_or_add_node(pc)
+            if merged:
                 return pc
-            self.add_and_connect_node(pc)
         elif not exploration_phase and not created_new_pc:
             if self.add_edges:
                 self.process_add_edge(pc_firing, pc_network)
@@ -461,9 +873,9 @@ class LifelongCognitiveMap(CognitiveMapInterface):
             if self.prior_idx_pc_firing:
                 # If we have entered place cell p after being in place cell q during
                 # navigation, q is definitely reachable and the edge gets updated accordingly.
-                q = pc_network.place_cells[self.prior_idx_pc_firing]
-                pc_new = pc_network.place_cells[idx_pc_active]
-                if (q in self.node_network and pc_new in self.node_network and
+                q = self.node_id_of(pc_network.place_cells[self.prior_idx_pc_firing])
+                pc_new = self.node_id_of(pc_network.place_cells[idx_pc_active])
+                if (q is not None and pc_new is not None and
                         q not in self.node_network[pc_new] and q != pc_new):
                     self.print_debug(f"adding edge [{self.prior_idx_pc_firing}-{idx_pc_active}]")
                     self.add_bidirectional_edge_to_map(q, pc_new,
@@ -478,56 +890,72 @@ class LifelongCognitiveMap(CognitiveMapInterface):
 
     def is_mergeable(self, p: PlaceCell) -> (bool, [bool]):
         """ Helper function. Checks if the waypoint p is mergeable with the existing graph"""
-        mergeable_values = [self.reach_estimator.is_same(p, q) for q in self.node_network.nodes]
-        return any(self.reach_estimator.is_same(p, q) for q in self.node_network.nodes), mergeable_values
-
-    def postprocess_vector_navigation(self, node_p: PlaceCell, node_q: PlaceCell, observation_p: PlaceCell,
+        if not self.place_cells:
+            return False, []
+        factors = self.reach_estimator.predict_reachability_pairs([(p, q) for q in self.place_cells.values()])
+        mergeable_values = [self.reach_estimator.pass_threshold(factor, self.reach_estimator.threshold_same)
+                            for factor in factors]
+        return any(mergeable_values), mergeable_values
+
+    def postprocess_vector_navigation(self, node_p: int, node_q: int, observation_p: PlaceCell,
                                       observation_q: PlaceCell, success: bool):
         """ Performs map processing after one full vector navigation. Updates edge connectivity probabilities.
             May add new nodes and edges, and remove edges.
 
         arguments:
-        node_p: PlaceCell        -- source node in the graph on the start of the vector navigation
-        node_q: PlaceCell        -- estimated target node in the graph
+        node_p: int              -- source node in the graph on the start of the vector navigation
+        node_q: int              -- estimated target node in the graph
         observation_q: PlaceCell -- actual location of the agent on the start of the vector navigation
         observation_p: PlaceCell -- actual location of the agent after vector navigation
         success: bool            -- indicates if the agent reached the target graph node
+
+        returns:
+        dict -- outcome applied to the edge (node_p, node_q, success and the observed reachability factor),
+                None if the edge was not updated
         """
 
         if node_q == node_p:
-            return
-        if not success and observation_q not in self.node_network and self.add_nodes:
+            return None
+        if not success and self.node_id_of(observation_q) is None and self.add_nodes:
             self.add_and_connect_node(observation_q)
         if self.add_edges:
-            if observation_p != observation_p and observation_p in self.node_network and observation_p not in \
-                    self.node_network[observation_q]:
-                self.add_bidirectional_edge_to_map(observation_p, observation_q,
+            node_observation_p = self.node_id_of(observation_p)
+            node_observation_q = self.node_id_of(observation_q)
+            if observation_p != observation_p and node_observation_p is not None and node_observation_p not in \
+                    self.node_network[node_observation_q]:
+                self.add_bidirectional_edge_to_map(node_observation_p, node_observation_q,
                                                    sample_normal(0.5, self.sigma),
                                                    connectivity_probability=0.8,
                                                    mu=0.5,
                                                    sigma=self.sigma)
         if node_p not in self.node_network or node_q not in self.node_network[node_p]:
-            return
+            return None
 
-        self.update_edge_parameters(node_p, node_q, observation_p, success)
+        observed_weight = self.update_edge_parameters(node_p, node_q, observation_p, success)
+        outcome = {"node_p": int(node_p), "node_q": int(node_q), "success": bool(success),
+                   "observed_weight": observed_weight}
         if not success and self.remove_edges:
             if self.node_network[node_q][node_p]['connectivity_probability'] < self.threshold_edge_removal:
                 self.remove_bidirectional_edge(node_p, node_q)
 
         self.print_debug(
-            f"edge [{list(self.node_network.nodes).index(node_p)}-{list(self.node_network.nodes).index(node_q)}]: " +
+            f"edge [{node_p}-{node_q}]: " +
             f"success {success} conn {self.node_network[node_q][node_p]['connectivity_probability']}")
+        return outcome
 
-    def update_edge_parameters(self, node_p: PlaceCell, node_q: PlaceCell, observation_p: PlaceCell, success: bool):
+    def update_edge_parameters(self, node_p: int, node_q: int, observation_p: PlaceCell, success: bool):
         """ Helper function. Performs map processing after one full vector navigation.
             Updates edge connectivity probabilities. May add new nodes and edges.
 
         arguments:
-        node_p: PlaceCell        -- source node in the graph on the start of the vector navigation
-        node_q: PlaceCell        -- estimated target node in the graph
+        node_p: int              -- source node in the graph on the start of the vector navigation
+        node_q: int              -- estimated target node in the graph
         observation_q: PlaceCell -- actual location of the agent on the start of the vector navigation
         observation_p: PlaceCell -- actual location of the agent after vector navigation
         success: bool            -- indicates if the agent reached the target graph node
+
+        returns:
+        float -- reachability factor observed between the agent and node_q, None if the navigation failed
         """
         edges = [self.node_network[node_p][node_q], self.node_network[node_q][node_p]]
 
@@ -537,12 +965,15 @@ class LifelongCognitiveMap(CognitiveMapInterface):
         connectivity_probability = min(connectivity_probability, 0.95)
         for edge in edges:
             edge['connectivity_probability'] = connectivity_probability
+            # outcome counts of navigations along the edge
+            outcome = 'successes' if success else 'failures'
+            edge[outcome] = edge.get(outcome, 0) + 1
 
         if success:
-            weight = self.reach_estimator.get_reachability(observation_p, node_q)[1]
+            observed_weight = self.reach_estimator.get_reachability(observation_p, self.place_cells[node_q])[1]
             sigma_ij_t_squared = edges[0]['sigma'] ** 2
             mu_ij_t = edges[0]['mu']
-            mu = (self.sigma_squared * mu_ij_t + sigma_ij_t_squared * weight) / (
+            mu = (self.sigma_squared * mu_ij_t + sigma_ij_t_squared * observed_weight) / (
                     sigma_ij_t_squared + self.sigma_squared)
             sigma = np.sqrt(1 / (1 / sigma_ij_t_squared + 1 / self.sigma_squared))
             weight = sample_normal(mu, sigma)
@@ -551,6 +982,10 @@ class LifelongCognitiveMap(CognitiveMapInterface):
                 edge['mu'] = mu
                 edge['sigma'] = sigma
                 edge['weight'] = weight
+            self.edges_changed([(node_p, node_q), (node_q, node_p)])
+            return float(observed_weight)
+        self.edges_changed([(node_p, node_q), (node_q, node_p)])
+        return None
 
     def conditional_probability(self, s: bool = True, r: bool = True):
         """ Helper function, computes conditional probability values for edge connectivity computations """
@@ -562,43 +997,116 @@ class LifelongCognitiveMap(CognitiveMapInterface):
             return 1 - self.p_s_given_r
         return 1 - self.p_s_given_not_r
 
-    def remove_bidirectional_edge(self, node_p: PlaceCell, node_q: PlaceCell):
+    def remove_bidirectional_edge(self, node_p: int, node_q: int):
         """ Helper function, removes bidirectional edge between two nodes """
         self.node_network.remove_edge(node_p, node_q)
         self.node_network.remove_edge(node_q, node_p)
-        nodelist = list(self.node_network.nodes)
+        self.edges_changed([(node_p, node_q), (node_q, node_p)])
         self.print_debug(
-            f"deleting edge [{nodelist.index(node_p)}-{nodelist.index(node_q)}]: " +
+            f"deleting edge [{node_p}-{node_q}]: " +
             f"conn {self.node_network[node_q][node_p]['connectivity_probability']}")
 
+    def duplicate_candidates(self) -> [(int, int)]:
+        """ Helper function, returns the pairs of nodes that pass the duplicate test on the current graph.
+            Only adjacent nodes with a sufficient degree are considered, optionally prefiltered by distance and
+            place cell firing. Common neighbors of the remaining pairs are counted with a sparse row product of
+            the adjacency matrix.
+
+        returns:
+        [(int, int)] -- pairs (node_p, node_q) where node_p is a duplicate of node_q, in node order
+        """
+        from scipy import sparse
+
+        nodes = list(self.node_network.nodes)
+        if len(nodes) == 0:
+            return []
+        adjacency = sparse.csr_matrix(nx.to_scipy_sparse_array(self.node_network, nodelist=nodes, weight=None,
+                                                               format="csr"))
+        degree = np.asarray(adjacency.sum(axis=1)).ravel()
+
+        # node_q -> node_p edges between nodes of a sufficient degree
+        q_idx, p_idx = adjacency.nonzero()
+        keep = ((p_idx != q_idx) & (degree[p_idx] >= self.min_node_degree_for_deletion) &
+                (degree[q_idx] >= self.min_node_degree_for_deletion))
+        p_idx, q_idx = p_idx[keep], q_idx[keep]
+
+        if self.max_distance_for_deletion is not None and len(p_idx) > 0:
+            coordinates = np.array([np.asarray(self.place_cells[node].env_coordinates, dtype=float)[:2]
+                                    for node in nodes])
+            keep = np.linalg.norm(coordinates[p_idx] - coordinates[q_idx], axis=1) <= self.max_distance_for_deletion
+            p_idx, q_idx = p_idx[keep], q_idx[keep]
+
+        if self.min_firing_for_deletion is not None and len(p_idx) > 0:
+            keep = np.array([self.place_cells[nodes[p]].compute_firing(self.place_cells[nodes[q]].gc_connections)
+                             >= self.min_firing_for_deletion for p, q in zip(p_idx, q_idx)], dtype=bool)
+            p_idx, q_idx = p_idx[keep], q_idx[keep]
+
+        if len(p_idx) == 0:
+            return []
+        common = np.asarray(adjacency[p_idx].multiply(adjacency[q_idx]).sum(axis=1)).ravel()
+        keep = ((common >= degree[p_idx] - self.max_number_unique_neighbors_for_deletion) &
+                (common >= degree[q_idx] - self.max_number_unique_neighbors_for_deletion))
+        order = np.lexsort((q_idx[keep], p_idx[keep]))
+        return [(nodes[p_idx[keep][i]], nodes[q_idx[keep][i]]) for i in order]
+
+    def passes_duplicate_prefilters(self, node_p: int, node_q: int) -> bool:
+        """ Helper function, applies the distance and firing prefilters of duplicate_candidates to one pair """
+        if self.max_distance_for_deletion is not None:
+            distance = np.linalg.norm(np.asarray(self.place_cells[node_p].env_coordinates, dtype=float)[:2] -
+                                      np.asarray(self.place_cells[node_q].env_coordinates, dtype=float)[:2])
+            if distance > self.max_distance_for_deletion:
+                return False
+        if self.min_firing_for_deletion is not None:
+            firing = self.place_cells[node_p].compute_firing(self.place_cells[node_q].gc_connections)
+            if firing < self.min_firing_for_deletion:
+                return False
+        return True
+
     def deduplicate_nodes(self):
         """ Helper function, performs node cleanup. If nodes have too many common neighbors,
             they are considered duplicates.
         """
         nodes = list(self.node_network.nodes)
+        position = {node: i for i, node in enumerate(nodes)}
         deleted = []
+        deleted_set = set()
 
-        def skip_pair(node_p: PlaceCell, node_q: PlaceCell):
-            return (node_p in deleted or node_q in deleted or node_q == node_p or
+        def skip_pair(node_p: int, node_q: int):
+            return (node_p in deleted_set or node_q in deleted_set or node_q == node_p or
                     node_q not in self.node_network or node_p not in self.node_network or
                     node_p not in self.node_network[node_q])
 
-        for node_p in nodes:
-            for node_q in nodes:
-                if skip_pair(node_p, node_q):
-                    continue
-                if self.are_duplicates(node_p, node_q):
-                    self.print_debug(f"Nodes {nodes.index(node_p)} and {nodes.index(node_q)} are duplicates, " +
-                                     f"deleting {nodes.index(node_p)}")
-                    for neighbor in self.node_network[node_p]:
-                        if neighbor not in self.node_network[node_q] and neighbor != node_q:
-                            edge_attributes_dict = self.node_network.edges[node_p, neighbor]
-                            self.add_bidirectional_edge_to_map_no_weight(node_q, neighbor, **edge_attributes_dict)
-                    deleted.append(node_p)
+        # pairs are checked in node order on the changing graph, like a search over all pairs. A merge changes the
+        # neighborhoods of node_q and of the neighbors it gained, their pairs later in the order are queued again
+        pending = [(position[p], position[q], p, q) for p, q in self.duplicate_candidates()]
+        heapq.heapify(pending)
+        queued = {(p, q) for _, _, p, q in pending}
+        while pending:
+            i, j, node_p, node_q = heapq.heappop(pending)
+            if skip_pair(node_p, node_q) or not self.are_duplicates(node_p, node_q):
+                continue
+            self.print_debug(f"Nodes {node_p} and {node_q} are duplicates, deleting {node_p}")
+            changed = {node_q}
+            for neighbor in list(self.node_network[node_p]):
+                if neighbor not in self.node_network[node_q] and neighbor != node_q:
+                    edge_attributes_dict = self.node_network.edges[node_p, neighbor]
+                    self.add_bidirectional_edge_to_map_no_weight(node_q, neighbor, **edge_attributes_dict)
+                    changed.add(neighbor)
+            deleted.append(node_p)
+            deleted_set.add(node_p)
+
+            for node in changed:
+                pairs = ([(node, other) for other in self.node_network.predecessors(node)] +
+                         [(other, node) for other in self.node_network.successors(node)])
+                for p, q in pairs:
+                    if ((position[p], position[q]) > (i, j) and (p, q) not in queued and
+                            self.passes_duplicate_prefilters(p, q)):
+                        queued.add((p, q))
+                        heapq.heappush(pending, (position[p], position[q], p, q))
         for node in deleted:
-            self.node_network.remove_node(node)
+            self.remove_node_from_map(node)
 
-    def are_duplicates(self, node_p: PlaceCell, node_q: PlaceCell):
+    def are_duplicates(self, node_p: int, node_q: int):
         """ Helper function, checks if two nodes are duplicates of each other """
         set_p = set(self.node_network[node_p])
         set_q = set(self.node_network[node_q])
@@ -615,19 +1123,75 @@ class LifelongCognitiveMap(CognitiveMapInterface):
         if not self.remove_nodes:
             self.deduplicate_nodes()
 
-    def add_and_connect_node(self, pc: PlaceCell):
+    def add_and_connect_node(self, pc: PlaceCell) -> int:
         """ Helper function. Adds new node to the map and edges to adjacent nodes with standard parameters  """
-        self.add_node_to_map(pc)
-        for node in self.node_network.nodes:
-            if node != pc:
-                reachable, weight = self.reach_estimator.get_reachability(node, pc)
-                if reachable:
-                    connectivity_probability = self.reach_estimator.get_connectivity_probability(weight)
-                    self.add_bidirectional_edge_to_map(pc, node,
-                                                       sample_normal(1 - weight, self.sigma),
-                                                       connectivity_probability=connectivity_probability,
-                                                       mu=1 - weight,
-                                                       sigma=self.sigma)
+        candidates = self.get_candidate_nodes_at(pc.env_coordinates, radius=self.candidate_radius,
+                                                 k=self.candidate_k)
+        weights = self.reach_estimator.predict_reachability_pairs([(self.place_cells[q], pc) for q in candidates])
+        new_node = self.add_node_to_map(pc)
+        self._connect_new_node(new_node, candidates, weights)
+        return new_node
+
+    def connect_partitions(self, partition_of: dict):
+        """ Adds edges between nodes of different partitions, e.g. maps built by different exploration workers.
+            The reachability of all candidate pairs across partitions is evaluated in one batched call.
+
+        arguments:
+        partition_of: dict -- node -> partition, nodes of the same partition are not connected
+        """
+        pairs = []
+        for p in self.node_network.nodes:
+            for q in self.get_candidate_nodes(p, radius=self.candidate_radius, k=self.candidate_k):
+                if (p < q and partition_of.get(p) != partition_of.get(q) and
+                        not self.node_network.has_edge(p, q)):
+                    pairs.append((p, q))
+        self.print_debug(f"connecting partitions, evaluating {len(pairs)} pairs")
+        weights = self.reach_estimator.predict_reachability_pairs(
+            [(self.place_cells[q], self.place_cells[p]) for p, q in pairs])
+        for (p, q), weight in zip(pairs, weights):
+            self._connect_new_node(p, [q], [weight])
+
+    def merge_or_add_node(self, pc: PlaceCell) -> (bool, int):
+        """ Inserts a new place cell into the map. Evaluates the reachability from the place cell to all candidate
+            nodes and back in one batched call. If the place cell is the same as one of the candidates it is merged,
+            otherwise it is added as a new node connected to the reachable candidates.
+
+        arguments:
+        pc: PlaceCell -- new place cell
+
+        returns:
+        bool -- True if the place cell was merged with an existing node
+        int  -- id of the new node, None if merged
+        """
+        candidates = self.get_candidate_nodes_at(pc.env_coordinates, radius=self.candidate_radius,
+                                                 k=self.candidate_k, calls_per_candidate=2)
+        pairs = [(pc, self.place_cells[q]) for q in candidates] + [(self.place_cells[q], pc) for q in candidates]
+        factors = list(self.reach_estimator.predict_reachability_pairs(pairs))
+        forward, reverse = factors[:len(candidates)], factors[len(candidates):]
+
+        if any(self.reach_estimator.pass_threshold(factor, self.reach_estimator.threshold_same)
+               for factor in forward):
+            return True, None
+        new_node = self.add_node_to_map(pc)
+        self._connect_new_node(new_node, candidates, reverse)
+        return False, new_node
+
+    def _connect_new_node(self, new_node: int, candidates: [int], weights: [float]):
+        """ Helper function, adds edges with standard parameters between a new node and the reachable candidates
+
+        arguments:
+        new_node: int     -- node that was added to the map
+        candidates: [int] -- candidate nodes
+        weights: [float]  -- reachability factors from the candidates to the new node
+        """
+        for node, weight in zip(candidates, weights):
+            if self.reach_estimator.pass_threshold(weight, self.reach_estimator.threshold_reachable):
+                connectivity_probability = self.reach_estimator.get_connectivity_probability(weight)
+                self.add_bidirectional_edge_to_map(new_node, node,
+                                                   sample_normal(1 - weight, self.sigma),
+                                                   connectivity_probability=connectivity_probability,
+                                                   mu=1 - weight,
+                                                   sigma=self.sigma)
 
 
 if __name__ == "__main__":
@@ -646,6 +1210,7 @@ if __name__ == "__main__":
     # Select the version of the cognitive map to use
     cm = LifelongCognitiveMap(reachability_estimator=re, load_data_from=map_filename)
     cm.draw()
+    print("path statistics:", cm.get_sparse_graph().path_statistics())
 
     dt = 1e-2
     env = PybulletEnvironment(False, dt, env_model, "analytical", build_data_set=True)
@@ -663,14 +1228,14 @@ if __name__ == "__main__":
         ax.axes.get_xaxis().set_visible(False)
         ax.axes.get_yaxis().set_visible(False)
 
-        ax.imshow(start.observations[-1].transpose(1, 2, 0))
+        ax.imshow(cm.get_place_cell(start).observations[-1].transpose(1, 2, 0))
         ax = fig.add_subplot(1, 2, 2)
         ax.axes.get_xaxis().set_visible(False)
         ax.axes.get_yaxis().set_visible(False)
 
-        ax.imshow(finish.observations[-1].transpose(1, 2, 0))
+        ax.imshow(cm.get_place_cell(finish).observations[-1].transpose(1, 2, 0))
 
         plt.show()
         plt.close()
 
-        plot_grid_cell(start.gc_connections, finish.gc_connections)
+        plot_grid_cell(cm.get_place_cell(start).gc_connections, cm.get_place_cell(finish).gc_connections)
@@ -0,0 +1,267 @@
+""" Persistence of cognitive maps.
+
+    Compact format: a snapshot is a folder containing
+        topology.npz   -- CSR adjacency (indptr, indices), node coordinates and one column per numeric or boolean
+                          edge attribute, other edge attributes are pickled per edge
+        place_cells/   -- place cell store, one .npy file per place cell attribute with one row per node
+
+    Loading only reads the topology. Place cells are StoredPlaceCell objects that read their grid cell connections,
+    observations and images from the memory-mapped store on first access, so planning a path does not touch them.
+
+    Pickle format: the graph and the place cell table are pickled into one file. This replaces
+    networkx.write_gpickle/read_gpickle, which are not available in networkx 3. Snapshots with place cells as
+    graph nodes are converted to integer node ids on load.
+
+    Nodes of the graph are integer ids, the place cells are kept in a separate table: node id -> PlaceCell.
+"""
+import os
+import pickle
+
+import networkx as nx
+import numpy as np
+
+from system.bio_model.place_cell_model import PlaceCell
+
+compact_extension = ".cmap"
+
+
+class PlaceCellStore:
+    def __init__(self, directory: str):
+        """ Place cell attributes stored as one .npy file per attribute, rows are read on demand
+
+        arguments:
+        directory: str -- folder of the store
+        """
+        self.directory = directory
+        self.arrays = {}
+
+    def _array(self, name: str):
+        """ Helper function, opens the file of an attribute memory-mapped, falls back to pickled object arrays """
+        if name not in self.arrays:
+            filepath = os.path.join(self.directory, name + ".npy")
+            try:
+                self.arrays[name] = np.load(filepath, mmap_mode="r")
+            except ValueError:
+                self.arrays[name] = np.load(filepath, allow_pickle=True)
+        return self.arrays[name]
+
+    def read(self, name: str, index: int):
+        """ Returns the value of the attribute of the place cell with the given index """
+        if name == "image" and not self._array("has_image")[index]:
+            return None
+        if name == "head_direction":
+            value = float(self._array("head_directions")[index])
+            return None if np.isnan(value) else value
+        value = self._array({"image": "images"}.get(name, name))[index]
+        return np.array(value)
+
+    @staticmethod
+    def write(directory: str, place_cells: [PlaceCell]):
+        """ Writes the attributes of the place cells into a new store """
+        os.makedirs(directory, exist_ok=True)
+
+        def save(name, values):
+            try:
+                array = np.array(values)
+            except ValueError:
+                array = np.empty(len(values), dtype=object)
+                array[:] = values
+            # write to a new file and replace the old one, so stores memory-mapping the old file stay valid
+            filepath = os.path.join(directory, name + ".npy")
+            np.save(filepath + ".tmp.npy", array, allow_pickle=array.dtype == object)
+            os.replace(filepath + ".tmp.npy", filepath)
+
+        save("gc_connections", [np.asarray(pc.gc_connections) for pc in place_cells])
+        save("observations", [np.asarray(pc.observations) for pc in place_cells])
+
+        images = [pc.image for pc in place_cells]
+        has_image = [image is not None for image in images]
+        save("has_image", has_image)
+        if any(has_image):
+            blank = np.zeros_like(np.asarray(images[has_image.index(True)]))
+            save("images", [np.asarray(image) if image is not None else blank for image in images])
+        else:
+            save("images", np.zeros((len(place_cells), 0)))
+        save("head_directions", np.array([pc.head_direction if pc.head_direction is not None else np.nan
+                                          for pc in place_cells], dtype=float))
+
+
+class StoredPlaceCell(PlaceCell):
+    # attributes that are read from the place cell store on first access
+    lazy_attributes = ("gc_connections", "observations", "image", "head_direction")
+
+    def __init__(self, store: PlaceCellStore, index: int, coordinates):
+        """ Place cell of a compact cognitive map snapshot
+
+        arguments:
+        store: PlaceCellStore -- store containing the attributes of the place cell
+        index: int            -- row of the place cell in the store
+        coordinates           -- [x, y] coordinates of the place cell
+        """
+        self.store = store
+        self.store_index = index
+        self.env_coordinates = coordinates
+        self.plotted_found = [False, False]
+        self.egocentric_coordinates = np.array([0.0, 0.0])
+        self.image_descriptor = None
+
+    def __getattr__(self, name):
+        store = self.__dict__.get("store")
+        if store is None or name not in StoredPlaceCell.lazy_attributes:
+            raise AttributeError(name)
+        value = store.read(name, self.store_index)
+        setattr(self, name, value)
+        return value
+
+    def __getstate__(self):
+        # a pickled place cell does not depend on the store
+        state = dict(self.__dict__)
+        for name in StoredPlaceCell.lazy_attributes:
+            state[name] = getattr(self, name)
+        state.pop("store", None)
+        return state
+
+
+def is_compact(filepath: str) -> bool:
+    """ Returns true if the snapshot is stored in the compact format """
+    return filepath.endswith(compact_extension)
+
+
+def save_compact(graph: nx.DiGraph, place_cells: dict, directory: str):
+    """ Stores the graph as CSR adjacency with edge attribute columns and a place cell store
+
+    arguments:
+    graph: nx.DiGraph -- cognitive map graph with integer node ids
+    place_cells: dict -- node id -> PlaceCell
+    directory: str    -- folder of the snapshot
+    """
+    os.makedirs(directory, exist_ok=True)
+    nodes = list(graph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    coordinates = np.array([np.asarray(place_cells[node].env_coordinates, dtype=float)[:2] for node in nodes])
+    coordinates = coordinates.reshape(-1, 2)
+
+    # numeric and boolean edge attributes are stored as columns, all other attributes as pickled objects
+    numeric_names, bool_names, object_names = set(), set(), set()
+    for _, _, data in graph.edges(data=True):
+        for name, value in data.items():
+            if isinstance(value, (bool, np.bool_)):
+                bool_names.add(name)
+            elif isinstance(value, (int, float, np.number)):
+                numeric_names.add(name)
+            else:
+                object_names.add(name)
+    # attributes with values of different kinds are stored as objects
+    object_names |= (numeric_names & bool_names)
+    numeric_names = sorted(numeric_names - object_names)
+    bool_names = sorted(bool_names - object_names)
+
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indices = []
+    columns = {name: [] for name in numeric_names + bool_names}
+    objects = []
+    for i, node in enumerate(nodes):
+        for neighbor, data in graph[node].items():
+            indices.append(index[neighbor])
+            for name in numeric_names:
+                columns[name].append(data.get(name, np.nan))
+            for name in bool_names:
+                columns[name].append(int(data[name]) if name in data else -1)  # -1: attribute not set
+            objects.append({name: data[name] for name in object_names if name in data})
+        indptr[i + 1] = len(indices)
+
+    edge_columns = {"edge_" + name: np.array(columns[name], dtype=float) for name in numeric_names}
+    edge_columns.update({"edge_" + name: np.array(columns[name], dtype=np.int8) for name in bool_names})
+    if object_names:
+        edge_columns["edge_objects"] = np.array(objects, dtype=object)
+    np.savez(os.path.join(directory, "topology.npz"),
+             indptr=indptr,
+             indices=np.array(indices, dtype=np.int64),
+             node_ids=np.array(nodes, dtype=np.int64),
+             coordinates=coordinates,
+             edge_attributes=np.array(numeric_names, dtype=str),
+             edge_bool_attributes=np.array(bool_names, dtype=str),
+             **edge_columns)
+    PlaceCellStore.write(os.path.join(directory, "place_cells"), [place_cells[node] for node in nodes])
+
+
+def load_topology(directory: str) -> dict:
+    """ Returns the arrays of the topology of a compact snapshot without touching the place cell store """
+    # edge attributes that are neither numeric nor boolean are pickled
+    with np.load(os.path.join(directory, "topology.npz"), allow_pickle=True) as data:
+        return {name: data[name] for name in data.files}
+
+
+def load_compact(directory: str) -> (nx.DiGraph, dict):
+    """ Loads a compact snapshot, place cell attributes are read lazily from the store
+
+    arguments:
+    directory: str -- folder of the snapshot
+
+    returns:
+    nx.DiGraph -- cognitive map graph with integer node ids
+    dict       -- node id -> StoredPlaceCell
+    """
+    topology = load_topology(directory)
+    store = PlaceCellStore(os.path.join(directory, "place_cells"))
+    coordinates = topology["coordinates"]
+    nodes = [int(node) for node in topology.get("node_ids", np.arange(len(coordinates)))]
+    place_cells = {node: StoredPlaceCell(store, i, coordinates[i]) for i, node in enumerate(nodes)}
+    attribute_names = [str(name) for name in topology["edge_attributes"]]
+    bool_names = [str(name) for name in topology.get("edge_bool_attributes", [])]
+    objects = topology.get("edge_objects")
+
+    graph = nx.DiGraph()
+    for node in nodes:
+        graph.add_node(node, pos=tuple(place_cells[node].env_coordinates))
+    indptr, indices = topology["indptr"], topology["indices"]
+    for i, node in enumerate(nodes):
+        for e in range(indptr[i], indptr[i + 1]):
+            data = {name: float(topology["edge_" + name][e]) for name in attribute_names
+                    if not np.isnan(topology["edge_" + name][e])}
+            data.update({name: bool(topology["edge_" + name][e]) for name in bool_names
+                         if topology["edge_" + name][e] >= 0})
+            if objects is not None:
+                data.update(objects[e])
+            graph.add_edge(node, nodes[indices[e]], **data)
+    return graph, place_cells
+
+
+def relabel_place_cell_graph(graph: nx.DiGraph) -> (nx.DiGraph, dict):
+    """ Converts a graph with place cells as nodes to integer node ids in node order """
+    place_cells = dict(enumerate(graph.nodes))
+    mapping = {pc: node for node, pc in place_cells.items()}
+    graph = nx.relabel_nodes(graph, mapping, copy=True)
+    for node, pc in place_cells.items():
+        graph.nodes[node]["pos"] = tuple(pc.env_coordinates)
+    return graph, place_cells
+
+
+def save_pickle(graph: nx.DiGraph, place_cells: dict, filepath: str):
+    """ Pickles the graph and the place cell table into one file """
+    with open(filepath, "wb") as f:
+        pickle.dump({"graph": graph, "place_cells": place_cells}, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_pickle(filepath: str) -> (nx.DiGraph, dict):
+    """ Loads a snapshot pickled by save_pickle, graphs written by networkx.write_gpickle are converted """
+    with open(filepath, "rb") as f:
+        data = pickle.load(f)
+    if isinstance(data, nx.DiGraph):
+        return relabel_place_cell_graph(data)
+    return data["graph"], data["place_cells"]
+
+
+def save_graph(graph: nx.DiGraph, place_cells: dict, filepath: str):
+    """ Stores the graph in the compact format if the filename ends with .cmap, pickled otherwise """
+    if is_compact(filepath):
+        save_compact(graph, place_cells, filepath)
+    else:
+        save_pickle(graph, place_cells, filepath)
+
+
+def load_graph(filepath: str) -> (nx.DiGraph, dict):
+    """ Loads a snapshot stored by save_graph, returns the graph and the place cell table """
+    if is_compact(filepath):
+        return load_compact(filepath)
+    return load_pickle(filepath)
@@ -0,0 +1,143 @@
+""" Two-level planning over the cognitive map.
+
+    Nodes are partitioned into square regions by their coordinates. Regions are connected in an abstract region
+    graph wherever an edge of the map crosses from one region into another; the nodes of such edges are the
+    portals of a region. A path is planned coarse-to-fine: first a route through the region graph, then a path
+    through the map that may only use nodes of the regions on that route. The partition and the region graph are
+    updated with every added or removed node and edge, so no clustering has to be recomputed as the map grows.
+"""
+import heapq
+import math
+from collections import Counter
+
+import networkx as nx
+
+
+class RegionHierarchy:
+    def __init__(self, graph: nx.DiGraph, region_size: float = 3.0, weight: str = None):
+        """ Spatial partition of the map into regions and the abstract graph between them
+
+        arguments:
+        graph: nx.DiGraph  -- graph of the cognitive map, nodes need a pos attribute
+        region_size: float -- side length of a region in meters
+        weight: str        -- edge attribute used as cost, None: every edge costs 1
+        """
+        self.graph = graph
+        self.region_size = region_size
+        self.weight = weight
+        self.region_of = {}  # node -> region
+        self.members = {}  # region -> nodes
+        self.crossing_edges = {}  # node -> edges of the node between different regions
+        self.region_edges = Counter()  # (region, region) -> number of map edges between the regions
+        self.nr_fallbacks = 0  # number of queries that needed a search over the whole map
+        self.rebuild()
+
+    def region(self, coordinates) -> (int, int):
+        return math.floor(coordinates[0] / self.region_size), math.floor(coordinates[1] / self.region_size)
+
+    def rebuild(self):
+        """ Partitions all nodes of the graph """
+        self.region_of = {}
+        self.members = {}
+        self.crossing_edges = {}
+        self.region_edges = Counter()
+        for node, pos in self.graph.nodes(data="pos"):
+            self.add_node(node, pos)
+        for p, q in self.graph.edges:
+            self.edge_changed(p, q)
+
+    def add_node(self, node: int, coordinates):
+        region = self.region(coordinates)
+        self.region_of[node] = region
+        self.members.setdefault(region, set()).add(node)
+
+    def remove_node(self, node: int):
+        """ Removes a node and its crossing edges, the node may already be removed from the graph """
+        for edge in list(self.crossing_edges.get(node, ())):
+            self._remove_crossing(edge)
+        self.crossing_edges.pop(node, None)
+        region = self.region_of.pop(node, None)
+        if region is not None:
+            self.members[region].discard(node)
+            if not self.members[region]:
+                del self.members[region]
+
+    def _remove_crossing(self, edge: (int, int)):
+        """ Helper function, removes an edge between two regions from the region graph """
+        p, q = edge
+        self.region_edges[(self.region_of[p], self.region_of[q])] -= 1
+        if self.region_edges[(self.region_of[p], self.region_of[q])] <= 0:
+            del self.region_edges[(self.region_of[p], self.region_of[q])]
+        self.crossing_edges[p].discard(edge)
+        self.crossing_edges[q].discard(edge)
+
+    def edge_changed(self, p: int, q: int):
+        """ Updates the region graph after the edge p -> q was added or removed """
+        if p not in self.region_of or q not in self.region_of or self.region_of[p] == self.region_of[q]:
+            return
+        edge = (p, q)
+        crossing = edge in self.crossing_edges.get(p, ())
+        if self.graph.has_edge(p, q) and not crossing:
+            self.region_edges[(self.region_of[p], self.region_of[q])] += 1
+            self.crossing_edges.setdefault(p, set()).add(edge)
+            self.crossing_edges.setdefault(q, set()).add(edge)
+        elif not self.graph.has_edge(p, q) and crossing:
+            self._remove_crossing(edge)
+
+    def portals(self, region) -> set:
+        """ Returns the nodes of a region that have an edge into another region """
+        return {node for node in self.members.get(region, ()) if self.crossing_edges.get(node)}
+
+    def region_route(self, start_region, goal_region) -> list:
+        """ Returns the shortest route of regions from start to goal region (in region hops), None if none exists """
+        successors = {}
+        for (a, b) in self.region_edges:
+            successors.setdefault(a, []).append(b)
+        previous = {start_region: None}
+        heap = [(0, start_region)]
+        while heap:
+            distance, region = heapq.heappop(heap)
+            if region == goal_region:
+                route = [region]
+                while previous[route[-1]] is not None:
+                    route.append(previous[route[-1]])
+                return list(reversed(route))
+            for successor in successors.get(region, ()):
+                if successor not in previous:
+                    previous[successor] = region
+                    heapq.heappush(heap, (distance + 1, successor))
+        return None
+
+    def cost(self, p: int, q: int, data: dict) -> float:
+        if self.weight is None:
+            return 1.0
+        return max(float(data.get(self.weight, 1.0)), 0.0)
+
+    def plan(self, start: int, goal: int) -> [int]:
+        """ Plans a path coarse-to-fine. The path is searched among the nodes of the regions on the region route,
+            if none is found there the whole map is searched. The path is not necessarily the shortest one.
+
+        returns:
+        [int] -- path from start to goal, None if no path exists
+        """
+        if start not in self.graph or goal not in self.graph:
+            return None
+        route = self.region_route(self.region_of[start], self.region_of[goal])
+        if route is None:
+            # every path of the map is mapped to a route of regions
+            return None
+        allowed = set(route)
+
+        def cost(p, q, data):
+            return self.cost(p, q, data) if self.region_of.get(q) in allowed else None
+
+        try:
+            return nx.dijkstra_path(self.graph, start, goal, weight=cost)
+        except nx.NetworkXNoPath:
+            pass
+        # the regions of the route are not connected through their own nodes
+        self.nr_fallbacks += 1
+        try:
+            return nx.dijkstra_path(self.graph, start, goal, weight=self.cost)
+        except nx.NetworkXNoPath:
+            return None
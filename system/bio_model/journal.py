@@ -0,0 +1,63 @@
+""" Append-only journal of changes, used for incremental saves of the cognitive map.
+
+    Changes are recorded in memory and appended to the journal file on flush, one pickled record after the other.
+    A snapshot together with its journal describes the current state; loading replays the journal on top of the
+    snapshot. Writing a new snapshot (compaction) clears the journal. A record that was cut off by a crash while
+    being written is ignored when the journal is read.
+"""
+import os
+import pickle
+
+
+class Journal:
+    def __init__(self, filepath: str):
+        """ Append-only journal file
+
+        arguments:
+        filepath: str -- file the records are appended to
+        """
+        self.filepath = filepath
+        self.pending = []  # records not yet written to the file
+        self.nr_written = len(self.read())
+
+    def __len__(self):
+        return self.nr_written + len(self.pending)
+
+    def record(self, *entry):
+        """ Records a change, entries are tuples starting with the name of the operation """
+        self.pending.append(entry)
+
+    def flush(self):
+        """ Appends all pending records to the journal file """
+        if not self.pending:
+            return
+        with open(self.filepath, "ab") as f:
+            for entry in self.pending:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        self.nr_written += len(self.pending)
+        self.pending = []
+
+    def read(self) -> list:
+        """ Returns all records of the journal file in the order they were written """
+        records = []
+        if not os.path.exists(self.filepath):
+            return records
+        with open(self.filepath, "rb") as f:
+            while True:
+                try:
+                    records.append(pickle.load(f))
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                    # incomplete record at the end of the file
+                    break
+        return records
+
+    def clear(self):
+        """ Removes the journal file and all pending records, called after a new snapshot was written """
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+        self.pending = []
+        self.nr_written = 0
@@ -0,0 +1,194 @@
+""" Cache of shortest path trees rooted at navigation goals.
+
+    A tree stores for every node its distance to the goal and the next node on the shortest path, so a path to
+    a cached goal is read off the tree in O(path length). When edges of the map change, the trees are repaired
+    incrementally: an edge that becomes cheaper propagates the decrease to the predecessors of its source,
+    an edge that becomes more expensive or is removed only invalidates the nodes whose route used it and
+    recomputes their distances from the unaffected rest of the tree.
+"""
+import heapq
+import math
+from collections import OrderedDict
+
+import networkx as nx
+
+
+class ShortestPathTree:
+    def __init__(self, graph: nx.DiGraph, goal: int, weight: str = None):
+        """ Reverse shortest path tree of all nodes to the goal, computed with Dijkstra
+
+        arguments:
+        graph: nx.DiGraph -- graph of the cognitive map
+        goal: int         -- root of the tree
+        weight: str       -- edge attribute used as cost, None: every edge costs 1
+        """
+        self.graph = graph
+        self.goal = goal
+        self.weight = weight
+        self.distance = {}  # node -> cost of the shortest path to the goal
+        self.next_hop = {}  # node -> next node on the shortest path to the goal
+        self.children = {}  # node -> nodes whose next hop is the node
+        self.compute()
+
+    def cost(self, p: int, q: int) -> float:
+        """ Returns the cost of the edge p -> q, infinity if it does not exist """
+        data = self.graph.get_edge_data(p, q)
+        if data is None:
+            return math.inf
+        if self.weight is None:
+            return 1.0
+        return max(float(data.get(self.weight, 1.0)), 0.0)
+
+    def _set_next_hop(self, node: int, next_node: int):
+        """ Helper function, updates the next hop of a node and the children of the next hops """
+        old = self.next_hop.pop(node, None)
+        if old is not None:
+            self.children[old].discard(node)
+        if next_node is not None:
+            self.next_hop[node] = next_node
+            self.children.setdefault(next_node, set()).add(node)
+
+    def _dijkstra(self, heap: list, allowed: set = None):
+        """ Helper function, settles the nodes of the heap and relaxes the edges towards them
+
+        arguments:
+        heap: list   -- (distance, node, next hop) entries
+        allowed: set -- if given: only distances of these nodes are changed
+        """
+        while heap:
+            distance, node, next_node = heapq.heappop(heap)
+            if distance > self.distance.get(node, math.inf):
+                continue
+            for predecessor in self.graph.predecessors(node):
+                if allowed is not None and predecessor not in allowed:
+                    continue
+                candidate = distance + self.cost(predecessor, node)
+                if candidate < self.distance.get(predecessor, math.inf):
+                    self.distance[predecessor] = candidate
+                    self._set_next_hop(predecessor, node)
+                    heapq.heappush(heap, (candidate, predecessor, node))
+
+    def compute(self):
+        """ Computes the tree from scratch """
+        self.distance = {}
+        self.next_hop = {}
+        self.children = {}
+        if self.goal not in self.graph:
+            return
+        self.distance[self.goal] = 0.0
+        self._dijkstra([(0.0, self.goal, None)])
+
+    def path(self, start: int) -> [int]:
+        """ Returns the shortest path from start to the goal, None if the goal is not reachable """
+        if start not in self.distance:
+            return None
+        path = [start]
+        while path[-1] != self.goal:
+            path.append(self.next_hop[path[-1]])
+        return path
+
+    def subtree(self, node: int) -> set:
+        """ Returns the node and all nodes whose shortest path passes through it """
+        nodes = set()
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if n in nodes:
+                continue
+            nodes.add(n)
+            stack.extend(self.children.get(n, ()))
+        return nodes
+
+    def _repair(self, invalid: set):
+        """ Helper function, recomputes the distances of the invalidated nodes from the rest of the tree """
+        for node in invalid:
+            self.distance.pop(node, None)
+            self._set_next_hop(node, None)
+        heap = []
+        for node in invalid:
+            if node not in self.graph:
+                continue
+            best, best_next = math.inf, None
+            for successor in self.graph.successors(node):
+                if successor in invalid or successor not in self.distance:
+                    continue
+                candidate = self.cost(node, successor) + self.distance[successor]
+                if candidate < best:
+                    best, best_next = candidate, successor
+            if best_next is not None:
+                self.distance[node] = best
+                self._set_next_hop(node, best_next)
+                heap.append((best, node, best_next))
+        heapq.heapify(heap)
+        self._dijkstra(heap, allowed=invalid)
+
+    def edge_changed(self, p: int, q: int):
+        """ Repairs the tree after the edge p -> q was added, removed or changed its cost """
+        if self.goal not in self.graph:
+            self.compute()
+            return
+        cost = self.cost(p, q)
+        if self.next_hop.get(p) == q and cost > self.distance[p] - self.distance[q]:
+            # the route of p and its subtree became more expensive
+            self._repair(self.subtree(p))
+        elif q in self.distance and cost + self.distance[q] < self.distance.get(p, math.inf):
+            self.distance[p] = cost + self.distance[q]
+            self._set_next_hop(p, q)
+            self._dijkstra([(self.distance[p], p, q)])
+
+    def node_removed(self, node: int):
+        """ Repairs the tree after the node and its edges were removed """
+        if node == self.goal:
+            self.compute()
+            return
+        invalid = self.subtree(node)
+        self._repair(invalid)
+        self.children.pop(node, None)
+
+
+class ShortestPathTreeCache:
+    def __init__(self, graph: nx.DiGraph, weight: str = None, max_trees: int = 32):
+        """ Least recently used cache of shortest path trees, one per goal
+
+        arguments:
+        graph: nx.DiGraph -- graph of the cognitive map
+        weight: str       -- edge attribute used as cost, None: every edge costs 1
+        max_trees: int    -- maximal number of cached goals
+        """
+        self.graph = graph
+        self.weight = weight
+        self.max_trees = max_trees
+        self.trees = OrderedDict()  # goal -> ShortestPathTree
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.trees = OrderedDict()
+
+    def tree(self, goal: int) -> ShortestPathTree:
+        """ Returns the tree rooted at the goal, computes it if it is not cached """
+        if goal in self.trees:
+            self.hits += 1
+            self.trees.move_to_end(goal)
+            return self.trees[goal]
+        self.misses += 1
+        tree = ShortestPathTree(self.graph, goal, weight=self.weight)
+        self.trees[goal] = tree
+        if len(self.trees) > self.max_trees:
+            self.trees.popitem(last=False)
+        return tree
+
+    def path(self, start: int, goal: int) -> [int]:
+        """ Returns the shortest path from start to goal, None if no path exists """
+        if start not in self.graph or goal not in self.graph:
+            return None
+        return self.tree(goal).path(start)
+
+    def edge_changed(self, p: int, q: int):
+        for tree in self.trees.values():
+            tree.edge_changed(p, q)
+
+    def node_removed(self, node: int):
+        self.trees.pop(node, None)
+        for tree in self.trees.values():
+            tree.node_removed(node)
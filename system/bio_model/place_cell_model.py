@@ -29,6 +29,49 @@ def get_path_top():
     return dirname
 
 
+image_descriptor_size = 16  # side length of the grayscale thumbnail used as image descriptor
+
+
+def compute_image_descriptor(image, size=image_descriptor_size):
+    """Computes a compact descriptor of a camera image: a downsampled grayscale thumbnail with values in [0, 1]
+
+    arguments:
+    image -- camera image of shape (h, w, c) or (c, h, w) with 3 (RGB) or 4 (RGBA) channels in [0, 255]
+    size  -- side length of the thumbnail (default 16)
+
+    returns:
+    numpy.ndarray -- flattened thumbnail of length size^2
+    """
+    image = np.asarray(image, dtype=np.float32)
+    if image.shape[0] in (3, 4) and image.shape[-1] not in (3, 4):
+        image = np.transpose(image, (1, 2, 0))  # channel-first observation to channel-last image
+    gray = image[:, :, :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32) / 255.0
+
+    # average over blocks, crop the borders that do not fill a whole block
+    block_h, block_w = gray.shape[0] // size, gray.shape[1] // size
+    gray = gray[:block_h * size, :block_w * size]
+    thumbnail = gray.reshape(size, block_h, size, block_w).mean(axis=(1, 3))
+    return thumbnail.flatten()
+
+
+def get_image_descriptor(pc):
+    """Returns the image descriptor of a place cell, computes it for place cells created without one"""
+    if getattr(pc, "image_descriptor", None) is None and getattr(pc, "image", None) is not None:
+        pc.image_descriptor = compute_image_descriptor(pc.image)
+    return getattr(pc, "image_descriptor", None)
+
+
+def descriptor_matrix(place_cells):
+    """Stacks the image descriptors of the place cells into a matrix of shape (number of cells, descriptor length).
+    Rows of place cells without an image are filled with NaN."""
+    matrix = np.full((len(place_cells), image_descriptor_size ** 2), np.nan, dtype=np.float32)
+    for i, pc in enumerate(place_cells):
+        descriptor = get_image_descriptor(pc)
+        if descriptor is not None:
+            matrix[i] = descriptor
+    return matrix
+
+
 class PlaceCell:
     """Class to keep track of an individual Place Cell"""
 
@@ -44,11 +87,20 @@ class PlaceCell:
         ]  # Was used for debug plotting, of linear lookahea
         
         self.image = image  # from the paper p
+        # compact descriptor of the image, used instead of the raw pixels for comparisons
+        self.image_descriptor = compute_image_descriptor(image) if image is not None else None
         self.head_direction = head_direction #from the paper e 
         self.egocentric_coordinates = np.array([0.0, 0.0])  # MANUEL: from the paper, we need egocentric coordinates
 
 
         self.observations = observations
+        # incremented whenever an attribute read by the reachability estimators is changed in place
+        self.observation_version = 0
+
+    def observation_changed(self):
+        """Marks the place cell as changed, values derived from its observations, coordinates or spikings are
+        recomputed on their next use"""
+        self.observation_version = getattr(self, "observation_version", 0) + 1
 
     def compute_firing(self, s_vectors):
         """Computes firing value based on current grid cell spiking"""
@@ -153,6 +205,8 @@ class PlaceCell:
         """
         for neighbor, rel_move in neighbors:
             self.egocentric_coordinates += rel_move
+        if neighbors:
+            self.observation_changed()
 
 
 class PlaceCellNetwork:
@@ -162,19 +216,35 @@ class PlaceCellNetwork:
         ReachabilityEstimator,
     )
 
-    def __init__(self, reach_estimator: ReachabilityEstimator, from_data=False):
+    def __init__(self, reach_estimator: ReachabilityEstimator, from_data=False, gating_distance=0.0,
+                 gating_angle=0.0):
         """Place Cell Network  of the environment.
 
         arguments:
-        from_data   -- if True: load existing place cells (default False)
-        re_type     -- type of reachability estimator determining whether a new node gets created
-                    see ReachabilityEstimator class for explanation of different types (default distance)
-                    plus additional type "firing" that uses place cell spikings
+        from_data       -- if True: load existing place cells (default False)
+        re_type         -- type of reachability estimator determining whether a new node gets created
+                        see ReachabilityEstimator class for explanation of different types (default distance)
+                        plus additional type "firing" that uses place cell spikings
+        gating_distance -- path-integrated distance the agent has to travel since the last evaluation
+                        before firing is recomputed (default 0, evaluate on every call)
+        gating_angle    -- change of head direction in radians since the last evaluation
+                        that triggers a recomputation of firing (default 0, evaluate on every call)
         """
         self.reach_estimator = reach_estimator
         self.place_cells = []  # array of place cells
         self.edges = {}  # Dictionary to hold edges and relative movements - MANUEL, FROM PAPER
 
+        # movement gating of the firing computation in track_movement
+        self.gating_distance = gating_distance
+        self.gating_angle = gating_angle
+        self.last_firing_values = None  # firing values of the last evaluation, None forces an evaluation
+        self.last_coordinates = None  # coordinates passed to the last call of track_movement
+        self.last_head_direction = None  # head direction at the last evaluation
+        self.distance_since_evaluation = 0.0  # path-integrated displacement since the last evaluation
+        self.nr_evaluations = 0  # number of calls of track_movement that computed firing
+        self.skipped_evaluations = 0  # number of calls of track_movement that reused the last firing
+        self.skipped_renders = 0  # number of calls of track_movement that did not need a camera image
+
         if from_data:
             # Load place cells if wanted
             directory = os.path.join(get_path_top(), "data/pc_model")
@@ -187,10 +257,12 @@ class PlaceCellNetwork:
                 pc = PlaceCell(gc_connection, observations[idx], env_coordinates[idx])
                 self.place_cells.append(pc)
 
-    def create_new_pc(self, gc_connections, obs, coordinates, image, head_direction):
+    def create_new_pc(self, gc_connections, obs, coordinates, image=None, head_direction=None):
         # Consolidate grid cell spiking vectors to matrix of size n^2 x M
         pc = PlaceCell(gc_connections, obs, coordinates, image, head_direction)
         self.place_cells.append(pc)
+        # firing of the cached evaluation no longer covers all place cells
+        self.last_firing_values = None
 
     def in_range(self, reach: [float]) -> bool:
         """Determine whether one value meets the threshold"""
@@ -231,24 +303,75 @@ class PlaceCellNetwork:
         return cell_b in [neighbor for neighbor, _ in self.edges.get(cell_a, [])]
       
 
+    def is_evaluation_due(self, coordinates, head_direction) -> bool:
+        """Decides whether the agent moved or turned enough since the last evaluation to recompute firing
+
+        arguments:
+        coordinates    -- current [x, y] coordinates of the agent
+        head_direction -- current head direction of the agent in radians
+        """
+        if self.last_coordinates is not None:
+            self.distance_since_evaluation += np.linalg.norm(
+                np.array(coordinates) - np.array(self.last_coordinates)
+            )
+        self.last_coordinates = coordinates
+
+        if self.last_firing_values is None or self.last_head_direction is None:
+            return True
+        if self.distance_since_evaluation >= self.gating_distance:
+            return True
+        angle_change = (head_direction - self.last_head_direction + np.pi) % (2 * np.pi) - np.pi
+        return abs(angle_change) >= self.gating_angle
+
+    def gating_statistics(self) -> dict:
+        """Returns counters of performed and skipped firing evaluations and camera renders"""
+        return {
+            "evaluations": self.nr_evaluations,
+            "skipped_evaluations": self.skipped_evaluations,
+            "skipped_renders": self.skipped_renders,
+        }
+
 ## add env so we can get the head direction and image from the environment
     def track_movement(self, gc_network, observations, coordinates, env, creation_allowed):
-        """Keeps track of current grid cell firing"""
-        firing_values = self.compute_firing_values(gc_network.gc_modules)
+        """Keeps track of current grid cell firing
 
-        if not creation_allowed:
-            return [firing_values, False]
+        arguments:
+        gc_network       -- grid cell network
+        observations     -- observations of the agent or a function returning them,
+                            only evaluated if a new place cell is created
+        coordinates      -- current [x, y] coordinates of the agent
+        env              -- running PybulletEnvironment
+        creation_allowed -- if True: create a new place cell when no existing one is in range
+
+        returns:
+        [float] -- firing values of all place cells
+        bool    -- indicates if a new place cell was created
+        """
+        head_direction = env.get_agent_head_direction()
+        if not self.is_evaluation_due(coordinates, head_direction):
+            self.skipped_evaluations += 1
+            self.skipped_renders += 1
+            return [list(self.last_firing_values), False]
+
+        firing_values = self.compute_firing_values(gc_network.gc_modules)
+        self.nr_evaluations += 1
+        self.distance_since_evaluation = 0.0
+        self.last_head_direction = head_direction
 
         created_new_pc = False
-        if len(firing_values) == 0 or not self.in_range(firing_values):
-            head_direction = env.get_agent_head_direction()
+        if creation_allowed and (len(firing_values) == 0 or not self.in_range(firing_values)):
+            if callable(observations):
+                observations = observations()
             image = env.get_camera_image()
             self.create_new_pc(
                 gc_network.consolidate_gc_spiking(), observations, coordinates, image, head_direction
             )
             firing_values.append(1)
             created_new_pc = True
+        else:
+            self.skipped_renders += 1
 
+        self.last_firing_values = list(firing_values)
         return [firing_values, created_new_pc]
 
     def compute_firing_values(self, gc_modules, virtual=False, axis=None, plot=False):
@@ -331,12 +454,8 @@ if __name__ == "__main__":
     pod = PhaseOffsetDetectorNetwork(16, 9, 40)
     dt = 1e-2
 
-    fr = list(cognitive_map.node_network.nodes)[
-        random.randint(0, len(list(cognitive_map.node_network.nodes)) - 1)
-    ]
-    to = list(cognitive_map.node_network.nodes)[
-        random.randint(0, len(list(cognitive_map.node_network.nodes)) - 1)
-    ]
+    fr = cognitive_map.get_place_cell(random.choice(list(cognitive_map.node_network.nodes)))
+    to = cognitive_map.get_place_cell(random.choice(list(cognitive_map.node_network.nodes)))
     env = PybulletEnvironment(
         False,
         dt,
@@ -0,0 +1,247 @@
+""" Scaling benchmark of cognitive map and place cell network operations on synthetic maps.
+
+    Synthetic place cells are created along random exploration trajectories with the spacing of place cells of
+    the exploration phase. Their grid codes are bumps on the neural sheets of grid cell modules with
+    geometrically growing spatial periods, as produced by path integration. Reachability is decided by a stub
+    estimator with a controllable cost per pair, so the benchmark measures the map operations themselves.
+
+    Run this file to time node insertion, merging, deduplication, path finding, saving, loading and firing
+    computation for maps of 10^2 to 10^5 nodes. Times per operation and their scaling exponents are printed
+    and stored with a plot of the scaling curves in experiments/scaling.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from system.bio_model.place_cell_model import PlaceCell, PlaceCellNetwork
+from system.bio_model.cognitive_map import LifelongCognitiveMap, sample_normal
+from system.bio_model.cognitive_map_storage import save_graph, load_graph
+from system.controller.reachability_estimator.reachability_estimation import DistanceReachabilityEstimator
+
+
+class StubReachabilityEstimator(DistanceReachabilityEstimator):
+    def __init__(self, cost_per_pair: float = 0.0, cost_per_call: float = 0.0):
+        """ Distance based estimator that spends a given amount of time per evaluated pair and per call,
+            simulating estimators of different cost
+
+        arguments:
+        cost_per_pair: float -- seconds spent per evaluated pair
+        cost_per_call: float -- seconds spent per call of predict_reachability_pairs, e.g. a network invocation
+        """
+        super().__init__()
+        self.cost_per_pair = cost_per_pair
+        self.cost_per_call = cost_per_call
+        self.nr_pairs = 0  # number of evaluated pairs
+        self.nr_calls = 0  # number of batched calls
+
+    def spend(self, seconds: float):
+        """ Helper function, busy waits, sleeping is too coarse for short durations """
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    def predict_reachability(self, start: PlaceCell, goal: PlaceCell) -> float:
+        return self.predict_reachability_pairs([(start, goal)])[0]
+
+    def predict_reachability_pairs(self, pairs: [(PlaceCell, PlaceCell)]) -> [float]:
+        self.nr_pairs += len(pairs)
+        self.nr_calls += 1
+        self.spend(self.cost_per_call + self.cost_per_pair * len(pairs))
+        if len(pairs) == 0:
+            return []
+        return super().predict_reachability_pairs(pairs)
+
+
+def grid_code(coordinates, periods: [float], sheet_size: int, width: float = 0.12) -> np.ndarray:
+    """ Returns the grid cell spiking at the coordinates: one periodic gaussian bump per module
+
+    arguments:
+    coordinates      -- [x, y] location
+    periods: [float] -- spatial period of each module in meters
+    sheet_size: int  -- side length of the neural sheet of a module
+    width: float     -- width of the bump relative to the sheet
+
+    returns:
+    np.ndarray -- spiking of shape (number of modules, sheet_size ** 2)
+    """
+    axis = (np.arange(sheet_size) + 0.5) / sheet_size
+    spiking = np.empty((len(periods), sheet_size ** 2), dtype=np.float32)
+    for m, period in enumerate(periods):
+        phase = np.mod(np.asarray(coordinates, dtype=float) / period, 1.0)
+        dx = np.abs(axis - phase[0])
+        dy = np.abs(axis - phase[1])
+        dx = np.minimum(dx, 1 - dx)
+        dy = np.minimum(dy, 1 - dy)
+        bump = np.exp(-(dx[:, None] ** 2 + dy[None, :] ** 2) / (2 * width ** 2))
+        spiking[m] = bump.ravel()
+    return spiking
+
+
+def generate_place_cells(nr_cells: int, spacing: float = 0.4, nr_modules: int = 6, sheet_size: int = 8,
+                         observation_size: int = 8, seed: int = 0) -> [PlaceCell]:
+    """ Creates place cells along random exploration trajectories in a square arena whose size grows with the
+        number of cells, so that the density of place cells stays constant
+
+    arguments:
+    nr_cells: int         -- number of place cells
+    spacing: float        -- distance between consecutive place cells of a trajectory in meters
+    nr_modules: int       -- number of grid cell modules
+    sheet_size: int       -- side length of the neural sheet of a module (40 in the model, smaller saves memory)
+    observation_size: int -- side length of the synthetic observations
+    seed: int             -- seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    arena = spacing * np.sqrt(nr_cells) * 2
+    periods = 0.3 * 1.42 ** np.arange(nr_modules)
+    place_cells = []
+    position = rng.uniform(0, arena, 2)
+    direction = rng.uniform(0, 2 * np.pi)
+    while len(place_cells) < nr_cells:
+        direction += rng.normal(0, 0.4)
+        step = spacing * np.array([np.cos(direction), np.sin(direction)])
+        if not (0 <= position[0] + step[0] <= arena and 0 <= position[1] + step[1] <= arena):
+            direction += np.pi / 2
+            continue
+        position = position + step
+        observation = rng.integers(0, 255, (1, 3, observation_size, observation_size), dtype=np.uint8)
+        place_cells.append(PlaceCell(grid_code(position, periods, sheet_size), observation, position.copy()))
+    return place_cells
+
+
+def build_map(place_cells: [PlaceCell], estimator: StubReachabilityEstimator, connect_radius: float = 1.0,
+              sigma: float = 0.015) -> LifelongCognitiveMap:
+    """ Creates a lifelong cognitive map of the place cells, nodes closer than connect_radius are connected
+        without evaluating the estimator
+    """
+    cognitive_map = LifelongCognitiveMap(reachability_estimator=estimator, debug=False,
+                                         candidate_radius=connect_radius)
+    nodes = [cognitive_map.add_node_to_map(pc) for pc in place_cells]
+    for p in nodes:
+        for q in cognitive_map.spatial_index.query_radius(cognitive_map.place_cells[p].env_coordinates,
+                                                          connect_radius):
+            if p < q:
+                weight = np.linalg.norm(cognitive_map.place_cells[p].env_coordinates -
+                                        cognitive_map.place_cells[q].env_coordinates) / connect_radius
+                cognitive_map.add_bidirectional_edge_to_map(p, q, sample_normal(weight, sigma),
+                                                            connectivity_probability=0.8, mu=weight, sigma=sigma)
+    return cognitive_map
+
+
+def timed(function, repetitions: int = 1) -> float:
+    """ Returns the mean duration of the function in seconds """
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        function()
+    return (time.perf_counter() - start) / repetitions
+
+
+def benchmark(nr_nodes: int, cost_per_pair: float = 0.0, cost_per_call: float = 0.0, nr_queries: int = 20,
+              seed: int = 0) -> dict:
+    """ Times the map operations on a synthetic map with the given number of nodes
+
+    returns:
+    dict -- operation -> mean duration of one operation in seconds
+    """
+    rng = np.random.default_rng(seed)
+    estimator = StubReachabilityEstimator(cost_per_pair=cost_per_pair, cost_per_call=cost_per_call)
+    place_cells = generate_place_cells(nr_nodes + nr_queries, seed=seed)
+    results = {}
+
+    start = time.perf_counter()
+    cognitive_map = build_map(place_cells[:nr_nodes], estimator)
+    results["build"] = time.perf_counter() - start
+
+    # insertion of new place cells and merging of place cells at existing locations
+    new_cells = place_cells[nr_nodes:]
+    results["insert"] = timed(lambda: [cognitive_map.merge_or_add_node(pc) for pc in new_cells]) / nr_queries
+    duplicates = [PlaceCell(place_cells[i].gc_connections, place_cells[i].observations,
+                            place_cells[i].env_coordinates + 0.01) for i in rng.integers(0, nr_nodes, nr_queries)]
+    results["merge"] = timed(lambda: [cognitive_map.merge_or_add_node(pc) for pc in duplicates]) / nr_queries
+
+    nodes = list(cognitive_map.node_network.nodes)
+    pairs = [tuple(rng.choice(nodes, 2, replace=False)) for _ in range(nr_queries)]
+    results["find_path"] = timed(lambda: [cognitive_map.find_path(int(p), int(q)) for p, q in pairs]) / nr_queries
+    results["find_path_cached_goal"] = timed(
+        lambda: [cognitive_map.find_path(int(p), int(pairs[0][1])) for p, _ in pairs]) / nr_queries
+
+    results["deduplicate"] = timed(cognitive_map.deduplicate_nodes)
+
+    pc_network = PlaceCellNetwork(reach_estimator=estimator)
+    pc_network.place_cells = list(cognitive_map.place_cells.values())
+    gc_modules = [SimpleNamespace(s=s) for s in place_cells[0].gc_connections]
+    results["firing"] = timed(lambda: pc_network.compute_firing_values(gc_modules))
+
+    directory = tempfile.mkdtemp()
+    try:
+        for extension in [".gpickle", ".cmap"]:
+            filepath = os.path.join(directory, "map" + extension)
+            results["save" + extension] = timed(lambda: save_graph(cognitive_map.node_network,
+                                                                   cognitive_map.place_cells, filepath))
+            results["load" + extension] = timed(lambda: load_graph(filepath))
+    finally:
+        shutil.rmtree(directory)
+
+    results["estimator_pairs"] = estimator.nr_pairs
+    results["estimator_calls"] = estimator.nr_calls
+    return results
+
+
+def scaling_exponents(sizes: [int], results: [dict]) -> dict:
+    """ Returns for every operation the slope of log(duration) over log(number of nodes) """
+    exponents = {}
+    for operation in results[0]:
+        if operation.startswith("estimator"):
+            continue
+        durations = np.array([max(result[operation], 1e-9) for result in results])
+        exponents[operation] = float(np.polyfit(np.log(sizes), np.log(durations), 1)[0])
+    return exponents
+
+
+def plot_scaling(sizes: [int], results: [dict], filepath: str):
+    """ Plots the duration of every operation over the number of nodes on log-log axes """
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    for operation in results[0]:
+        if operation.startswith("estimator"):
+            continue
+        ax.loglog(sizes, [result[operation] for result in results], marker="o", label=operation)
+    ax.set_xlabel("number of nodes")
+    ax.set_ylabel("duration [s]")
+    ax.legend(fontsize="small")
+    fig.savefig(filepath)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    """ Measure the scaling of the map operations and store the results in experiments/scaling """
+    from tabulate import tabulate
+
+    sizes = [100, 1000, 10000, 100000]
+    cost_per_pair = 1e-5  # seconds per pair, roughly a batched network evaluation
+    cost_per_call = 1e-3  # seconds per estimator call
+
+    all_results = []
+    for size in sizes:
+        print("benchmarking", size, "nodes")
+        all_results.append(benchmark(size, cost_per_pair=cost_per_pair, cost_per_call=cost_per_call))
+
+    operations = list(all_results[0])
+    print(tabulate([[operation] + [result[operation] for result in all_results] for operation in operations],
+                   headers=["operation"] + [str(size) for size in sizes], floatfmt=".2e"))
+    exponents = scaling_exponents(sizes, all_results)
+    print(tabulate(sorted(exponents.items()), headers=["operation", "scaling exponent"], floatfmt=".2f"))
+
+    directory = os.path.join(os.path.dirname(__file__), "..", "..", "experiments", "scaling")
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "results.json"), "w") as f:
+        json.dump({"sizes": sizes, "results": all_results, "exponents": exponents}, f, indent=2)
+    plot_scaling(sizes, all_results, os.path.join(directory, "scaling.png"))
@@ -0,0 +1,120 @@
+""" Read-only mirror of the cognitive map graph as a scipy.sparse CSR matrix.
+
+    networkx stays the mutable store of the map. The mirror is rebuilt on the first query after the graph changed
+    and answers whole-graph queries with scipy.sparse.csgraph in compiled code: multi-source and all-pairs shortest
+    paths, connected components, reachability and degrees.
+"""
+import networkx as nx
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+# lower bound of edge costs, csgraph ignores edges whose cost is zero after conversions
+min_edge_cost = 1e-9
+
+
+class SparseGraph:
+    def __init__(self, graph: nx.DiGraph, weight: str = None):
+        """ CSR mirror of a directed graph, rows and columns are ordered like the nodes of the graph
+
+        arguments:
+        graph: nx.DiGraph -- graph of the cognitive map
+        weight: str       -- edge attribute used as cost, None: every edge costs 1
+        """
+        self.graph = graph
+        self.weight = weight
+        self.nodes = []  # row of the matrix -> node id
+        self.index = {}  # node id -> row of the matrix
+        self.csr = None
+        self.nr_builds = 0
+
+    def invalidate(self):
+        """ Has to be called when the graph changed, the matrix is rebuilt on the next query """
+        self.csr = None
+
+    def matrix(self) -> sparse.csr_matrix:
+        """ Returns the CSR adjacency matrix holding the edge costs """
+        if self.csr is None:
+            self.nodes = list(self.graph.nodes)
+            self.index = {node: i for i, node in enumerate(self.nodes)}
+            rows, cols, costs = [], [], []
+            for p, q, data in self.graph.edges(data=True):
+                rows.append(self.index[p])
+                cols.append(self.index[q])
+                cost = 1.0 if self.weight is None else float(data.get(self.weight, 1.0))
+                costs.append(max(cost, min_edge_cost))
+            self.csr = sparse.csr_matrix((np.array(costs, dtype=float), (rows, cols)),
+                                         shape=(len(self.nodes), len(self.nodes)))
+            self.nr_builds += 1
+        return self.csr
+
+    def shortest_path_lengths(self, sources: [int] = None) -> np.ndarray:
+        """ Returns the costs of the shortest paths from the sources to all nodes, infinity if unreachable
+
+        arguments:
+        sources: [int] -- source nodes, None: all nodes
+
+        returns:
+        np.ndarray -- matrix of shape (number of sources, number of nodes), columns ordered like self.nodes
+        """
+        matrix = self.matrix()
+        indices = None if sources is None else [self.index[node] for node in sources]
+        return csgraph.dijkstra(matrix, directed=True, indices=indices)
+
+    def shortest_path(self, start: int, goal: int) -> [int]:
+        """ Returns a shortest path from start to goal, None if no path exists """
+        matrix = self.matrix()
+        if start not in self.index or goal not in self.index:
+            return None
+        _, predecessors = csgraph.dijkstra(matrix, directed=True, indices=self.index[start],
+                                           return_predecessors=True)
+        i = self.index[goal]
+        if i != self.index[start] and predecessors[i] < 0:
+            return None
+        path = [i]
+        while path[-1] != self.index[start]:
+            path.append(predecessors[path[-1]])
+        return [self.nodes[i] for i in reversed(path)]
+
+    def multi_source_distances(self, sources: [int]) -> dict:
+        """ Returns for every node the cost of the shortest path from the closest source """
+        matrix = self.matrix()
+        distances = csgraph.dijkstra(matrix, directed=True, indices=[self.index[node] for node in sources],
+                                     min_only=True)
+        return {node: distances[i] for i, node in enumerate(self.nodes)}
+
+    def connected_components(self, strongly: bool = True) -> [[int]]:
+        """ Returns the strongly (or weakly) connected components, largest first """
+        matrix = self.matrix()
+        nr_components, labels = csgraph.connected_components(matrix, directed=True,
+                                                             connection="strong" if strongly else "weak")
+        components = [[] for _ in range(nr_components)]
+        for i, label in enumerate(labels):
+            components[label].append(self.nodes[i])
+        return sorted(components, key=len, reverse=True)
+
+    def reachable_from(self, node: int) -> [int]:
+        """ Returns all nodes reachable from the node, including itself """
+        matrix = self.matrix()
+        order = csgraph.breadth_first_order(matrix, self.index[node], directed=True, return_predecessors=False)
+        return [self.nodes[i] for i in order]
+
+    def out_degrees(self) -> dict:
+        """ Returns the number of outgoing edges of every node """
+        degrees = np.diff(self.matrix().indptr)
+        return {node: int(degrees[i]) for i, node in enumerate(self.nodes)}
+
+    def path_statistics(self) -> dict:
+        """ Returns statistics of the all-pairs shortest paths: fraction of connected ordered pairs,
+            mean and maximal (diameter) cost of the paths between connected pairs
+        """
+        nr_nodes = len(self.graph)
+        if nr_nodes < 2:
+            return {"connected_pairs": 0.0, "mean_path_length": 0.0, "diameter": 0.0}
+        distances = self.shortest_path_lengths()
+        off_diagonal = ~np.eye(nr_nodes, dtype=bool)
+        finite = np.isfinite(distances) & off_diagonal
+        lengths = distances[finite]
+        return {"connected_pairs": float(finite.sum()) / (nr_nodes * (nr_nodes - 1)),
+                "mean_path_length": float(lengths.mean()) if len(lengths) else 0.0,
+                "diameter": float(lengths.max()) if len(lengths) else 0.0}
@@ -0,0 +1,110 @@
+""" Uniform grid index over node coordinates of the cognitive map.
+    Restricts reachability candidates to nodes in the vicinity of a location,
+    so that the cost of a query depends on the local density of nodes instead of the size of the map.
+"""
+import math
+
+import numpy as np
+
+
+class SpatialIndex:
+    def __init__(self, cell_size: float = 1.0):
+        """ Uniform grid that buckets nodes by their [x, y] coordinates. Supports incremental insertion and removal.
+
+        arguments:
+        cell_size: float -- side length of a grid cell in meters (default 1.0)
+        """
+        self.cell_size = cell_size
+        self.cells = {}  # grid cell -> {node: coordinates}
+        self.node_cells = {}  # node -> grid cell
+
+    def __len__(self):
+        return len(self.node_cells)
+
+    def __contains__(self, node):
+        return node in self.node_cells
+
+    def _cell(self, coordinates) -> (int, int):
+        """ Helper function, returns the grid cell containing the coordinates """
+        return math.floor(coordinates[0] / self.cell_size), math.floor(coordinates[1] / self.cell_size)
+
+    def insert(self, node, coordinates):
+        """ Adds a node at the given coordinates, moves it if it is already indexed """
+        if node in self.node_cells:
+            self.remove(node)
+        cell = self._cell(coordinates)
+        self.cells.setdefault(cell, {})[node] = np.array(coordinates[:2], dtype=float)
+        self.node_cells[node] = cell
+
+    def remove(self, node):
+        """ Removes a node from the index, ignores nodes that are not indexed """
+        cell = self.node_cells.pop(node, None)
+        if cell is None:
+            return
+        del self.cells[cell][node]
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def clear(self):
+        self.cells = {}
+        self.node_cells = {}
+
+    def _ring(self, center: (int, int), ring: int):
+        """ Helper function, yields the nodes of all occupied grid cells at Chebyshev distance ring from center """
+        for dx in range(-ring, ring + 1):
+            for dy in range(-ring, ring + 1):
+                if max(abs(dx), abs(dy)) != ring:
+                    continue
+                cell = self.cells.get((center[0] + dx, center[1] + dy))
+                if cell:
+                    yield from cell.items()
+
+    def query_radius(self, coordinates, radius: float) -> list:
+        """ Returns all nodes within the given euclidean distance of the coordinates """
+        center = self._cell(coordinates)
+        coordinates = np.array(coordinates[:2], dtype=float)
+        result = []
+        for ring in range(int(math.ceil(radius / self.cell_size)) + 1):
+            for node, node_coordinates in self._ring(center, ring):
+                if np.linalg.norm(node_coordinates - coordinates) <= radius:
+                    result.append(node)
+        return result
+
+    def query_nearest(self, coordinates, k: int, radius: float = None) -> list:
+        """ Returns up to k nodes closest to the coordinates, sorted by distance
+
+        arguments:
+        coordinates  -- [x, y] query location
+        k: int       -- maximal number of nodes
+        radius: float -- if given: only nodes within this distance are returned
+        """
+        center = self._cell(coordinates)
+        coordinates = np.array(coordinates[:2], dtype=float)
+        max_ring = int(math.ceil(radius / self.cell_size)) if radius is not None else None
+        found = []  # (distance, node)
+        ring = 0
+        while len(self.node_cells) > 0:
+            for node, node_coordinates in self._ring(center, ring):
+                distance = np.linalg.norm(node_coordinates - coordinates)
+                if radius is None or distance <= radius:
+                    found.append((distance, node))
+            found.sort(key=lambda entry: entry[0])
+            # nodes in rings further out are at least ring * cell_size away
+            if len(found) >= k and found[k - 1][0] <= ring * self.cell_size:
+                break
+            if max_ring is not None and ring >= max_ring:
+                break
+            if len(found) == len(self.node_cells):
+                break
+            ring += 1
+        return [node for _, node in found[:k]]
+
+    def query(self, coordinates, radius: float = None, k: int = None) -> list:
+        """ Returns the candidate nodes around the coordinates: all nodes within radius,
+            the k nearest nodes or the k nearest nodes within radius. Without any restriction all nodes are returned.
+        """
+        if k is not None:
+            return self.query_nearest(coordinates, k, radius=radius)
+        if radius is not None:
+            return self.query_radius(coordinates, radius)
+        return list(self.node_cells)
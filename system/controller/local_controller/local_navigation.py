@@ -188,8 +188,8 @@ def vector_navigation(env, goal, gc_network, target_gc_spiking=None, model="comb
         env.navigation_step(gc_network, pod, obstacles=obstacles)
 
         if pc_network is not None and cognitive_map is not None:
-            observations = get_observations(env)
-            [firing_values, created_new_pc] = pc_network.track_movement(gc_network, observations,
+            # observations are only collected if a new place cell gets created
+            [firing_values, created_new_pc] = pc_network.track_movement(gc_network, lambda: get_observations(env),
                                                                         env.xy_coordinates[-1], env, exploration_phase)
 
             mapped_pc = cognitive_map.track_vector_movement(
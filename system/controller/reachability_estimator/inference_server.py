@@ -0,0 +1,311 @@
+""" Local inference server for the network-based reachability estimator.
+
+    One server process owns the model. Clients in other processes write their pairs into a shared memory ring
+    buffer and signal the server over a Unix socket with newline separated JSON messages. The server coalesces
+    the requests of all clients that arrive within max_latency into large batches, writes the reachability
+    factors back into the ring buffers of the clients and signals completion.
+
+    Start a server with start_inference_server or by running this file, and create clients with
+    reachability_estimator_factory('inference_server', socket_path=...).
+"""
+import json
+import os
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+
+from system.bio_model.place_cell_model import PlaceCell
+from system.controller.reachability_estimator.reachability_estimation import ReachabilityEstimator, \
+    NetworkReachabilityEstimator, spikings_reshape
+
+default_socket_path = os.path.join(tempfile.gettempdir(), "reachability_inference.sock")
+spikings_shape = (6, 40, 40)
+
+
+def send_message(connection: socket.socket, message: dict):
+    connection.sendall((json.dumps(message) + "\n").encode())
+
+
+class RingBuffer:
+    def __init__(self, capacity: int, image_shape: tuple, with_spikings: bool, name: str = None):
+        """ Pair slots in shared memory: start and goal images, optionally their grid cell spikings,
+            and the predicted reachability factors
+
+        arguments:
+        capacity: int       -- number of pair slots
+        image_shape: tuple  -- shape of one observation
+        with_spikings: bool -- if True: the slots hold grid cell spikings
+        name: str           -- name of an existing shared memory block to attach to, None: create a new one
+        """
+        self.capacity = capacity
+        self.image_shape = tuple(image_shape)
+        self.with_spikings = with_spikings
+        shapes = [(capacity,) + self.image_shape] * 2
+        if with_spikings:
+            shapes += [(capacity,) + spikings_shape] * 2
+        shapes.append((capacity,))
+        sizes = [int(np.prod(shape)) * 4 for shape in shapes]
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=sum(sizes))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # the creating client unlinks the block, the attaching process must not. On POSIX the block is
+            # registered with the resource tracker under its name with a leading slash, on Windows not at all
+            if os.name != "nt":
+                resource_tracker.unregister("/" + self.shm.name, "shared_memory")
+        offsets = np.cumsum([0] + sizes)
+        arrays = [np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf, offset=offset)
+                  for shape, offset in zip(shapes, offsets)]
+        self.starts, self.goals = arrays[0], arrays[1]
+        self.src_spikings, self.goal_spikings = (arrays[2], arrays[3]) if with_spikings else (None, None)
+        self.results = arrays[-1]
+
+    def slots(self, offset: int, n: int) -> np.ndarray:
+        """ Returns the indices of n slots starting at the offset, wrapping around the end """
+        return (offset + np.arange(n)) % self.capacity
+
+    def close(self, unlink: bool = False):
+        self.starts = self.goals = self.src_spikings = self.goal_spikings = self.results = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class ReachabilityInferenceServer:
+    def __init__(self, socket_path: str = default_socket_path, max_batch_size: int = 1024,
+                 max_latency: float = 0.002, **estimator_kwargs):
+        """ Serves reachability predictions of one network-based estimator to clients of other processes
+
+        arguments:
+        socket_path: str      -- path of the Unix socket the server listens on
+        max_batch_size: int   -- pending requests are evaluated when they hold this many pairs
+        max_latency: float    -- pending requests are evaluated at the latest this many seconds after the oldest
+        estimator_kwargs      -- arguments of NetworkReachabilityEstimator
+        """
+        self.socket_path = socket_path
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.estimator = NetworkReachabilityEstimator(**estimator_kwargs)
+        self.selector = selectors.DefaultSelector()
+        self.buffers = {}  # connection -> RingBuffer
+        self.received = {}  # connection -> bytes of incomplete messages
+        self.pending = []  # (connection, offset, number of pairs, arrival time)
+        self.nr_batches = 0
+        self.nr_pairs = 0
+
+    def hello(self) -> dict:
+        return {"threshold_same": self.estimator.threshold_same,
+                "threshold_reachable": self.estimator.threshold_reachable,
+                "with_spikings": self.estimator.with_spikings,
+                "signature": self.estimator.signature()}
+
+    def serve(self):
+        """ Accepts clients and answers their requests until the process is terminated """
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+        server.setblocking(False)
+        self.selector.register(server, selectors.EVENT_READ)
+        try:
+            while True:
+                timeout = None
+                if self.pending:
+                    timeout = max(0.0, self.pending[0][3] + self.max_latency - time.perf_counter())
+                for key, _ in self.selector.select(timeout):
+                    if key.fileobj is server:
+                        connection, _ = server.accept()
+                        self.selector.register(connection, selectors.EVENT_READ)
+                        self.received[connection] = b""
+                        send_message(connection, self.hello())
+                    else:
+                        self.receive(key.fileobj)
+                if self.pending and (sum(n for _, _, n, _ in self.pending) >= self.max_batch_size or
+                                     time.perf_counter() - self.pending[0][3] >= self.max_latency):
+                    self.evaluate()
+        finally:
+            self.selector.close()
+            server.close()
+            os.remove(self.socket_path)
+
+    def receive(self, connection: socket.socket):
+        """ Reads the messages of a client: attach to its ring buffer or a request of pairs """
+        data = connection.recv(65536)
+        if not data:
+            self.disconnect(connection)
+            return
+        self.received[connection] += data
+        *lines, self.received[connection] = self.received[connection].split(b"\n")
+        for line in lines:
+            message = json.loads(line)
+            if message["op"] == "attach":
+                self.buffers[connection] = RingBuffer(message["capacity"], message["image_shape"],
+                                                      message["with_spikings"], name=message["name"])
+            elif message["op"] == "predict":
+                self.pending.append((connection, message["offset"], message["n"], time.perf_counter()))
+
+    def disconnect(self, connection: socket.socket):
+        self.selector.unregister(connection)
+        self.pending = [request for request in self.pending if request[0] is not connection]
+        if connection in self.buffers:
+            self.buffers.pop(connection).close()
+        self.received.pop(connection, None)
+        connection.close()
+
+    def evaluate(self):
+        """ Evaluates all pending requests in one batch and signals the clients """
+        requests, self.pending = self.pending, []
+        slots = [self.buffers[connection].slots(offset, n) for connection, offset, n, _ in requests]
+
+        def gather(name):
+            return np.concatenate([getattr(self.buffers[connection], name)[indices]
+                                   for (connection, _, _, _), indices in zip(requests, slots)])
+
+        with_spikings = self.estimator.with_spikings
+        values = self.estimator.predict_reachability_batch(
+            gather("starts"), gather("goals"),
+            gather("src_spikings") if with_spikings else None, gather("goal_spikings") if with_spikings else None,
+            batch_size=self.max_batch_size)
+        self.nr_batches += 1
+        self.nr_pairs += len(values)
+
+        start = 0
+        for (connection, offset, n, _), indices in zip(requests, slots):
+            start += n
+            if connection not in self.buffers:
+                # disconnected while an earlier request was signalled
+                continue
+            self.buffers[connection].results[indices] = values[start - n:start]
+            try:
+                send_message(connection, {"op": "done", "offset": offset, "n": n})
+            except OSError:
+                self.disconnect(connection)
+
+
+def run_server(socket_path: str, max_batch_size: int, max_latency: float, estimator_kwargs: dict):
+    """ Entry point of the server process """
+    ReachabilityInferenceServer(socket_path, max_batch_size, max_latency, **estimator_kwargs).serve()
+
+
+def start_inference_server(socket_path: str = default_socket_path, max_batch_size: int = 1024,
+                           max_latency: float = 0.002, startup_timeout: float = 120.0, **estimator_kwargs):
+    """ Starts a server process and waits until it accepts clients
+
+    returns:
+    multiprocessing.Process -- server process, terminate it when the clients are done
+    """
+    import multiprocessing
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_server, args=(socket_path, max_batch_size, max_latency, estimator_kwargs), daemon=True)
+    process.start()
+    end = time.perf_counter() + startup_timeout
+    while not os.path.exists(socket_path):
+        if not process.is_alive() or time.perf_counter() > end:
+            process.terminate()
+            raise RuntimeError("Reachability inference server did not start")
+        time.sleep(0.05)
+    return process
+
+
+class RemoteReachabilityEstimator(ReachabilityEstimator):
+    fingerprint_attributes = NetworkReachabilityEstimator.fingerprint_attributes
+
+    def __init__(self, socket_path: str = default_socket_path, capacity: int = 1024, debug: bool = False):
+        """ Client of a reachability inference server, behaves like the network-based estimator of the server
+
+        arguments:
+        socket_path: str -- path of the Unix socket of the server
+        capacity: int    -- number of pair slots of the shared memory ring buffer
+        debug: bool      -- enables logging
+        """
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(socket_path)
+        self.reader = self.connection.makefile("rb")
+        hello = self.receive()
+        super().__init__(threshold_same=hello["threshold_same"], threshold_reachable=hello["threshold_reachable"],
+                         device="cpu", debug=debug)
+        self.with_spikings = hello["with_spikings"]
+        self.server_signature = hello["signature"]
+        self.capacity = capacity
+        self.buffer = None  # created on the first request, when the shape of the observations is known
+        self.position = 0  # next free slot of the ring buffer
+        self.lock = threading.Lock()
+
+    def receive(self) -> dict:
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Reachability inference server closed the connection")
+        return json.loads(line)
+
+    def signature(self) -> str:
+        # the values are the ones of the served estimator
+        return self.server_signature
+
+    def predict_reachability(self, start: PlaceCell, goal: PlaceCell) -> float:
+        return self.predict_reachability_pairs([(start, goal)])[0]
+
+    def predict_reachability_pairs(self, pairs: [(PlaceCell, PlaceCell)]) -> [float]:
+        """ Sends the pairs to the server in chunks of the ring buffer capacity """
+        if len(pairs) == 0:
+            return []
+        with self.lock:
+            if self.buffer is None:
+                self.buffer = RingBuffer(self.capacity, np.shape(pairs[0][0].observations[0]), self.with_spikings)
+                send_message(self.connection, {"op": "attach", "name": self.buffer.shm.name,
+                                               "capacity": self.capacity,
+                                               "image_shape": list(self.buffer.image_shape),
+                                               "with_spikings": self.with_spikings})
+            values = []
+            for i in range(0, len(pairs), self.capacity):
+                values.append(self.predict_chunk(pairs[i:i + self.capacity]))
+            return np.concatenate(values)
+
+    def predict_chunk(self, pairs: [(PlaceCell, PlaceCell)]) -> np.ndarray:
+        """ Helper function, writes the pairs into the ring buffer and waits for their results """
+        offset = self.position
+        indices = self.buffer.slots(offset, len(pairs))
+        self.position = (offset + len(pairs)) % self.capacity
+        for i, (p, q) in zip(indices, pairs):
+            self.buffer.starts[i] = p.observations[0]
+            self.buffer.goals[i] = q.observations[-1]
+            if self.with_spikings:
+                self.buffer.src_spikings[i] = spikings_reshape(np.array(p.gc_connections).flatten())
+                self.buffer.goal_spikings[i] = spikings_reshape(np.array(q.gc_connections).flatten())
+        send_message(self.connection, {"op": "predict", "offset": offset, "n": len(pairs)})
+        message = self.receive()
+        if message.get("op") != "done" or message.get("offset") != offset:
+            raise RuntimeError("Unexpected answer of the reachability inference server: %s" % message)
+        return self.buffer.results[indices].copy()
+
+    # decisions are the ones of the network-based estimator
+    pass_threshold = NetworkReachabilityEstimator.pass_threshold
+    get_connectivity_probability = NetworkReachabilityEstimator.get_connectivity_probability
+
+    def close(self):
+        """ Disconnects from the server and releases the ring buffer """
+        self.reader.close()
+        self.connection.close()
+        if self.buffer is not None:
+            self.buffer.close(unlink=True)
+            self.buffer = None
+
+
+if __name__ == "__main__":
+    """ Serve the network-based estimator with the given weights until the process is terminated """
+    weights_file = "re_mse_weights.50"
+    with_spikings = True
+
+    ReachabilityInferenceServer(default_socket_path, weights_file=weights_file, with_spikings=with_spikings,
+                                debug=True).serve()
@@ -0,0 +1,157 @@
+""" Micro-batching of single-pair reachability queries.
+    Queries are queued and answered with futures. The queue is evaluated in one batched call of the wrapped
+    estimator when it holds max_batch_size pairs, when the oldest query waited max_latency seconds, or when the
+    result of a queued query is requested. While other threads are querying the estimator, synchronous
+    single-pair queries wait up to max_latency for the batch, so queries of concurrent callers are evaluated
+    together. A caller that is alone is answered right away.
+"""
+import threading
+import time
+
+from system.bio_model.place_cell_model import PlaceCell
+from system.controller.reachability_estimator.reachability_estimation import ReachabilityEstimator
+
+
+class ReachabilityFuture:
+    def __init__(self, batcher: "MicroBatchingReachabilityEstimator"):
+        """ Reachability factor of a queued pair that becomes available with the next flush """
+        self.batcher = batcher
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def done(self) -> bool:
+        return self.event.is_set()
+
+    def set_result(self, value: float):
+        self.value = value
+        self.event.set()
+
+    def set_error(self, error: Exception):
+        self.error = error
+        self.event.set()
+
+    def result(self, timeout: float = 0.0) -> float:
+        """ Returns the reachability factor. Waits up to timeout seconds for the pair to be evaluated together with
+            other queued pairs, then flushes the queue if the pair was not evaluated yet
+        """
+        if not self.event.wait(timeout):
+            self.batcher.flush()
+            self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class MicroBatchingReachabilityEstimator(ReachabilityEstimator):
+    def __init__(self, estimator: ReachabilityEstimator, max_batch_size: int = 256, max_latency: float = 0.005):
+        """ Wraps a reachability estimator and evaluates queued single-pair queries in batches.
+            Thresholds and decisions are taken from the wrapped estimator.
+
+        arguments:
+        estimator: ReachabilityEstimator -- estimator whose predict_reachability_pairs evaluates the batches
+        max_batch_size: int              -- the queue is flushed when it holds this many pairs
+        max_latency: float               -- the queue is flushed at the latest this many seconds after the
+                                            first queued pair, None: only flushed on size or on request
+        """
+        super().__init__(threshold_same=estimator.threshold_same, threshold_reachable=estimator.threshold_reachable,
+                         device=estimator.device, debug=estimator.debug)
+        self.estimator = estimator
+        self.fingerprint_attributes = estimator.fingerprint_attributes
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.queue = []  # (start, goal, future)
+        self.lock = threading.RLock()
+        self.timer = None
+        self.nr_callers = 0  # number of threads currently waiting for results
+        self.callers_lock = threading.Lock()
+        self.nr_flushes = 0
+        self.nr_pairs = 0
+
+    def signature(self) -> str:
+        # batching does not change the predicted values
+        return self.estimator.signature()
+
+    def submit(self, start: PlaceCell, goal: PlaceCell) -> ReachabilityFuture:
+        """ Queues a pair and returns the future of its reachability factor """
+        future = ReachabilityFuture(self)
+        with self.lock:
+            self.queue.append((start, goal, future))
+            if len(self.queue) >= self.max_batch_size:
+                self.flush()
+            elif len(self.queue) == 1 and self.max_latency is not None:
+                self.timer = threading.Timer(self.max_latency, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        return future
+
+    def flush(self):
+        """ Evaluates all queued pairs in one call of the wrapped estimator """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            queue, self.queue = self.queue, []
+            if not queue:
+                return
+            start = time.perf_counter()
+            try:
+                values = self.estimator.predict_reachability_pairs([(p, q) for p, q, _ in queue])
+            except Exception as error:
+                for _, _, future in queue:
+                    future.set_error(error)
+                return
+            for (_, _, future), value in zip(queue, values):
+                future.set_result(value)
+            self.nr_flushes += 1
+            self.nr_pairs += len(queue)
+            self.print_debug("evaluated %d pairs in %.4f s" % (len(queue), time.perf_counter() - start))
+
+    def map(self, pairs) -> [float]:
+        """ Submits the pairs of an iterable or generator and returns their reachability factors in order,
+            full batches are evaluated while the pairs are still generated
+        """
+        self.enter()
+        try:
+            futures = [self.submit(p, q) for p, q in pairs]
+            return [future.result() for future in futures]
+        finally:
+            self.leave()
+
+    def predict_reachability(self, start: PlaceCell, goal: PlaceCell) -> float:
+        """ Queues the pair and waits for the batch if other threads are querying the estimator, their pairs
+            submitted meanwhile are evaluated in the same call of the wrapped estimator
+        """
+        self.enter()
+        try:
+            future = self.submit(start, goal)
+            with self.callers_lock:
+                alone = self.nr_callers == 1
+            return future.result(0.0 if alone or self.max_latency is None else self.max_latency)
+        finally:
+            self.leave()
+
+    def enter(self):
+        """ Registers a thread that waits for results """
+        with self.callers_lock:
+            self.nr_callers += 1
+
+    def leave(self):
+        with self.callers_lock:
+            self.nr_callers -= 1
+
+    def predict_reachability_pairs(self, pairs: [(PlaceCell, PlaceCell)]) -> [float]:
+        return self.map(pairs)
+
+    def pass_threshold(self, reachability_factor, threshold) -> bool:
+        return self.estimator.pass_threshold(reachability_factor, threshold)
+
+    def get_connectivity_probability(self, reachability_factor):
+        return self.estimator.get_connectivity_probability(reachability_factor)
+
+    def forget_nodes(self, nodes: [int] = None):
+        self.estimator.forget_nodes(nodes)
+
+    def mean_batch_size(self) -> float:
+        """ Returns the mean number of pairs per evaluated batch """
+        return self.nr_pairs / self.nr_flushes if self.nr_flushes else 0.0
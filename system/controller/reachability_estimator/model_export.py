@@ -0,0 +1,271 @@
+""" Export of network-based reachability models to inference artifacts.
+
+    The eager model of a weights file is wrapped into one module that maps image pairs (and grid cell spikings)
+    to reachability factors. It is traced to TorchScript or exported to ONNX, optionally after dynamic int8
+    quantization of the linear layers and static int8 quantization of the convolutional image encoder, which is
+    calibrated on dataset samples. A JSON file next to the artifact describes the model.
+
+    Artifacts are loaded with reachability_estimator_factory('compiled', artifact_file=...). check_parity compares
+    an artifact with the eager model on dataset samples.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+
+import system.controller.reachability_estimator.networks as networks
+from system.bio_model.place_cell_model import PlaceCell
+from system.controller.reachability_estimator.reachability_estimation import ReachabilityEstimator, \
+    NetworkReachabilityEstimator, get_path, spikings_reshape
+
+# image encoder of each backbone that can be statically quantized
+conv_encoders = {'convolutional': 'img_encoder', 'res_net': 'res_net', 'student': 'student_encoder'}
+
+
+class ReachabilityModule(nn.Module):
+    def __init__(self, nets: dict, backbone: str, model_variant: str, with_spikings: bool):
+        """ Eager reachability model as a single module, the output is the reachability factor of each pair """
+        super().__init__()
+        self.nets = nn.ModuleDict(nets)
+        self.backbone = backbone
+        self.model_variant = model_variant
+        self.with_spikings = with_spikings
+
+    def forward(self, src_imgs, dst_imgs, src_spikings=None, dst_spikings=None):
+        return networks.get_prediction(self.nets, self.backbone, self.model_variant, src_imgs, dst_imgs,
+                                       batch_src_spikings=src_spikings, batch_dst_spikings=dst_spikings)[0]
+
+
+def load_samples(dataset_file: str, nr_samples: int, with_spikings: bool, seed: int = 0) -> [np.ndarray]:
+    """ Loads random samples of a reachability dataset
+
+    returns:
+    [np.ndarray] -- start images, goal images and, if with_spikings, start and goal spikings
+    """
+    from system.controller.reachability_estimator.training.H5Dataset import H5Dataset, H5DatasetWithSpikings
+
+    dataset = H5DatasetWithSpikings(dataset_file) if with_spikings else H5Dataset(dataset_file)
+    indices = np.random.default_rng(seed).choice(len(dataset), min(nr_samples, len(dataset)), replace=False)
+    samples = [dataset[int(i)] for i in indices]
+    columns = [np.array([sample[0] for sample in samples]), np.array([sample[1] for sample in samples])]
+    if with_spikings:
+        columns += [np.array([sample[4] for sample in samples]), np.array([sample[5] for sample in samples])]
+    return [column.astype(np.float32) for column in columns]
+
+
+def quantize_conv_encoder(module: ReachabilityModule, calibration: [np.ndarray], batch_size: int = 32):
+    """ Replaces the image encoder of the module with a statically int8 quantized one, calibrated on the samples """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    name = conv_encoders.get(module.backbone)
+    if name is None:
+        raise ValueError("Backbone %s has no convolutional image encoder" % module.backbone)
+    starts, goals = torch.from_numpy(calibration[0]), torch.from_numpy(calibration[1])
+    if name == 'img_encoder':
+        batches = [(starts[i:i + batch_size], goals[i:i + batch_size]) for i in range(0, len(starts), batch_size)]
+    else:
+        # the encoders of the res_net and student backbones encode single images
+        batches = [(images[i:i + batch_size],) for images in (starts, goals) for i in range(0, len(images), batch_size)]
+
+    torch.backends.quantized.engine = 'fbgemm'
+    prepared = prepare_fx(module.nets[name], get_default_qconfig_mapping('fbgemm'), batches[0])
+    with torch.no_grad():
+        for batch in batches:
+            prepared(*batch)
+    module.nets[name] = convert_fx(prepared)
+
+
+def export_model(weights_file: str, output_file: str, export_format: str = 'torchscript',
+                 quantize_linear: bool = False, quantize_conv: bool = False, calibration: [np.ndarray] = None,
+                 with_spikings: bool = False, weights_folder: str = None) -> str:
+    """ Exports the model of a weights file to an inference artifact
+
+    arguments:
+    weights_file: str          -- weights file of the network-based estimator
+    output_file: str           -- path of the artifact, the description is written to output_file + '.json'
+    export_format: str         -- 'torchscript' or 'onnx'
+    quantize_linear: bool      -- if True: dynamic int8 quantization of the linear layers
+    quantize_conv: bool        -- if True: static int8 quantization of the image encoder, needs calibration samples
+    calibration: [np.ndarray]  -- samples of load_samples, the first ones are also used as example inputs
+    with_spikings: bool        -- flag indicates whether grid cell spikings are part of the input
+    weights_folder: str        -- path to the folder with weights files
+
+    returns:
+    str -- path of the artifact
+    """
+    estimator = NetworkReachabilityEstimator(weights_file=weights_file, weights_folder=weights_folder,
+                                             with_spikings=with_spikings, debug=False, factored=False)
+    module = ReachabilityModule(estimator.nets, estimator.backbone, estimator.model_variant, with_spikings).eval()
+
+    if calibration is not None:
+        example = tuple(torch.from_numpy(column[:2]) for column in calibration)
+    else:
+        example = (torch.zeros(2, 4, 64, 64), torch.zeros(2, 4, 64, 64))
+        if with_spikings:
+            example += (torch.zeros(2, 6, 40, 40), torch.zeros(2, 6, 40, 40))
+
+    if quantize_conv:
+        if calibration is None:
+            raise ValueError("Static quantization needs calibration samples")
+        quantize_conv_encoder(module, calibration)
+    if quantize_linear:
+        module = torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8)
+
+    input_names = ['src_imgs', 'dst_imgs'] + (['src_spikings', 'dst_spikings'] if with_spikings else [])
+    with torch.no_grad():
+        if export_format == 'torchscript':
+            traced = torch.jit.freeze(torch.jit.trace(module, example))
+            torch.jit.save(traced, output_file)
+        elif export_format == 'onnx':
+            if quantize_linear or quantize_conv:
+                raise ValueError("Quantized models are exported with torchscript")
+            torch.onnx.export(module, example, output_file, input_names=input_names, output_names=['reachability'],
+                              dynamic_axes={name: {0: 'batch'} for name in input_names + ['reachability']},
+                              opset_version=17)
+        else:
+            raise ValueError("Export format %s is not supported" % export_format)
+
+    with open(output_file + '.json', 'w') as f:
+        json.dump({'format': export_format, 'backbone': estimator.backbone, 'model_variant': estimator.model_variant,
+                   'with_spikings': with_spikings, 'weights_file': weights_file,
+                   'weights_hash': estimator.weights_hash, 'quantize_linear': quantize_linear,
+                   'quantize_conv': quantize_conv, 'threshold_same': estimator.threshold_same,
+                   'threshold_reachable': estimator.threshold_reachable}, f, indent=2)
+    return output_file
+
+
+class CompiledReachabilityEstimator(ReachabilityEstimator):
+    fingerprint_attributes = NetworkReachabilityEstimator.fingerprint_attributes
+
+    def __init__(self, artifact_file: str, artifact_folder: str = None, device: str = 'cpu', debug: bool = False,
+                 batch_size: int = 256):
+        """ Network-based reachability estimator running an exported TorchScript or ONNX artifact
+
+        arguments:
+        artifact_file: str   -- file of the artifact, see export_model
+        artifact_folder: str -- path to the folder with the artifact (default the folder of weights files)
+        device: str          -- device used for calculations (default cpu)
+        debug: bool          -- enables logging
+        batch_size: int      -- number of pairs per forward pass
+        """
+        if artifact_folder is None:
+            artifact_folder = os.path.join(get_path(), "data/models")
+        artifact_filepath = os.path.join(artifact_folder, artifact_file)
+        with open(artifact_filepath + '.json') as f:
+            self.description = json.load(f)
+        super().__init__(threshold_same=self.description['threshold_same'],
+                         threshold_reachable=self.description['threshold_reachable'], device=device, debug=debug)
+        with open(artifact_filepath, 'rb') as f:
+            self.artifact_hash = hashlib.sha1(f.read()).hexdigest()
+        self.with_spikings = self.description['with_spikings']
+        self.batch_size = batch_size
+
+        if self.description['format'] == 'torchscript':
+            self.model = torch.jit.load(artifact_filepath, map_location='cpu')
+            self.session = None
+        else:
+            import onnxruntime
+            self.model = None
+            self.session = onnxruntime.InferenceSession(artifact_filepath, providers=['CPUExecutionProvider'])
+        self.print_debug('loaded %s' % artifact_file, self.description)
+
+    def signature(self) -> str:
+        return "%s[%s, %s, spikings=%s]" % (super().signature(), self.description['weights_hash'],
+                                            self.artifact_hash, self.with_spikings)
+
+    def predict_reachability(self, start: PlaceCell, goal: PlaceCell) -> float:
+        return self.predict_reachability_pairs([(start, goal)])[0]
+
+    def predict_reachability_pairs(self, pairs: [(PlaceCell, PlaceCell)]) -> [float]:
+        if len(pairs) == 0:
+            return []
+        starts = np.array([p.observations[0] for p, _ in pairs])
+        goals = np.array([q.observations[-1] for _, q in pairs])
+        if not self.with_spikings:
+            return self.predict_reachability_batch(starts, goals)
+        src_spikings = np.array([spikings_reshape(np.array(p.gc_connections).flatten()) for p, _ in pairs])
+        goal_spikings = np.array([spikings_reshape(np.array(q.gc_connections).flatten()) for _, q in pairs])
+        return self.predict_reachability_batch(starts, goals, src_spikings, goal_spikings)
+
+    def predict_reachability_batch(self, starts, goals, src_spikings=None, goal_spikings=None,
+                                   batch_size: int = None) -> np.ndarray:
+        """ Predicts reachability for multiple location pairs, same arguments as
+            NetworkReachabilityEstimator.predict_reachability_batch
+        """
+        inputs = [np.asarray(starts, dtype=np.float32), np.asarray(goals, dtype=np.float32)]
+        if self.with_spikings:
+            inputs += [np.asarray(src_spikings, dtype=np.float32), np.asarray(goal_spikings, dtype=np.float32)]
+        batch_size = batch_size or self.batch_size
+
+        results = []
+        for i in range(0, len(inputs[0]), batch_size):
+            batch = [column[i:i + batch_size] for column in inputs]
+            if self.session is not None:
+                names = [node.name for node in self.session.get_inputs()]
+                results.append(self.session.run(None, dict(zip(names, batch)))[0])
+            else:
+                with torch.inference_mode():
+                    results.append(self.model(*[torch.from_numpy(column) for column in batch]).numpy())
+        return np.concatenate(results)
+
+    # decisions are the ones of the network-based estimator
+    pass_threshold = NetworkReachabilityEstimator.pass_threshold
+    get_connectivity_probability = NetworkReachabilityEstimator.get_connectivity_probability
+
+
+def check_parity(weights_file: str, artifact_file: str, samples: [np.ndarray], batch_size: int = 64,
+                 tolerance: float = 0.02, weights_folder: str = None, artifact_folder: str = None) -> dict:
+    """ Compares the predictions and the speed of an artifact with the eager model
+
+    arguments:
+    samples: [np.ndarray] -- samples of load_samples
+    tolerance: float      -- maximal absolute difference of the reachability factors for the check to pass
+
+    returns:
+    dict -- maximal and mean absolute difference, agreement of the reachability decisions,
+            seconds per pair of both models and whether the check passed
+    """
+    compiled = CompiledReachabilityEstimator(artifact_file, artifact_folder=artifact_folder)
+    eager = NetworkReachabilityEstimator(weights_file=weights_file, weights_folder=weights_folder,
+                                         with_spikings=compiled.with_spikings, debug=False, factored=False)
+    spikings = samples[2:] if compiled.with_spikings else [None, None]
+
+    start = time.perf_counter()
+    eager_values = np.asarray(eager.predict_reachability_batch(list(samples[0]), list(samples[1]),
+                                                               *[None if s is None else list(s) for s in spikings],
+                                                               batch_size=batch_size))
+    eager_time = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled_values = compiled.predict_reachability_batch(samples[0], samples[1], *spikings, batch_size=batch_size)
+    compiled_time = time.perf_counter() - start
+
+    errors = np.abs(eager_values - compiled_values)
+    agreement = np.mean((eager_values > eager.threshold_reachable) == (compiled_values > eager.threshold_reachable))
+    return {'max_abs_error': float(errors.max()), 'mean_abs_error': float(errors.mean()),
+            'decision_agreement': float(agreement), 'eager_seconds_per_pair': eager_time / len(errors),
+            'compiled_seconds_per_pair': compiled_time / len(errors), 'speedup': eager_time / compiled_time,
+            'passed': bool(errors.max() <= tolerance)}
+
+
+if __name__ == "__main__":
+    """ Export a model with quantization and compare it with the eager model """
+    import tabulate
+
+    weights_file = "re_mse_weights.50"
+    with_spikings = True
+    dataset_file = os.path.join(get_path(), "data", "reachability", "dataset_spikings.hd5")
+    artifact_file = "re_mse_weights.50.quantized.pt"
+
+    calibration = load_samples(dataset_file, 256, with_spikings, seed=0)
+    test_samples = load_samples(dataset_file, 1024, with_spikings, seed=1)
+    export_model(weights_file, os.path.join(get_path(), "data", "models", artifact_file), 'torchscript',
+                 quantize_linear=True, quantize_conv=True, calibration=calibration, with_spikings=with_spikings)
+    print(tabulate.tabulate(check_parity(weights_file, artifact_file, test_samples).items()))
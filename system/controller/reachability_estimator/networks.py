@@ -14,7 +14,6 @@ import torchvision
 from torch import nn
 import torch.nn.functional as F
 from torch.autograd import Variable
-from torchmetrics import MeanSquaredError
 
 
 def initialize_siamese():
@@ -82,7 +81,7 @@ def initialize_regressors(nets):
     return nets
 
 
-def initialize_res_net():
+def initialize_res_net(pretrained=True):
     # Defining the NN and optimizers
     input_dim = 64
     nets = initialize_regressors({})
@@ -93,7 +92,9 @@ def initialize_res_net():
         'opt': torch.optim.Adam(net.parameters(), lr=3.0e-4, eps=1.0e-5)
     }
 
-    net = torchvision.models.resnet18(pretrained=True, num_classes=input_dim)
+    # the ImageNet weights only exist with 1000 classes, the classifier is replaced afterwards
+    net = torchvision.models.resnet18(weights=torchvision.models.ResNet18_Weights.DEFAULT if pretrained else None)
+    net.fc = nn.Linear(net.fc.in_features, input_dim)
     weight1 = net.conv1.weight.clone()
     new_first_layer = nn.Conv2d(4, 64, kernel_size=(7, 7), stride=(2, 2), padding=(3, 3), bias=False).requires_grad_()
     new_first_layer.weight[:, :3, :, :].data[...] = Variable(weight1, requires_grad=True)
@@ -106,46 +107,76 @@ def initialize_res_net():
     return nets
 
 
-def initialize_network(backbone='convolutional', model_variant='convolutional'):
+def initialize_student(model_variant='pair_conv'):
+    """ Lightweight student of the res_net backbone: a small CNN on downsampled images and,
+        for the spikings variant, an MLP on the per-module grid cell errors
+    """
+    embedding_dim = 64
+    grid_cell_dim = 16
+    nets = initialize_regressors({})
+
+    input_dim = embedding_dim * 2 + (grid_cell_dim if model_variant == 'spikings' else 0)
+    net = FCLayers(init_scale=1.0, input_dim=input_dim, no_weight_init=False)
+    nets["fully_connected"] = {
+        'net': net,
+        'opt': torch.optim.Adam(net.parameters(), lr=1.0e-3, eps=1.0e-5)
+    }
+
+    net = StudentImageEncoder(output_dim=embedding_dim)
+    nets["student_encoder"] = {
+        'net': net,
+        'opt': torch.optim.Adam(net.parameters(), lr=1.0e-3, eps=1.0e-5)
+    }
+
+    if model_variant == 'spikings':
+        net = GridCellMLP(output_dim=grid_cell_dim)
+        nets["grid_cell_mlp"] = {
+            'net': net,
+            'opt': torch.optim.Adam(net.parameters(), lr=1.0e-3, eps=1.0e-5)
+        }
+    return nets
+
+
+def initialize_network(backbone='convolutional', model_variant='convolutional', pretrained=True):
+    """ pretrained: initialize the res_net backbone with ImageNet weights, not needed when loading a snapshot """
     if backbone == 'convolutional':
         return initialize_cnn(model_variant)
     elif backbone == 'res_net':
-        return initialize_res_net()
+        return initialize_res_net(pretrained)
     elif backbone == 'siamese':
         return initialize_siamese()
+    elif backbone == 'student':
+        return initialize_student(model_variant)
     else:
         raise ValueError("Backbone not implemented")
 
 
-compare_mse = MeanSquaredError()
 module_weights = torch.FloatTensor([32, 16, 8, 4, 2, 1])
 
 
+def get_grid_cell_module_errors(batch_src_spikings, batch_dst_spikings):
+    """ Returns the mean squared error between the spikings of each grid cell module, shape (B, 6) """
+    batch_size = batch_src_spikings.shape[0]
+    difference = batch_src_spikings.reshape(batch_size, 6, -1) - batch_dst_spikings.reshape(batch_size, 6, -1)
+    return difference.pow(2).mean(2)
+
+
 def get_grid_cell(batch_src_spikings, batch_dst_spikings):
     """
-    Calculate the similarity between two arrays of grid cell modules using Structural Similarity Index (SSIM)
-    with weighted aggregation.
+    Calculate the similarity between two batches of grid cell spikings as the weighted mean squared error
+    of each module, computed per sample.
 
     Args:
-    array1 (list of numpy arrays): First array of grid cell modules.
-    array2 (list of numpy arrays): Second array of grid cell modules.
-    module_weights (list of float): List of weights for each module. Must have the same length as arrays.
+    batch_src_spikings (torch.Tensor): spikings of the first locations, shape (B, 6, 40, 40) or (B, 6, 1600).
+    batch_dst_spikings (torch.Tensor): spikings of the second locations, same shape.
 
     Returns:
-    float: Weighted SSIM-based similarity score.
+    torch.Tensor: similarity score of each pair, shape (B,).
     """
-    batch_size = batch_src_spikings.shape[0]
-    batch_similarity_scores = torch.zeros(6, batch_size)
-
-    for ch in range(6):
-        batch_similarity_scores[ch] = compare_mse(batch_src_spikings[:, ch:ch + 1, :, :],
-                                                  batch_dst_spikings[:, ch:ch + 1, :, :])
-    batch_similarity_scores = torch.FloatTensor(batch_similarity_scores)
-    batch_similarity_scores = torch.transpose(batch_similarity_scores, 0, 1)
-    batch_similarity_scores = (batch_similarity_scores * module_weights).sum(1) / module_weights.sum()
-    batch_similarity_scores = (torch.max(batch_similarity_scores,
-                                         torch.fill(torch.zeros((batch_size,)), 0.99)) - 0.99) / 0.01
-    return batch_similarity_scores
+    module_scores = get_grid_cell_module_errors(batch_src_spikings, batch_dst_spikings)
+    weights = module_weights.to(module_scores.device)
+    batch_similarity_scores = (module_scores * weights).sum(1) / weights.sum()
+    return (torch.clamp(batch_similarity_scores, min=0.99) - 0.99) / 0.01
 
 
 def get_prediction_convolutional(nets, model_variant, src_batch, dst_batch, batch_transformation, batch_src_spikings,
@@ -236,6 +267,13 @@ def get_prediction_resnet(nets, model_variant, src_batch, dst_batch, batch_src_s
     return reachability_prediction, position_prediction, angle_prediction
 
 
+def get_prediction_student(nets, model_variant, src_batch, dst_batch, batch_src_spikings, batch_dst_spikings):
+    src_features = nets['student_encoder'](src_batch)
+    dst_features = nets['student_encoder'](dst_batch)
+    return get_prediction_from_embeddings(nets, 'student', model_variant, src_features, dst_features,
+                                          batch_src_spikings, batch_dst_spikings)
+
+
 def get_prediction(nets, backbone, model_variant, src_batch, dst_batch, batch_transformation=None,
                    batch_src_spikings=None, batch_dst_spikings=None):
     if backbone == 'convolutional':
@@ -245,6 +283,54 @@ def get_prediction(nets, backbone, model_variant, src_batch, dst_batch, batch_tr
         return get_prediction_resnet(nets, model_variant, src_batch, dst_batch, batch_src_spikings, batch_dst_spikings)
     elif backbone == 'siamese':
         return get_grid_cell(batch_src_spikings, batch_dst_spikings), None, None
+    elif backbone == 'student':
+        return get_prediction_student(nets, model_variant, src_batch, dst_batch, batch_src_spikings,
+                                      batch_dst_spikings)
+
+
+def is_factorable(backbone, model_variant):
+    """ Returns whether the prediction splits into a per-image embedding and a pair head.
+        The convolutional backbone encodes both images jointly (ImagePairEncoderV2 convolves the 12 channels of
+        src, dst and src - dst), so its image features only exist per pair.
+    """
+    return (backbone == 'res_net' and model_variant == 'pair_conv') or backbone in ('siamese', 'student')
+
+
+def get_embedding(nets, backbone, model_variant, img_batch):
+    """ Encodes single images for the pair head of a factorable model, see get_prediction_from_embeddings.
+        Returns None for backbones that do not use the images.
+    """
+    if not is_factorable(backbone, model_variant):
+        raise ValueError("Backbone %s with variant %s can not be factored" % (backbone, model_variant))
+    if backbone == 'res_net':
+        return nets['res_net'](img_batch)
+    elif backbone == 'student':
+        return nets['student_encoder'](img_batch)
+    return None
+
+
+def get_prediction_from_embeddings(nets, backbone, model_variant, src_embeddings, dst_embeddings,
+                                   batch_src_spikings=None, batch_dst_spikings=None):
+    """ Pair head of a factorable model, equivalent to get_prediction on the images the embeddings were computed from """
+    if backbone == 'res_net' and model_variant == 'pair_conv':
+        linear_features = nets['fully_connected'](torch.cat([src_embeddings, dst_embeddings], dim=1))
+        reachability_prediction = nets["reachability_regression"](linear_features)
+        position_prediction = nets["position_regression"](linear_features)
+        angle_prediction = nets["angle_regression"](linear_features)
+        return reachability_prediction, position_prediction, angle_prediction
+    elif backbone == 'siamese':
+        return get_grid_cell(batch_src_spikings, batch_dst_spikings), None, None
+    elif backbone == 'student':
+        pair_features = [src_embeddings, dst_embeddings]
+        if model_variant == 'spikings':
+            pair_features.append(nets['grid_cell_mlp'](get_grid_cell_module_errors(batch_src_spikings,
+                                                                                   batch_dst_spikings)))
+        linear_features = nets['fully_connected'](torch.cat(pair_features, dim=1))
+        reachability_prediction = nets["reachability_regression"](linear_features)
+        position_prediction = nets["position_regression"](linear_features)
+        angle_prediction = nets["angle_regression"](linear_features)
+        return reachability_prediction, position_prediction, angle_prediction
+    raise ValueError("Backbone %s with variant %s can not be factored" % (backbone, model_variant))
 
 
 class GridCellSiameseNetwork(nn.Module):
@@ -518,3 +604,47 @@ class ImageEncoderV3(nn.Module):
             x = F.relu(self.conv4(x))
 
         return x.view(x.size(0), -1)
+
+
+class StudentImageEncoder(nn.Module):
+    def __init__(self, input_channels=4, output_dim=64, downsampling=2, init_scale=1.0):
+        super(StudentImageEncoder, self).__init__()
+        self.downsampling = downsampling
+
+        # Input: 4 x 64 x 64, downsampled to 4 x 32 x 32
+        self.conv1 = nn.Conv2d(input_channels, 16, kernel_size=3, stride=2, padding=1)
+        # 16 x 16 x 16
+        self.conv2 = nn.Conv2d(16, 32, kernel_size=3, stride=2, padding=1)
+        # 32 x 8 x 8
+        self.conv3 = nn.Conv2d(32, output_dim, kernel_size=3, stride=2, padding=1)
+        # 64 x 4 x 4, averaged to 64
+
+        for layer in (self.conv1, self.conv2, self.conv3):
+            nn.init.orthogonal_(layer.weight, init_scale)
+            with torch.no_grad():
+                layer.bias.zero_()
+
+    def forward(self, imgs):
+        x = F.avg_pool2d(imgs / 255.0, self.downsampling)
+        x = F.relu(self.conv1(x))
+        x = F.relu(self.conv2(x))
+        x = F.relu(self.conv3(x))
+        return x.mean(dim=(2, 3))
+
+
+class GridCellMLP(nn.Module):
+    def __init__(self, nr_modules=6, output_dim=16, init_scale=1.0):
+        super(GridCellMLP, self).__init__()
+
+        self.fc1 = nn.Linear(nr_modules, output_dim)
+        self.fc2 = nn.Linear(output_dim, output_dim)
+
+        for layer in (self.fc1, self.fc2):
+            nn.init.orthogonal_(layer.weight, init_scale)
+            with torch.no_grad():
+                layer.bias.zero_()
+
+    def forward(self, module_errors):
+        x = F.relu(self.fc1(module_errors))
+        x = F.relu(self.fc2(x))
+        return x
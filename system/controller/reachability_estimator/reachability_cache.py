@@ -0,0 +1,123 @@
+""" Persistent cache of reachability values between pairs of place cells.
+    Entries are keyed by the stable node ids and observation versions of both place cells together with a digest of
+    the attributes the wrapped estimator reads. They are stored with the identity of the estimator that produced
+    them, so they stay valid across reloads of the cognitive map until a node's observation or the estimator changes.
+"""
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+from system.bio_model.place_cell_model import PlaceCell
+from system.controller.reachability_estimator.reachability_estimation import ReachabilityEstimator
+
+
+def place_cell_fingerprint(pc: PlaceCell, attributes: (str,)) -> tuple:
+    """ Returns the cache key of a place cell: its node id, its observation version and a digest of the given
+        attributes. The digest is stored on the place cell until PlaceCell.observation_changed is called.
+
+    arguments:
+    pc: PlaceCell       -- place cell
+    attributes: (str,) -- attributes of the place cell the estimator reads, see ReachabilityEstimator
+
+    returns:
+    tuple -- (node id or None, observation version, digest)
+    """
+    version = getattr(pc, "observation_version", 0)
+    digests = getattr(pc, "reachability_fingerprints", None)
+    if digests is None:
+        digests = pc.reachability_fingerprints = {}
+    cached = digests.get(attributes)
+    if cached is None or cached[0] != version:
+        digest = hashlib.sha1()
+        for name in attributes:
+            digest.update(name.encode())
+            value = getattr(pc, name, None)
+            if value is None:
+                continue
+            if name == "observations":
+                for observation in value:
+                    digest.update(np.ascontiguousarray(observation).tobytes())
+            else:
+                digest.update(np.ascontiguousarray(value, dtype=float).tobytes())
+        cached = digests[attributes] = (version, digest.hexdigest())
+    return getattr(pc, "node_id", None), version, cached[1]
+
+
+class CachedReachabilityEstimator(ReachabilityEstimator):
+    def __init__(self, estimator: ReachabilityEstimator):
+        """ Wraps a reachability estimator and caches its reachability values for pairs of place cells.
+            Thresholds and decisions are taken from the wrapped estimator.
+
+        arguments:
+        estimator: ReachabilityEstimator -- estimator whose predictions are cached
+        """
+        super().__init__(threshold_same=estimator.threshold_same, threshold_reachable=estimator.threshold_reachable,
+                         device=estimator.device, debug=estimator.debug)
+        self.estimator = estimator
+        self.fingerprint_attributes = estimator.fingerprint_attributes
+        self.entries = {}  # (fingerprint start, fingerprint goal) -> reachability factor
+        self.hits = 0
+        self.misses = 0
+
+    def signature(self) -> str:
+        return "cached(" + self.estimator.signature() + ")"
+
+    def fingerprint(self, pc: PlaceCell) -> tuple:
+        return place_cell_fingerprint(pc, self.fingerprint_attributes)
+
+    def predict_reachability(self, start: PlaceCell, goal: PlaceCell) -> float:
+        """ Returns the cached reachability factor or predicts and caches it """
+        return self.predict_reachability_pairs([(start, goal)])[0]
+
+    def predict_reachability_pairs(self, pairs: [(PlaceCell, PlaceCell)]) -> [float]:
+        """ Looks up all pairs in the cache and predicts the missing ones in one batched call """
+        keys = [(self.fingerprint(p), self.fingerprint(q)) for p, q in pairs]
+        missing = [i for i, key in enumerate(keys) if key not in self.entries]
+        self.hits += len(pairs) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            values = self.estimator.predict_reachability_pairs([pairs[i] for i in missing])
+            for i, value in zip(missing, values):
+                self.entries[keys[i]] = value
+        return [self.entries[key] for key in keys]
+
+    def pass_threshold(self, reachability_factor, threshold) -> bool:
+        return self.estimator.pass_threshold(reachability_factor, threshold)
+
+    def get_connectivity_probability(self, reachability_factor):
+        return self.estimator.get_connectivity_probability(reachability_factor)
+
+    def forget_nodes(self, nodes: [int] = None):
+        self.estimator.forget_nodes(nodes)
+
+    def hit_rate(self) -> float:
+        """ Returns the fraction of queries answered from the cache """
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def statistics(self) -> dict:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate()}
+
+    def prune(self, nodes: [PlaceCell]):
+        """ Drops all entries that do not belong to a pair of the given nodes in their current state """
+        valid = {self.fingerprint(p) for p in nodes}
+        self.entries = {key: value for key, value in self.entries.items() if key[0] in valid and key[1] in valid}
+
+    def save(self, filepath: str):
+        """ Stores the cache entries together with the identity of the wrapped estimator """
+        with open(filepath, "wb") as f:
+            pickle.dump({"signature": self.estimator.signature(), "entries": self.entries}, f)
+
+    def load(self, filepath: str):
+        """ Loads cache entries from the file, entries of a different estimator are discarded """
+        if not os.path.exists(filepath):
+            return
+        with open(filepath, "rb") as f:
+            data = pickle.load(f)
+        if data.get("signature") != self.estimator.signature():
+            self.print_debug("reachability cache %s was created by a different estimator, discarding" % filepath)
+            return
+        self.entries.update(data["entries"])
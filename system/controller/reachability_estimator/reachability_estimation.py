@@ -15,9 +15,11 @@ import tabulate
 
 import sys
 import os
+import hashlib
 import system.controller.reachability_estimator.networks as networks
 from system.controller.simulation.environment.map_occupancy import MapLayout
-from system.bio_model.place_cell_model import PlaceCell
+from system.bio_model.place_cell_model import PlaceCell, get_image_descriptor, compute_image_descriptor, \
+    descriptor_matrix
 from typing import Union, List
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
@@ -34,35 +36,65 @@ def reachability_estimator_factory(type: str = 'distance', **kwargs):
 
     arguments:
     type: str -- type of the reachability estimator, possible values:
-                 ['distance' (default), 'neural_network', 'simulation', 'view_overlap', 'shortcut']
+                 ['distance' (default), 'neural_network', 'simulation', 'view_overlap', 'shortcut',
+                  'inference_server', 'compiled']
     kwargs:
         device: str         -- type of the computations, possible values: ['cpu' (default), 'gpu']
         weights_file: str   -- filename of the weights for network-based estimator if exists
         with_spikings: bool -- parameter for network-based estimator, flag to include grid cell spikings into input
         env_model: str      -- model of the environment for simulation-based estimator
+        socket_path: str    -- socket of the inference server for the client of a served network-based estimator
+        artifact_file: str  -- exported TorchScript or ONNX model for the compiled estimator, see model_export
+        cached: bool        -- wrap the estimator into a persistent reachability cache (default False)
+        micro_batching: bool -- queue single-pair queries and evaluate them in batches (default False)
+        max_batch_size: int  -- size that triggers the evaluation of queued queries (default 256)
+        max_latency: float   -- maximal waiting time of a queued query in seconds (default 0.005)
 
     returns:
         ReachabilityEstimator object of the corresponding type
     """
     if type == 'distance':
-        return DistanceReachabilityEstimator(device=kwargs.get('device', 'cpu'), debug=kwargs.get('debug', False))
+        estimator = DistanceReachabilityEstimator(device=kwargs.get('device', 'cpu'), debug=kwargs.get('debug', False))
     elif type == 'neural_network':
-        return NetworkReachabilityEstimator(device=kwargs.get('device', 'cpu'), debug=kwargs.get('debug', False),
-                                            weights_file=kwargs.get('weights_file', None), with_spikings=kwargs.get('with_spikings', False))
+        estimator = NetworkReachabilityEstimator(device=kwargs.get('device', 'cpu'), debug=kwargs.get('debug', False),
+                                                 weights_file=kwargs.get('weights_file', None),
+                                                 with_spikings=kwargs.get('with_spikings', False))
     elif type == 'simulation':
-        return SimulationReachabilityEstimator(device=kwargs.get('device', 'cpu'), debug=kwargs.get('debug', False),
-                                               env_model=kwargs.get('env_model', None))
+        estimator = SimulationReachabilityEstimator(device=kwargs.get('device', 'cpu'), debug=kwargs.get('debug', False),
+                                                    env_model=kwargs.get('env_model', None))
     elif type == 'view_overlap':
-        return ViewOverlapReachabilityEstimator(device=kwargs.get('device', 'cpu'), debug=kwargs.get('debug', False))
-    
+        estimator = ViewOverlapReachabilityEstimator(device=kwargs.get('device', 'cpu'),
+                                                     debug=kwargs.get('debug', False))
     elif type == 'shortcut':
-        return ShortcutReachabilityEstimator(device=kwargs.get('device', 'cpu'), debug=kwargs.get('debug', False))
-
-    print("Reachability estimator type not defined: " + type)
-    return None
+        estimator = ShortcutReachabilityEstimator(device=kwargs.get('device', 'cpu'), debug=kwargs.get('debug', False))
+    elif type == 'inference_server':
+        from system.controller.reachability_estimator.inference_server import RemoteReachabilityEstimator, \
+            default_socket_path
+        estimator = RemoteReachabilityEstimator(socket_path=kwargs.get('socket_path', default_socket_path),
+                                                debug=kwargs.get('debug', False))
+    elif type == 'compiled':
+        from system.controller.reachability_estimator.model_export import CompiledReachabilityEstimator
+        estimator = CompiledReachabilityEstimator(kwargs['artifact_file'], device=kwargs.get('device', 'cpu'),
+                                                  debug=kwargs.get('debug', False))
+    else:
+        print("Reachability estimator type not defined: " + type)
+        return None
+
+    if kwargs.get('cached', False):
+        from system.controller.reachability_estimator.reachability_cache import CachedReachabilityEstimator
+        estimator = CachedReachabilityEstimator(estimator)
+    if kwargs.get('micro_batching', False):
+        from system.controller.reachability_estimator.micro_batching import MicroBatchingReachabilityEstimator
+        estimator = MicroBatchingReachabilityEstimator(estimator, max_batch_size=kwargs.get('max_batch_size', 256),
+                                                       max_latency=kwargs.get('max_latency', 0.005))
+    return estimator
 
 
 class ReachabilityEstimator:
+    # attributes of the place cells the predictions depend on, see reachability_cache
+    fingerprint_attributes = ("env_coordinates", "observations", "gc_connections", "egocentric_coordinates", "image",
+                              "head_direction")
+
     def __init__(self, threshold_same: float, threshold_reachable: float, device: str = 'cpu', debug: bool = False):
         """ Abstract base class defining the interface for reachability estimator implementations.
 
@@ -82,6 +114,11 @@ class ReachabilityEstimator:
         if self.debug:
             print(*params)
 
+    def signature(self) -> str:
+        """ Identifies the estimator and its configuration, reachability values of estimators with equal
+            signatures are interchangeable """
+        return "%s(%s, %s)" % (type(self).__name__, self.threshold_same, self.threshold_reachable)
+
     def predict_reachability(self, start: PlaceCell, goal: PlaceCell) -> float:
         """ Abstract function, determines reachability factor between two locations """
         pass
@@ -96,6 +133,34 @@ class ReachabilityEstimator:
         reachability_factor = self.predict_reachability(p, q)
         return self.pass_threshold(reachability_factor, self.threshold_reachable), reachability_factor
 
+    def predict_reachability_pairs(self, pairs: [(PlaceCell, PlaceCell)]) -> [float]:
+        """ Determines reachability factors for multiple pairs of locations.
+            Estimators without a batched implementation evaluate the pairs one by one.
+
+        arguments:
+        pairs: [(PlaceCell, PlaceCell)] -- (start, goal) pairs
+
+        returns:
+        [float] -- reachability factor of every pair
+        """
+        return [self.predict_reachability(p, q) for p, q in pairs]
+
+    def get_reachability_pairs(self, pairs: [(PlaceCell, PlaceCell)]) -> ([bool], [float]):
+        """ Determines for multiple pairs of nodes whether they are reachable based on the reachability threshold
+
+        arguments:
+        pairs: [(PlaceCell, PlaceCell)] -- (start, goal) pairs
+
+        returns:
+        [bool]  -- flags that indicate that locations are reachable
+        [float] -- reachability probabilities
+        """
+        if len(pairs) == 0:
+            return [], []
+        reachability_factors = list(self.predict_reachability_pairs(pairs))
+        return [self.pass_threshold(factor, self.threshold_reachable) for factor in reachability_factors], \
+            reachability_factors
+
     def pass_threshold(self, reachability_factor, threshold) -> bool:
         """ Abstract function, decides if the reachability value passes the threshold """
         pass
@@ -108,8 +173,18 @@ class ReachabilityEstimator:
         """ Computes connectivity probability based on reachability factor """
         return reachability_factor
 
+    def forget_nodes(self, nodes: [int] = None):
+        """ Drops data cached for map nodes, called when nodes are removed from the map or a map is loaded
+
+        arguments:
+        nodes: [int] -- ids of the nodes, None: all nodes
+        """
+        pass
+
 
 class DistanceReachabilityEstimator(ReachabilityEstimator):
+    fingerprint_attributes = ("env_coordinates",)
+
     def __init__(self, device='cpu', debug=False):
         """ Creates a reachability estimator that judges reachability between two locations based on the distance
             
@@ -123,14 +198,23 @@ class DistanceReachabilityEstimator(ReachabilityEstimator):
         """ Returns distance between start and goal as an estimation of reachability"""
         return np.linalg.norm(start.env_coordinates - goal.env_coordinates)
 
+    def predict_reachability_pairs(self, pairs: [(PlaceCell, PlaceCell)]) -> [float]:
+        """ Returns distances between all pairs in one vectorized computation """
+        starts = np.array([p.env_coordinates for p, _ in pairs], dtype=float)
+        goals = np.array([q.env_coordinates for _, q in pairs], dtype=float)
+        return np.linalg.norm(starts - goals, axis=1)
+
     def pass_threshold(self, reachability_factor: float, threshold: float) -> bool:
         """ Two nodes are reachable if the distance is less than the threshold """
         return reachability_factor < threshold
 
 
 class NetworkReachabilityEstimator(ReachabilityEstimator):
+    fingerprint_attributes = ("observations", "gc_connections")
+
     def __init__(self, device: str = 'cpu', debug: bool = True, weights_file: str = None, with_spikings: bool = False,
-                 weights_folder: str = None, backbone: str = 'convolutional', batch_size: int = 64):
+                 weights_folder: str = None, backbone: str = 'convolutional', batch_size: int = 64,
+                 inference_batch_size: int = 256, factored: bool = True):
         """ Creates a network-based reachability estimator that judges reachability
             between two locations based on observations and grid cell spikings
 
@@ -141,8 +225,12 @@ class NetworkReachabilityEstimator(ReachabilityEstimator):
         with_spikings: bool -- flag indicates whether to include grid cell firing to input
         weights_folder: sre -- path to the folder with weights files
         backbone: str       -- variant of the neural network, used when not loading from a snapshot, possible values:
-                               ['convolutional' (default), 'resnet', 'siamese']
+                               ['convolutional' (default), 'resnet', 'siamese', 'student']
         batch_size: int     -- size of batches (default 64), used when not loading from a snapshot
+        inference_batch_size: int -- size of the chunks in which pairs are passed through the network
+                                     by predict_reachability_pairs (default 256)
+        factored: bool      -- if True and the network allows it: images are encoded once per place cell and
+                               the embeddings are cached by node id, pairs only run the pair head
         """
         super().__init__(threshold_same=0.933, threshold_reachable=0.4, device=device, debug=debug)
 
@@ -150,6 +238,8 @@ class NetworkReachabilityEstimator(ReachabilityEstimator):
         if weights_folder is None:
             weights_folder = os.path.join(get_path(), "data/models")
         weights_filepath = os.path.join(weights_folder, weights_file)
+        with open(weights_filepath, 'rb') as f:
+            self.weights_hash = hashlib.sha1(f.read()).hexdigest()
         state_dict = torch.load(weights_filepath, map_location='cpu')
         self.print_debug('loaded %s' % weights_file)
         global_args = state_dict.get('global_args', {})
@@ -159,8 +249,9 @@ class NetworkReachabilityEstimator(ReachabilityEstimator):
         self.backbone = global_args.get('backbone', backbone)
         self.model_variant = global_args['model_variant']
         self.batch_size = global_args.get('batch_size', batch_size)
+        self.inference_batch_size = inference_batch_size
 
-        self.nets = networks.initialize_network(self.backbone, self.model_variant)
+        self.nets = networks.initialize_network(self.backbone, self.model_variant, pretrained=False)
         self.nets = {name: spec['net'] for name, spec in self.nets.items()}
 
         self.print_debug(self.nets)
@@ -169,8 +260,20 @@ class NetworkReachabilityEstimator(ReachabilityEstimator):
             net.load_state_dict(state_dict['nets'][name])
             net.train(False)
 
+        self.factored = factored and networks.is_factorable(self.backbone, self.model_variant)
+        self.embeddings = {}  # (node id, observation index) -> (observation version, embedding)
+        if factored and not self.factored:
+            self.print_debug('%s backbone with variant %s encodes image pairs jointly, '
+                             'embeddings can not be cached' % (self.backbone, self.model_variant))
+
+    def signature(self) -> str:
+        return "%s[%s, %s, %s, spikings=%s]" % (super().signature(), self.backbone, self.model_variant,
+                                                self.weights_hash, self.with_spikings)
+
     def predict_reachability(self, start: PlaceCell, goal: PlaceCell) -> float:
         """ Predicts reachability value between two locations """
+        if self.factored:
+            return self.predict_reachability_factored([(start, goal)])[0]
         if self.with_spikings:
             if isinstance(goal.gc_connections, list):
                 goal.gc_connections = np.array(goal.gc_connections)
@@ -179,10 +282,104 @@ class NetworkReachabilityEstimator(ReachabilityEstimator):
                                                    [spikings_reshape(np.array(goal.gc_connections).flatten())])[0]
         return self.predict_reachability_batch([start.observations[0]], [goal.observations[-1]])[0]
 
+    def forget_nodes(self, nodes: [int] = None):
+        if nodes is None:
+            self.embeddings = {}
+            return
+        nodes = set(nodes)
+        self.embeddings = {key: value for key, value in self.embeddings.items() if key[0] not in nodes}
+
+    def get_embeddings(self, place_cells: [PlaceCell], index: int) -> torch.Tensor:
+        """ Returns the embeddings of the observation at the index of each place cell.
+            Embeddings of map nodes are cached by node id and recomputed when the observation version of the
+            place cell changes, see PlaceCell.observation_changed. Place cells without a node id are encoded on
+            every call. The map drops the embeddings of removed nodes and of all nodes on load, see forget_nodes.
+
+        arguments:
+        place_cells: [PlaceCell] -- place cells, may contain duplicates
+        index: int               -- index of the observation, 0 for start and -1 for goal locations
+
+        returns:
+        torch.Tensor -- embeddings in the order of the place cells
+        """
+        embeddings = {}  # id of the place cell -> embedding, only used during this call
+        missing = {}
+        for pc in place_cells:
+            node = getattr(pc, 'node_id', None)
+            cached = self.embeddings.get((node, index)) if node is not None else None
+            if cached is not None and cached[0] == getattr(pc, 'observation_version', 0):
+                embeddings[id(pc)] = cached[1]
+            else:
+                missing[id(pc)] = pc
+        missing = list(missing.values())
+        for i in range(0, len(missing), self.inference_batch_size):
+            chunk = missing[i:i + self.inference_batch_size]
+            images = torch.from_numpy(np.array([pc.observations[index] for pc in chunk])).float()
+            with torch.no_grad():
+                chunk_embeddings = networks.get_embedding(self.nets, self.backbone, self.model_variant, images)
+            for pc, embedding in zip(chunk, chunk_embeddings.cpu().numpy()):
+                embeddings[id(pc)] = embedding
+                if getattr(pc, 'node_id', None) is not None:
+                    self.embeddings[(pc.node_id, index)] = (getattr(pc, 'observation_version', 0), embedding)
+        return torch.from_numpy(np.array([embeddings[id(pc)] for pc in place_cells]))
+
+    def predict_reachability_factored(self, pairs: [(PlaceCell, PlaceCell)]) -> [float]:
+        """ Predicts reachability for multiple pairs of place cells with the pair head on cached embeddings:
+            one encoder pass per place cell and a cheap head evaluation per pair
+        """
+        src_embeddings = dst_embeddings = src_spikings = dst_spikings = None
+        if self.backbone == 'siamese' or self.model_variant == 'spikings':
+            spikings = {}
+            for pc in [pc for pair in pairs for pc in pair]:
+                if id(pc) not in spikings:
+                    spikings[id(pc)] = spikings_reshape(np.array(pc.gc_connections).flatten())
+            src_spikings = torch.from_numpy(np.array([spikings[id(p)] for p, _ in pairs])).float()
+            dst_spikings = torch.from_numpy(np.array([spikings[id(q)] for _, q in pairs])).float()
+        if self.backbone != 'siamese':
+            src_embeddings = self.get_embeddings([p for p, _ in pairs], 0)
+            dst_embeddings = self.get_embeddings([q for _, q in pairs], -1)
+
+        def chunk(tensor, batch):
+            return tensor[batch] if tensor is not None else None
+
+        results = []
+        with torch.no_grad():
+            for i in range(0, len(pairs), self.inference_batch_size):
+                batch = slice(i, i + self.inference_batch_size)
+                results.append(networks.get_prediction_from_embeddings(
+                    self.nets, self.backbone, self.model_variant, chunk(src_embeddings, batch),
+                    chunk(dst_embeddings, batch), chunk(src_spikings, batch), chunk(dst_spikings, batch))[0])
+        return torch.cat(results, dim=0).data.cpu().numpy()
+
+    def predict_reachability_pairs(self, pairs: [(PlaceCell, PlaceCell)]) -> [float]:
+        """ Predicts reachability for multiple pairs of place cells in batches of inference_batch_size """
+        if len(pairs) == 0:
+            return []
+        if self.factored:
+            return self.predict_reachability_factored(pairs)
+        starts = [p.observations[0] for p, _ in pairs]
+        goals = [q.observations[-1] for _, q in pairs]
+        if not self.with_spikings:
+            return self.predict_reachability_batch(starts, goals, batch_size=self.inference_batch_size)
+
+        spikings = {}
+
+        def get_spikings(pc: PlaceCell):
+            """ Helper function, reshapes grid cell spikings once per place cell """
+            if id(pc) not in spikings:
+                spikings[id(pc)] = spikings_reshape(np.array(pc.gc_connections).flatten())
+            return spikings[id(pc)]
+
+        src_spikings = [get_spikings(p) for p, _ in pairs]
+        goal_spikings = [get_spikings(q) for _, q in pairs]
+        return self.predict_reachability_batch(starts, goals, src_spikings, goal_spikings,
+                                               batch_size=self.inference_batch_size)
+
     def predict_reachability_batch(self, starts: Union[List[numpy.ndarray], List[torch.Tensor]], 
                                    goals: Union[List[numpy.ndarray], List[torch.Tensor]],
                                    src_spikings: Union[List[numpy.ndarray], List[torch.Tensor]] = None,
-                                   goal_spikings: Union[List[numpy.ndarray], List[torch.Tensor]] = None) -> List[float]:
+                                   goal_spikings: Union[List[numpy.ndarray], List[torch.Tensor]] = None,
+                                   batch_size: int = None) -> List[float]:
         """ Predicts reachability for multiple location pairs
 
         arguments:
@@ -192,6 +389,8 @@ class NetworkReachabilityEstimator(ReachabilityEstimator):
                                                          of each pair, nullable
         goal_spikings: [numpy.ndarray | torch.Tensor] -- grid cell firings corresponding to the second locations
                                                          of each pair, nullable
+        batch_size: int                               -- number of pairs per forward pass,
+                                                         if None: batch size of the snapshot
 
         returns:
         [float] -- reachability values
@@ -237,12 +436,12 @@ class NetworkReachabilityEstimator(ReachabilityEstimator):
 
         results = []
         n_remaining = n
-        batch_size = min(self.batch_size, len(starts))
+        batch_size = min(batch_size or self.batch_size, len(starts))
         while n_remaining > 0:
-            results.append(get_prediction(starts[n - n_remaining: n - n_remaining + batch_size],
-                                          goals[n - n_remaining: n - n_remaining + batch_size],
-                                          src_spikings[n - n_remaining: n - n_remaining + batch_size],
-                                          goal_spikings[n - n_remaining: n - n_remaining + batch_size])[0])
+            batch = slice(n - n_remaining, n - n_remaining + batch_size)
+            results.append(get_prediction(starts[batch], goals[batch],
+                                          src_spikings[batch] if src_spikings is not None else None,
+                                          goal_spikings[batch] if goal_spikings is not None else None)[0])
             n_remaining -= batch_size
         return torch.cat(results, dim=0).data.cpu().numpy()
 
@@ -256,9 +455,30 @@ class NetworkReachabilityEstimator(ReachabilityEstimator):
 
 ##MANUEL. TEST THE SHORTCUT REACHABILITY ESTIMATOR
 class ShortcutReachabilityEstimator(ReachabilityEstimator):
-    def __init__(self, threshold_same=0.4, threshold_reachable=0.75, distance_threshold=2.0, device='cpu', debug=False):
+    # image similarity scale on descriptor distances, calibrate_image_alpha on 200 camera images at random poses in
+    # Savinov_val3 (see __main__), views 0.1 m and 3 degrees apart get a median similarity of 0.84
+    default_image_alpha = 1.99
+    fingerprint_attributes = ("egocentric_coordinates", "image", "head_direction")
+
+    def __init__(self, threshold_same=0.4, threshold_reachable=0.75, distance_threshold=2.0, device='cpu', debug=False,
+                 image_alpha=None):
+        """ Creates a reachability estimator that detects shortcuts based on egocentric coordinates,
+            image and head direction similarity
+
+        arguments:
+        threshold_same: float      -- threshold for determining when nodes are close enough to be considered same node
+        threshold_reachable: float -- threshold for determining when nodes are close enough to be considered reachable
+        distance_threshold: float  -- maximal distance of egocentric coordinates for a shortcut
+        device                     -- device used for calculations (default cpu)
+        debug: bool                -- enables logging
+        image_alpha: float         -- similarity scale on image descriptor distances (default default_image_alpha)
+        """
         super().__init__(threshold_same, threshold_reachable, device, debug)
         self.distance_threshold = distance_threshold
+        self.image_alpha = image_alpha if image_alpha is not None else self.default_image_alpha
+
+    def signature(self) -> str:
+        return "%s[%s, %s]" % (super().signature(), self.distance_threshold, self.image_alpha)
 
     def predict_reachability(self, start: PlaceCell, goal: PlaceCell) -> float:
         # Use egocentric coordinates to detect if there's a shortcut
@@ -267,20 +487,83 @@ class ShortcutReachabilityEstimator(ReachabilityEstimator):
             return self.compute_similarity(start, goal)
         return 0.0 
 
+    def predict_reachability_pairs(self, pairs: [(PlaceCell, PlaceCell)]) -> [float]:
+        """ Predicts reachability for multiple pairs with one similarity matrix between the descriptors of the
+            distinct start and goal place cells
+        """
+        if len(pairs) == 0:
+            return []
+
+        def rows(place_cells):
+            """ Helper function, returns the distinct place cells and the row of each given place cell """
+            index = {}
+            for pc in place_cells:
+                index.setdefault(id(pc), (len(index), pc))
+            return [pc for _, pc in index.values()], np.array([index[id(pc)][0] for pc in place_cells])
+
+        starts, start_rows = rows([p for p, _ in pairs])
+        goals, goal_rows = rows([q for _, q in pairs])
+        distances = np.linalg.norm(np.array([p.egocentric_coordinates for p, _ in pairs], dtype=float)
+                                   - np.array([q.egocentric_coordinates for _, q in pairs], dtype=float), axis=1)
+        image_similarity = self.compute_image_similarity_matrix(descriptor_matrix(starts),
+                                                                descriptor_matrix(goals))[start_rows, goal_rows]
+        head_direction_similarity = self.compute_head_direction_similarity(
+            np.array([p.head_direction for p, _ in pairs], dtype=float),
+            np.array([q.head_direction for _, q in pairs], dtype=float))
+        return np.where(distances < self.distance_threshold, (image_similarity + head_direction_similarity) / 2.0, 0.0)
+
     def compute_similarity(self, start: PlaceCell, goal: PlaceCell) -> float:
-        image_similarity = self.compute_image_similarity(start.image, goal.image)
+        image_similarity = self.compute_image_similarity(get_image_descriptor(start), get_image_descriptor(goal))
         head_direction_similarity = self.compute_head_direction_similarity(start.head_direction, goal.head_direction)
         overall_similarity = (image_similarity + head_direction_similarity) / 2.0
         return overall_similarity
 
-    def compute_image_similarity(self, image1, image2):
-        """Compute image similarity based on the method described in the paper."""
-        distance = np.linalg.norm(image1 - image2)
+    def compute_image_similarity(self, descriptor1, descriptor2):
+        """Compute image similarity of two image descriptors based on the method described in the paper."""
+        distance = np.linalg.norm(descriptor1 - descriptor2)
         # similarity function f1 -> vom paperrr
-        alpha = 15
-        similarity = max(0, 1 - distance / alpha)
+        similarity = max(0, 1 - distance / self.image_alpha)
         return similarity
 
+    def compute_image_similarity_matrix(self, descriptors1: np.ndarray, descriptors2: np.ndarray) -> np.ndarray:
+        """ Vectorized image similarity between all rows of two descriptor matrices
+
+        arguments:
+        descriptors1: numpy.ndarray -- descriptor matrix of shape (n, d)
+        descriptors2: numpy.ndarray -- descriptor matrix of shape (m, d)
+
+        returns:
+        numpy.ndarray -- similarity matrix of shape (n, m)
+        """
+        # float64, the expansion of the squared distance cancels out in float32 for similar descriptors
+        descriptors1 = np.asarray(descriptors1, dtype=np.float64)
+        descriptors2 = np.asarray(descriptors2, dtype=np.float64)
+        squared = (np.sum(descriptors1 ** 2, axis=1)[:, None] + np.sum(descriptors2 ** 2, axis=1)[None, :]
+                   - 2 * descriptors1 @ descriptors2.T)
+        distances = np.sqrt(np.maximum(squared, 0))
+        return np.maximum(0, 1 - distances / self.image_alpha)
+
+    def calibrate_image_alpha(self, images: [np.ndarray], quantile: float = 0.1) -> float:
+        """ Calibrates the image similarity scale on camera images of the environment.
+            The alpha of the paper (15 on raw-pixel distances) is smaller than the raw distance of any two views
+            that are not identical, rescaling it to descriptors keeps that property. Instead alpha is set to the
+            given quantile of the descriptor distances between the sample images, so only that fraction of
+            pairs of random views gets a non-zero image similarity.
+
+        arguments:
+        images: [numpy.ndarray] -- sample camera images of the environment taken at random poses
+        quantile: float         -- fraction of the image pairs with non-zero similarity (default 0.1)
+
+        returns:
+        float -- new image alpha, also stored in the estimator
+        """
+        descriptors = np.array([compute_image_descriptor(image) for image in images])
+        i, j = np.triu_indices(len(images), k=1)
+        distances = np.linalg.norm(descriptors[i] - descriptors[j], axis=1)
+        self.image_alpha = float(np.quantile(distances, quantile))
+        self.print_debug("calibrated image alpha %f" % self.image_alpha)
+        return self.image_alpha
+
     def compute_head_direction_similarity(self, direction1, direction2):
         """Compute head direction similarity based on angular difference."""
         return 1.0 - np.abs(direction1 - direction2) / np.pi
@@ -289,6 +572,8 @@ class ShortcutReachabilityEstimator(ReachabilityEstimator):
         return reachability_factor >= threshold
 
 class SimulationReachabilityEstimator(ReachabilityEstimator):
+    fingerprint_attributes = ("env_coordinates", "gc_connections")
+
     def __init__(self, device='cpu', debug=False, env_model=None):
         """ Creates a reachability estimator that judges reachability
             between two locations based success of navigation simulation
@@ -303,6 +588,9 @@ class SimulationReachabilityEstimator(ReachabilityEstimator):
         self.env_model = env_model
         self.fov = 120 * np.pi / 180
 
+    def signature(self) -> str:
+        return "%s[%s]" % (super().signature(), self.env_model)
+
     def predict_reachability(self, start: PlaceCell, goal: PlaceCell) -> float:
         """ Determines reachability factor between two locations """
         from system.controller.local_controller.local_navigation import setup_gc_network, vector_navigation
@@ -353,6 +641,8 @@ class SimulationReachabilityEstimator(ReachabilityEstimator):
 
 
 class ViewOverlapReachabilityEstimator(ReachabilityEstimator):
+    fingerprint_attributes = ("env_coordinates",)
+
     def __init__(self, device='cpu', debug=False):
         """ Creates a reachability estimator that judges reachability
             between two locations based the overlap of their fields of view
@@ -369,6 +659,9 @@ class ViewOverlapReachabilityEstimator(ReachabilityEstimator):
         self.distance_threshold = 0.7
         self.map_layout = MapLayout(self.env_model)
 
+    def signature(self) -> str:
+        return "%s[%s, %s]" % (super().signature(), self.env_model, self.distance_threshold)
+
     def predict_reachability(self, start: PlaceCell, goal: PlaceCell) -> float:
         """ Reachability Score based on the view overlap of start and goal in the environment """
         # untested and unfinished
@@ -389,3 +682,24 @@ def spikings_reshape(img_array):
     """ Helper function, image stored in array form to image in correct shape for nn """
     img = np.reshape(img_array, (6, 40, 40))
     return img
+
+
+if __name__ == "__main__":
+    """ Calibrate the image similarity scale of the shortcut estimator on camera images taken at random poses """
+    from system.controller.simulation.pybullet_environment import PybulletEnvironment
+
+    env_model = "Savinov_val3"
+    nr_images = 200
+    rng = np.random.default_rng(0)
+
+    map_layout = MapLayout(env_model)
+    locations = map_layout.get_reachable_locations()
+    env = PybulletEnvironment(False, 1e-2, env_model, build_data_set=True)
+    images = []
+    for index in rng.choice(len(locations), nr_images):
+        position = map_layout.path_coord_to_map_coord(*locations[index])
+        images.append(env.camera((position, rng.uniform(-np.pi, np.pi))))
+    env.end_simulation()
+
+    estimator = ShortcutReachabilityEstimator()
+    print("image alpha: %f" % estimator.calibrate_image_alpha(images))
@@ -0,0 +1,236 @@
+""" Distillation of a trained reachability model into the lightweight student backbone.
+
+    The student (networks.initialize_student) is trained on the soft labels of the teacher, mixed with the
+    ground truth reachability of the dataset. Position and angle are trained on the ground truth like in
+    train_multiframe_dst. The saved snapshot is loaded by NetworkReachabilityEstimator like any other model.
+"""
+import time
+
+import torch
+from torch.utils.data import DataLoader, RandomSampler
+from torch.utils.tensorboard import SummaryWriter
+import tabulate
+
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "..", ".."))
+
+from system.controller.reachability_estimator.networks import initialize_network, get_prediction
+from system.controller.reachability_estimator.reachability_estimation import NetworkReachabilityEstimator
+from system.controller.reachability_estimator.training.H5Dataset import H5Dataset, H5DatasetWithSpikings
+from system.controller.reachability_estimator.training.train_multiframe_dst import get_path, _save_model
+
+
+def distillation_loss(student_prediction, teacher_prediction, reachability, temperature, soft_label_weight):
+    """ Binary cross entropy against the temperature-softened teacher predictions and the ground truth
+
+    arguments:
+    student_prediction -- reachability predicted by the student
+    teacher_prediction -- reachability predicted by the teacher
+    reachability       -- ground truth reachability
+    temperature        -- softens both predictions on the logit scale, 1: no softening
+    soft_label_weight  -- weight of the soft labels, the ground truth gets the rest
+    """
+    student_soft = torch.sigmoid(torch.logit(student_prediction, eps=1e-6) / temperature)
+    teacher_soft = torch.sigmoid(torch.logit(teacher_prediction, eps=1e-6) / temperature)
+    soft_loss = torch.nn.functional.binary_cross_entropy(student_soft, teacher_soft, reduction='none')
+    hard_loss = torch.nn.functional.binary_cross_entropy(student_prediction, reachability, reduction='none')
+    return soft_label_weight * temperature ** 2 * soft_loss + (1 - soft_label_weight) * hard_loss
+
+
+def unpack(item, with_grid_cell_spikings, device):
+    """ Helper function, moves a batch of the dataset to the device """
+    if with_grid_cell_spikings:
+        src_imgs, dst_imgs, reachability, transformation, src_spikings, dst_spikings = item
+        src_spikings = src_spikings.to(device=device, non_blocking=True).float()
+        dst_spikings = dst_spikings.to(device=device, non_blocking=True).float()
+    else:
+        src_imgs, dst_imgs, reachability, transformation = item
+        src_spikings = dst_spikings = None
+    return (src_imgs.to(device=device, non_blocking=True).float(),
+            dst_imgs.to(device=device, non_blocking=True).float(),
+            torch.clamp(reachability.to(device=device, non_blocking=True).float(), 0.0, 1.0),
+            transformation.to(device=device, non_blocking=True).float(), src_spikings, dst_spikings)
+
+
+def compare_with_teacher(teacher: NetworkReachabilityEstimator, nets, global_args, loader) -> dict:
+    """ Accuracy of teacher and student on the ground truth, their agreement and throughput in pairs per second """
+    model_variant, with_grid_cell_spikings, device = \
+        [global_args[_] for _ in ['model_variant', 'with_grid_cell_spikings', 'train_device']]
+    threshold = teacher.threshold_reachable
+    nr_pairs = nr_teacher_correct = nr_student_correct = nr_agreeing = 0
+    teacher_time = student_time = 0.0
+    for net in nets.values():
+        net.train(False)
+    with torch.no_grad():
+        for item in loader:
+            src_batch, dst_batch, r, transformation, src_spikings, dst_spikings = \
+                unpack(item, with_grid_cell_spikings, device)
+
+            start = time.perf_counter()
+            teacher_prediction = get_prediction(teacher.nets, teacher.backbone, teacher.model_variant, src_batch,
+                                                dst_batch, transformation, src_spikings, dst_spikings)[0]
+            teacher_time += time.perf_counter() - start
+            start = time.perf_counter()
+            student_prediction = get_prediction(nets, 'student', model_variant, src_batch, dst_batch, transformation,
+                                                src_spikings, dst_spikings)[0]
+            student_time += time.perf_counter() - start
+
+            nr_pairs += len(r)
+            nr_teacher_correct += ((teacher_prediction > threshold) == (r > 0.5)).sum().item()
+            nr_student_correct += ((student_prediction > threshold) == (r > 0.5)).sum().item()
+            nr_agreeing += ((teacher_prediction > threshold) == (student_prediction > threshold)).sum().item()
+    for net in nets.values():
+        net.train(True)
+    return {'teacher_accuracy': nr_teacher_correct / nr_pairs, 'student_accuracy': nr_student_correct / nr_pairs,
+            'agreement': nr_agreeing / nr_pairs, 'teacher_pairs_per_second': nr_pairs / teacher_time,
+            'student_pairs_per_second': nr_pairs / student_time, 'speedup': teacher_time / student_time}
+
+
+def train_distillation(teacher: NetworkReachabilityEstimator, nets, net_opts, dataset, global_args):
+    """ Train the student on the soft labels of the teacher """
+    (
+        model_file,
+        batch_size,
+        samples_per_epoch,
+        max_epochs,
+        lr_decay_epoch,
+        lr_decay_rate,
+        n_dataset_worker,
+        train_device,
+        log_interval,
+        save_interval,
+        model_variant,
+        position_loss_weight,
+        angle_loss_weight,
+        with_grid_cell_spikings,
+        temperature,
+        soft_label_weight
+    ) = [global_args[_] for _ in ['model_file',
+                                  'batch_size',
+                                  'samples_per_epoch',
+                                  'max_epochs',
+                                  'lr_decay_epoch',
+                                  'lr_decay_rate',
+                                  'n_dataset_worker',
+                                  'train_device',
+                                  'log_interval',
+                                  'save_interval',
+                                  'model_variant',
+                                  'position_loss_weight',
+                                  'angle_loss_weight',
+                                  'with_grid_cell_spikings',
+                                  'temperature',
+                                  'soft_label_weight'
+    ]]
+
+    writer = SummaryWriter()
+    net_scheds = {
+        name: torch.optim.lr_scheduler.StepLR(opt, step_size=lr_decay_epoch, gamma=lr_decay_rate)
+        for name, opt in net_opts.items()
+    }
+
+    train_size = int(0.8 * len(dataset))
+    valid_size = len(dataset) - train_size
+    train_dataset, valid_dataset = torch.utils.data.random_split(dataset, [train_size, valid_size])
+    valid_loader = DataLoader(valid_dataset, batch_size=batch_size, num_workers=n_dataset_worker)
+
+    for epoch in range(1, max_epochs + 1):
+        print('===== epoch %d =====' % epoch)
+        loader = DataLoader(train_dataset,
+                            batch_size=batch_size,
+                            sampler=RandomSampler(train_dataset, True, samples_per_epoch),
+                            num_workers=n_dataset_worker,
+                            pin_memory=True,
+                            drop_last=True)
+
+        last_log_time = time.time()
+        for idx, item in enumerate(loader):
+            src_batch, dst_batch, r, transformation, src_spikings, dst_spikings = \
+                unpack(item, with_grid_cell_spikings, train_device)
+            position = transformation[:, 0:2]
+            angle = transformation[:, -1]
+
+            with torch.no_grad():
+                teacher_prediction = get_prediction(teacher.nets, teacher.backbone, teacher.model_variant,
+                                                    src_batch, dst_batch, transformation, src_spikings,
+                                                    dst_spikings)[0]
+
+            for _, opt in net_opts.items():
+                opt.zero_grad()
+
+            reachability_prediction, position_prediction, angle_prediction = get_prediction(
+                nets, 'student', model_variant, src_batch, dst_batch, transformation, src_spikings, dst_spikings)
+
+            loss = distillation_loss(reachability_prediction, teacher_prediction, r, temperature, soft_label_weight)
+            loss_position = torch.sqrt(torch.sum(
+                torch.nn.functional.mse_loss(position_prediction, position, reduction='none'), dim=1))
+            loss_angle = torch.sqrt(torch.nn.functional.mse_loss(angle_prediction, angle, reduction='none'))
+            loss = (loss + r @ (position_loss_weight * loss_position + angle_loss_weight * loss_angle)).sum()
+            loss.backward()
+
+            for _, opt in net_opts.items():
+                opt.step()
+
+            if idx % log_interval == 0:
+                print(f'epoch {epoch}; batch time {time.time() - last_log_time}; sec loss: {loss.item()}')
+                writer.add_scalar("Loss/distillation", loss, epoch * samples_per_epoch + idx * batch_size)
+                last_log_time = time.time()
+
+        for _, sched in net_scheds.items():
+            sched.step()
+
+        if epoch % save_interval == 0 or epoch == max_epochs:
+            print('saving model...')
+            _save_model(nets, net_opts, epoch, global_args, model_file)
+
+        comparison = compare_with_teacher(teacher, nets, global_args, valid_loader)
+        for name, value in comparison.items():
+            writer.add_scalar("Distillation/" + name, value, epoch)
+        print(tabulate.tabulate(comparison.items()))
+    writer.flush()
+
+
+if __name__ == '__main__':
+    """ Distill a trained reachability model into the student backbone """
+
+    global_args = {
+        'teacher_weights_file': "re_mse_weights.50",
+        'model_file': os.path.join(os.path.dirname(__file__), "../data/models/student_distilled"),
+        'batch_size': 64,
+        'samples_per_epoch': 10000,
+        'max_epochs': 30,
+        'lr_decay_epoch': 5,
+        'lr_decay_rate': 0.7,
+        'n_dataset_worker': 0,
+        'log_interval': 20,
+        'save_interval': 5,
+        'backbone': 'student',
+        'model_variant': "spikings",  # "pair_conv" for a student without the grid cell branch
+        'train_device': "cpu",
+        'position_loss_weight': 0.006,
+        'angle_loss_weight': 0.003,
+        'with_grid_cell_spikings': True,
+        'temperature': 2.0,
+        'soft_label_weight': 0.7,
+        'external_link': False
+    }
+
+    teacher = NetworkReachabilityEstimator(weights_file=global_args['teacher_weights_file'],
+                                           with_spikings=global_args['with_grid_cell_spikings'], debug=False,
+                                           factored=False)
+    nets = initialize_network(global_args['backbone'], global_args['model_variant'])
+
+    filepath = os.path.realpath(os.path.join(get_path(), "data/reachability", "dataset_spikings.hd5"))
+    if global_args['with_grid_cell_spikings']:
+        dataset = H5DatasetWithSpikings(filepath, global_args['external_link'])
+    else:
+        dataset = H5Dataset(filepath, global_args['external_link'])
+
+    train_distillation(
+        teacher,
+        nets={name: spec['net'] for name, spec in nets.items()},
+        net_opts={name: spec['opt'] for name, spec in nets.items() if spec['opt'] is not None},
+        dataset=dataset,
+        global_args=global_args)
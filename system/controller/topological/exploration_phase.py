@@ -10,6 +10,9 @@
 import sys
 import os
 
+import cv2
+import numpy as np
+
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
 
 from system.bio_model.grid_cell_model import GridCellNetwork
@@ -76,6 +79,292 @@ def waypoint_movement(path: [PlaceCell], env_model: str, gc_network: GridCellNet
     return pc_network, cognitive_map
 
 
+class CoverageGrid:
+    def __init__(self, map_layout: MapLayout, sensor_radius: float = 0.5, field_radius: float = 0.3):
+        """ Coverage of the reachable area of the environment on the grid of the path map
+
+        arguments:
+        map_layout: MapLayout -- layout of the environment
+        sensor_radius: float  -- radius around the poses of the agent that counts as covered in meters
+        field_radius: float   -- radius of the firing fields of place cells that counts as covered in meters
+        """
+        self.map_layout = map_layout
+        self.division = map_layout.path_map_division
+        self.sensor_radius = sensor_radius
+        self.field_radius = field_radius
+        self.reachable = (map_layout.reachable_area > 0).astype(np.uint8)
+        self.covered = np.zeros_like(self.reachable)
+        self.blocked = np.zeros_like(self.reachable)  # frontier cells whose goals could not be reached
+        self.nr_covered_place_cells = 0
+
+    def cell(self, coordinates) -> (int, int):
+        """ Returns the (x, y) cell of the coordinates """
+        return self.map_layout.grid_coord(coordinates[0], coordinates[1], self.division)
+
+    def coordinates(self, cell) -> (float, float):
+        """ Returns the coordinates of the (x, y) cell """
+        return self.map_layout.continuous_coord(cell[0], cell[1], self.division)
+
+    def cover(self, coordinates, radius: float):
+        """ Marks the cells within the radius around the coordinates """
+        cv2.circle(self.covered, self.cell(coordinates), int(round(radius * self.division)), 1, thickness=-1)
+
+    def cover_trajectory(self, trajectory):
+        for coordinates in trajectory:
+            self.cover(coordinates, self.sensor_radius)
+
+    def cover_place_cells(self, place_cells: [PlaceCell]):
+        """ Marks the firing fields of the place cells that were created since the last call """
+        for pc in place_cells[self.nr_covered_place_cells:]:
+            self.cover(pc.env_coordinates, self.field_radius)
+        self.nr_covered_place_cells = len(place_cells)
+
+    def coverage(self) -> float:
+        """ Returns the fraction of the reachable area that is covered """
+        return float(np.count_nonzero(self.covered & self.reachable)) / max(np.count_nonzero(self.reachable), 1)
+
+    def frontiers(self, min_size: int = 10) -> [([(int, int)], (float, float))]:
+        """ Returns the frontiers: connected groups of reachable, uncovered cells next to covered cells
+
+        arguments:
+        min_size: int -- minimal number of cells of a frontier
+
+        returns:
+        [([(int, int)], (float, float))] -- cells and center coordinates of the frontiers
+        """
+        border = (cv2.dilate(self.covered, np.ones((3, 3), np.uint8)) > 0) & (self.covered == 0)
+        frontier = (border & (self.reachable > 0) & (self.blocked == 0)).astype(np.uint8)
+        nr_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(frontier, connectivity=8)
+        frontiers = []
+        for label in range(1, nr_labels):
+            if stats[label, cv2.CC_STAT_AREA] < min_size:
+                continue
+            ys, xs = np.nonzero(labels == label)
+            cells = list(zip(xs, ys))
+            # the goal is the frontier cell closest to the centroid, the centroid itself may be an obstacle
+            closest = np.argmin((xs - centroids[label][0]) ** 2 + (ys - centroids[label][1]) ** 2)
+            frontiers.append((cells, self.coordinates(cells[closest])))
+        return frontiers
+
+
+def select_frontier(frontiers: [([(int, int)], (float, float))], position, strategy: str = "informative"):
+    """ Selects the frontier to explore next
+
+    arguments:
+    frontiers -- cells and center coordinates of the frontiers, see CoverageGrid.frontiers
+    position  -- current [x, y] coordinates of the agent
+    strategy  -- nearest: closest frontier, informative: largest frontier relative to its distance
+
+    returns:
+    ([(int, int)], (float, float)) -- selected frontier
+    """
+    distances = [np.linalg.norm(np.array(goal) - np.array(position)) for _, goal in frontiers]
+    if strategy == "nearest":
+        return frontiers[int(np.argmin(distances))]
+    elif strategy == "informative":
+        return frontiers[int(np.argmax([len(cells) / (1.0 + distance)
+                                        for (cells, _), distance in zip(frontiers, distances)]))]
+    raise ValueError(f"Frontier selection strategy {strategy} is not supported")
+
+
+def thin_waypoints(map_layout: MapLayout, waypoints: [(float, float)], max_spacing: float = 1.0,
+                   clearance: float = 0.15) -> [(float, float)]:
+    """ Keeps only the waypoints needed to follow the path in straight lines
+
+    arguments:
+    map_layout: MapLayout -- layout of the environment
+    waypoints             -- dense waypoints of the A* path
+    max_spacing: float    -- maximal distance between kept waypoints in meters
+    clearance: float      -- minimal distance of the straight lines to obstacles in meters
+    """
+    if len(waypoints) < 3:
+        return list(waypoints)
+    thinned = [waypoints[0]]
+    i = 0
+    while i < len(waypoints) - 1:
+        j = i + 1
+        while j + 1 < len(waypoints) \
+                and np.linalg.norm(np.array(waypoints[j + 1]) - np.array(waypoints[i])) <= max_spacing \
+                and map_layout.visible(*waypoints[i], *waypoints[j + 1], distance_thres=clearance):
+            j += 1
+        thinned.append(waypoints[j])
+        i = j
+    return thinned
+
+
+def frontier_exploration(start, env_model: str, gc_network: GridCellNetwork, pc_network: PlaceCellNetwork,
+                         cognitive_map: CognitiveMapInterface, strategy: str = "informative",
+                         sensor_radius: float = 0.5, field_radius: float = 0.3, min_frontier_size: int = 10,
+                         target_coverage: float = 0.95, min_coverage_gain: float = 0.005, patience: int = 5,
+                         max_goals: int = 200):
+    """ Explores the environment by repeatedly navigating to a frontier of the covered area and builds the
+        cognitive map. Coverage is tracked on the occupancy grid from the poses of the agent and the firing fields
+        of the place cells. The exploration stops when the coverage saturates.
+
+    arguments:
+    start                                -- [x, y] start coordinates of the agent
+    env_model: str                       -- environment model
+    gc_network: GridCellNetwork          -- grid cell network
+    pc_network: PlaceCellNetwork         -- place cell network
+    cognitive_map: CognitiveMapInterface -- cognitive map object
+    strategy: str                        -- frontier selection, see select_frontier
+    sensor_radius: float                 -- radius around the poses of the agent that counts as covered
+    field_radius: float                  -- radius of the firing fields of place cells that counts as covered
+    min_frontier_size: int               -- minimal number of cells (5 cm) of a frontier
+    target_coverage: float               -- the exploration stops when this fraction of the area is covered
+    min_coverage_gain: float             -- minimal coverage gain of a goal that counts as progress
+    patience: int                        -- the exploration stops after this many goals without progress
+    max_goals: int                       -- maximal number of frontier goals
+
+    returns:
+    PlaceCellNetwork      -- place cell network
+    CognitiveMapInterface -- cognitive map
+    """
+    map_layout = MapLayout(env_model)
+    coverage = CoverageGrid(map_layout, sensor_radius=sensor_radius, field_radius=field_radius)
+    env = PybulletEnvironment(False, dt, env_model, "analytical", build_data_set=True, start=start)
+    coverage.cover(start, sensor_radius)
+
+    nr_goals_without_progress = 0
+    for i in range(max_goals):
+        fraction = coverage.coverage()
+        frontiers = coverage.frontiers(min_frontier_size)
+        if fraction >= target_coverage or not frontiers or nr_goals_without_progress >= patience:
+            break
+
+        cells, goal = select_frontier(frontiers, env.xy_coordinates[-1], strategy)
+        print_debug(f"frontier goal {i} at {goal}, {fraction * 100:.1f} % covered, {len(frontiers)} frontiers")
+        waypoints = map_layout.find_path(env.xy_coordinates[-1], goal)
+        if waypoints is None or len(waypoints) == 1 and np.ndim(waypoints[0][0]) > 0:
+            # A* found no path to the frontier and returned (start, goal), the frontier is not offered again
+            for x, y in cells:
+                coverage.blocked[y, x] = 1
+            nr_goals_without_progress += 1
+            continue
+
+        nr_poses = len(env.xy_coordinates)
+        for waypoint in thin_waypoints(map_layout, waypoints):
+            vector_navigation(env, list(waypoint), gc_network, model="analytical", step_limit=5000,
+                              obstacles=False, plot_it=False, exploration_phase=True, pc_network=pc_network,
+                              cognitive_map=cognitive_map)
+            coverage.cover_trajectory(env.xy_coordinates[nr_poses:])
+            nr_poses = len(env.xy_coordinates)
+        coverage.cover_place_cells(pc_network.place_cells)
+
+        # frontier cells that were not covered on the way are unreachable in practice
+        for x, y in cells:
+            if not coverage.covered[y, x]:
+                coverage.blocked[y, x] = 1
+
+        if coverage.coverage() - fraction < min_coverage_gain:
+            nr_goals_without_progress += 1
+        else:
+            nr_goals_without_progress = 0
+
+    print_debug(f"exploration finished after {len(env.xy_coordinates)} simulation steps,",
+                f"{coverage.coverage() * 100:.1f} % covered")
+    env.end_simulation()
+    if plotting:
+        cognitive_map.draw()
+        plot.plotTrajectoryInEnvironment(env, goal=False, cognitive_map=cognitive_map, trajectory=True)
+    return pc_network, cognitive_map
+
+
+def align_grid_code(gc_network: GridCellNetwork, displacement, max_speed: float = 0.5):
+    """ Path-integrates a straight movement by the given displacement without simulating the agent,
+        so that the grid cell state encodes a location relative to the same origin as the other workers.
+
+    arguments:
+    gc_network: GridCellNetwork -- grid cell network in its initial state
+    displacement                -- [x, y] vector from the start of the whole exploration to the start of the worker
+    max_speed: float            -- speed of the integrated movement in m/s
+    """
+    displacement = np.array(displacement, dtype=float)
+    distance = np.linalg.norm(displacement)
+    if distance == 0:
+        return
+    nr_steps = int(np.ceil(distance / (max_speed * dt)))
+    xy_speed = displacement / (nr_steps * dt)
+    for _ in range(nr_steps):
+        gc_network.track_movement(xy_speed)
+
+
+def explore_partition(arguments: dict):
+    """ Worker of the parallel exploration, explores one part of the waypoints with its own simulator,
+        grid cell network, place cell network and cognitive map.
+
+    arguments:
+    arguments: dict -- goals, origin, env_model, re_type and re_kwargs of the partition
+
+    returns:
+    [PlaceCell] -- place cells of the place cell network
+    nx.DiGraph  -- graph of the cognitive map
+    dict        -- node id -> PlaceCell of the cognitive map
+    """
+    global plotting, debug
+    plotting = False
+    debug = False
+
+    from system.controller.reachability_estimator.reachability_estimation import reachability_estimator_factory
+
+    # all workers load the grid cell network saved by the main process, so their grid codes are comparable
+    gc_network = GridCellNetwork(40, 6, dt, 0.2, gmax=2.4, from_data=True, gc_name="gc_model")
+    align_grid_code(gc_network, np.array(arguments["goals"][0]) - np.array(arguments["origin"]))
+
+    re = reachability_estimator_factory(arguments["re_type"], **arguments["re_kwargs"])
+    pc_network = PlaceCellNetwork(reach_estimator=re)
+    cognitive_map = LifelongCognitiveMap(reachability_estimator=re, debug=False)
+    waypoint_movement(arguments["goals"], arguments["env_model"], gc_network, pc_network, cognitive_map)
+    return pc_network.place_cells, cognitive_map.node_network, cognitive_map.place_cells
+
+
+def parallel_exploration(goals: [[float]], env_model: str, nr_workers: int, re_type: str, re_kwargs: dict,
+                         merge_distance: float = 0.1, min_firing: float = 0.9):
+    """ Splits the waypoints into consecutive parts that are explored by worker processes in parallel and
+        merges their place cell networks and cognitive maps. Consecutive parts share a waypoint,
+        so their maps overlap.
+
+    arguments:
+    goals: [[float]]      -- waypoints of the whole exploration
+    env_model: str        -- environment model
+    nr_workers: int       -- number of worker processes
+    re_type: str          -- type of the reachability estimator, see reachability_estimator_factory
+    re_kwargs: dict       -- arguments of the reachability estimator
+    merge_distance: float -- maximal distance of place cells of different workers that are merged
+    min_firing: float     -- minimal firing of a place cell at the grid cell state of a place cell it is merged with
+
+    returns:
+    PlaceCellNetwork     -- merged place cell network, contains the place cells of the merged map
+    LifelongCognitiveMap -- merged cognitive map
+    """
+    import multiprocessing
+    from system.controller.reachability_estimator.reachability_estimation import reachability_estimator_factory
+
+    # the main process creates and saves the grid cell network that the workers load
+    setup_gc_network(dt)
+
+    nr_workers = max(1, min(nr_workers, len(goals) - 1))
+    bounds = np.linspace(0, len(goals) - 1, nr_workers + 1).astype(int)
+    partitions = [{"goals": goals[bounds[i]:bounds[i + 1] + 1], "origin": goals[0], "env_model": env_model,
+                   "re_type": re_type, "re_kwargs": re_kwargs} for i in range(nr_workers)]
+
+    with multiprocessing.get_context("spawn").Pool(nr_workers) as pool:
+        results = pool.map(explore_partition, partitions)
+
+    re = reachability_estimator_factory(re_type, **re_kwargs)
+    cognitive_map = LifelongCognitiveMap(reachability_estimator=re, debug=debug)
+    partition_of = {}
+    for i, (_, graph, place_cells) in enumerate(results):
+        mapping = cognitive_map.merge_graph(graph, place_cells, merge_distance=merge_distance, min_firing=min_firing)
+        for node in mapping.values():
+            partition_of.setdefault(node, i)
+    cognitive_map.connect_partitions(partition_of)
+
+    pc_network = PlaceCellNetwork(reach_estimator=re)
+    pc_network.place_cells = list(cognitive_map.place_cells.values())
+    return pc_network, cognitive_map
+
+
 if __name__ == "__main__":
     """ 
     Create a cognitive map by exploring the environment. 
@@ -87,6 +376,8 @@ if __name__ == "__main__":
     re_weights_file = "re_mse_weights.50"
     cognitive_map_filename = "after_exploration1.gpickle"
     env_model = "Savinov_val3"  # only one currently supported
+    nr_workers = 1  # number of parallel exploration workers, 1: a single agent explores all waypoints
+    exploration = "waypoints"  # waypoints: follow the hard-coded goals, frontier: explore frontiers of the covered area
 
     goals = [
         [-2, 0], [-6, -2.5], [-4, 0.5], [-6.5, 0.5], [-7.5, -2.5], [-2, -1.5], [1, -1.5],
@@ -94,13 +385,26 @@ if __name__ == "__main__":
         [-8.5, -4], [-7.5, -3.5], [1.5, -3.5], [-6, -2.5]
     ]
 
-    gc_network = setup_gc_network(dt)
-    re = reachability_estimator_factory(re_type, weights_file=re_weights_file, env_model=env_model,
-                                        debug=debug, with_spikings=True)
-    pc_network = PlaceCellNetwork(reach_estimator=re)
-    cognitive_map = LifelongCognitiveMap(reachability_estimator=re)
+    if exploration == "frontier":
+        gc_network = setup_gc_network(dt)
+        re = reachability_estimator_factory(re_type, weights_file=re_weights_file, env_model=env_model,
+                                            debug=debug, with_spikings=True)
+        pc_network = PlaceCellNetwork(reach_estimator=re)
+        cognitive_map = LifelongCognitiveMap(reachability_estimator=re)
+
+        pc_network, cognitive_map = frontier_exploration(goals[0], env_model, gc_network, pc_network, cognitive_map)
+    elif nr_workers > 1:
+        pc_network, cognitive_map = parallel_exploration(
+            goals, env_model, nr_workers, re_type,
+            dict(weights_file=re_weights_file, env_model=env_model, debug=False, with_spikings=True))
+    else:
+        gc_network = setup_gc_network(dt)
+        re = reachability_estimator_factory(re_type, weights_file=re_weights_file, env_model=env_model,
+                                            debug=debug, with_spikings=True)
+        pc_network = PlaceCellNetwork(reach_estimator=re)
+        cognitive_map = LifelongCognitiveMap(reachability_estimator=re)
 
-    pc_network, cognitive_map = waypoint_movement(goals, env_model, gc_network, pc_network, cognitive_map)
+        pc_network, cognitive_map = waypoint_movement(goals, env_model, gc_network, pc_network, cognitive_map)
     cognitive_map.postprocess_topological_navigation()
 
     pc_network.save_pc_network()
@@ -0,0 +1,232 @@
+""" Log of vector navigation outcomes and offline replay of the edge updates of the lifelong cognitive map.
+
+    TopologicalNavigation appends one record per updated edge to a log file (one JSON object per line). Every record
+    names the snapshot the navigation started from and the session, i.e. the number of the process that loaded this
+    snapshot, because every session starts again from the stored snapshot.
+    replay_outcomes applies the Bayesian connectivity and weight updates of LifelongCognitiveMap for all logged
+    records, vectorized over the edges, so that other priors or update parameters can be evaluated on the same
+    navigation runs without simulating them again.
+"""
+import json
+import os
+
+import networkx as nx
+import numpy as np
+
+# parameters of edges that are created during navigation, see LifelongCognitiveMap.process_add_edge
+default_edge_parameters = {"connectivity_probability": 0.8, "mu": 0.5, "sigma": 0.015}
+
+
+class NavigationOutcomeLog:
+    def __init__(self, filepath: str, map_file: str = None):
+        """ Append-only log of navigation outcomes, one JSON record per line
+
+        arguments:
+        filepath: str -- file the records are appended to
+        map_file: str -- filename of the snapshot of the cognitive map the navigation starts from
+        """
+        self.filepath = filepath
+        self.map_file = map_file
+        directory = os.path.dirname(filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # sessions of the same snapshot are numbered in the order they were logged
+        sessions = [record.get("session", 0) for record in self.read() if record.get("map") == map_file]
+        self.session = max(sessions) + 1 if sessions else 0
+
+    def append(self, outcome: dict, **context):
+        """ Appends an outcome returned by LifelongCognitiveMap.postprocess_vector_navigation
+
+        arguments:
+        outcome: dict -- node_p, node_q, success and observed_weight of the updated edge
+        **context     -- additional information about the navigation, e.g. run, step or coordinates
+        """
+        record = dict(outcome)
+        record.update({"map": self.map_file, "session": self.session})
+        record.update({key: to_serializable(value) for key, value in context.items()})
+        with open(self.filepath, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def read(self) -> [dict]:
+        """ Returns all records of the log in the order they were written """
+        return load_outcomes(self.filepath)
+
+
+def to_serializable(value):
+    """ Helper function, converts numpy values to types supported by json """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [to_serializable(v) for v in value]
+    return value
+
+
+def load_outcomes(filepath: str) -> [dict]:
+    """ Reads the records of an outcome log, an incomplete last line of an interrupted run is ignored """
+    records = []
+    if not os.path.exists(filepath):
+        return records
+    with open(filepath) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def select_outcomes(records: [dict], map_file: str, session: int = None) -> [dict]:
+    """ Returns the records of one session that started from the snapshot
+
+    arguments:
+    records: [dict] -- logged outcomes
+    map_file: str   -- filename of the snapshot
+    session: int    -- number of the session, None: the last logged session of the snapshot
+    """
+    records = [record for record in records if record.get("map") == map_file]
+    if session is None:
+        session = max((record.get("session", 0) for record in records), default=0)
+    return [record for record in records if record.get("session", 0) == session]
+
+
+def replay_outcomes(graph: nx.DiGraph, records: [dict], p_s_given_r: float = 0.55, p_s_given_not_r: float = 0.15,
+                    sigma: float = 0.015, max_connectivity_probability: float = 0.95,
+                    threshold_edge_removal: float = 0.5, remove_edges: bool = True,
+                    rng: np.random.Generator = None, map_file: str = None, session: int = None) -> dict:
+    """ Applies the edge updates of LifelongCognitiveMap.update_edge_parameters for all records.
+        The k-th outcomes of all edges are applied at once, so the number of vectorized steps equals the
+        maximal number of outcomes of a single edge.
+
+    arguments:
+    graph: nx.DiGraph                   -- cognitive map graph providing the initial edge parameters,
+                                           edges missing in the graph start with default_edge_parameters
+    records: [dict]                     -- logged outcomes in the order of the navigation
+    p_s_given_r: float                  -- probability of success given the edge is traversable
+    p_s_given_not_r: float              -- probability of success given the edge is not traversable
+    sigma: float                        -- standard deviation of the observed weights
+    max_connectivity_probability: float -- upper bound of the connectivity probability
+    threshold_edge_removal: float       -- edges whose connectivity drops below this value after a failure are removed
+    remove_edges: bool                  -- if False: edges are never removed
+    rng: np.random.Generator            -- if given: weights are sampled around mu as during navigation,
+                                           otherwise the weight of an edge is its mu
+    map_file: str                       -- if given: only records of a session that started from this snapshot
+                                           are replayed, the snapshot has to be the one graph was loaded from
+    session: int                        -- session of the snapshot that is replayed, None: the last one
+
+    returns:
+    dict -- (node_p, node_q) -> parameters of the edge, an undirected edge is stored under its smaller node first;
+            parameters contain connectivity_probability, mu, sigma, weight, successes, failures and removed
+    """
+    if map_file is not None:
+        records = select_outcomes(records, map_file, session)
+    edges = sorted({tuple(sorted((record["node_p"], record["node_q"]))) for record in records})
+    if not edges:
+        return {}
+    edge_index = {edge: i for i, edge in enumerate(edges)}
+
+    def initial(p, q, name):
+        data = graph.edges[p, q] if graph.has_edge(p, q) else {}
+        return data.get(name, default_edge_parameters.get(name, 0))
+
+    connectivity = np.array([initial(p, q, "connectivity_probability") for p, q in edges], dtype=float)
+    mu = np.array([initial(p, q, "mu") for p, q in edges], dtype=float)
+    sigmas = np.array([initial(p, q, "sigma") for p, q in edges], dtype=float)
+    weight = np.array([initial(p, q, "weight") if graph.has_edge(p, q) else mu[i]
+                       for i, (p, q) in enumerate(edges)], dtype=float)
+    successes = np.array([initial(p, q, "successes") for p, q in edges], dtype=np.int64)
+    failures = np.array([initial(p, q, "failures") for p, q in edges], dtype=np.int64)
+    removed = np.zeros(len(edges), dtype=bool)
+
+    # outcomes as arrays, ordered per edge and numbered by their rank within the edge
+    edge_of_record = np.array([edge_index[tuple(sorted((r["node_p"], r["node_q"])))] for r in records])
+    success = np.array([bool(r["success"]) for r in records])
+    observed = np.array([r["observed_weight"] if r.get("observed_weight") is not None else np.nan
+                         for r in records], dtype=float)
+    order = np.argsort(edge_of_record, kind="stable")
+    sorted_edges = edge_of_record[order]
+    first = np.searchsorted(sorted_edges, sorted_edges, side="left")
+    rank = np.empty(len(records), dtype=np.int64)
+    rank[order] = np.arange(len(records)) - first
+
+    sigma_squared = sigma ** 2
+    for k in range(rank.max() + 1):
+        selected = np.nonzero(rank == k)[0]
+        e = edge_of_record[selected]
+        active = ~removed[e]
+        selected, e = selected[active], e[active]
+        s = success[selected]
+
+        # Bayesian update of the connectivity probability
+        likelihood_r = np.where(s, p_s_given_r, 1 - p_s_given_r)
+        likelihood_not_r = np.where(s, p_s_given_not_r, 1 - p_s_given_not_r)
+        t = likelihood_r * connectivity[e]
+        connectivity[e] = np.minimum(t / (t + likelihood_not_r * (1 - connectivity[e])), max_connectivity_probability)
+        successes[e] += s
+        failures[e] += ~s
+
+        # update of the weight distribution with the observed reachability
+        updated = s & ~np.isnan(observed[selected])
+        u = e[updated]
+        sigma_t_squared = sigmas[u] ** 2
+        mu[u] = (sigma_squared * mu[u] + sigma_t_squared * observed[selected][updated]) / (
+                sigma_t_squared + sigma_squared)
+        sigmas[u] = np.sqrt(1 / (1 / sigma_t_squared + 1 / sigma_squared))
+        weight[u] = rng.normal(mu[u], sigmas[u]) if rng is not None else mu[u]
+
+        if remove_edges:
+            removed[e[~s]] |= connectivity[e[~s]] < threshold_edge_removal
+
+    return {edge: {"connectivity_probability": connectivity[i], "mu": mu[i], "sigma": sigmas[i],
+                   "weight": weight[i], "successes": int(successes[i]), "failures": int(failures[i]),
+                   "removed": bool(removed[i])}
+            for edge, i in edge_index.items()}
+
+
+def apply_replay(graph: nx.DiGraph, records: [dict], map_file: str, session: int = None, **parameters) -> nx.DiGraph:
+    """ Returns a copy of the graph with the edge parameters replayed from the records of one session, removed edges
+        are dropped
+
+    arguments:
+    graph: nx.DiGraph -- cognitive map graph loaded from the snapshot
+    records: [dict]   -- logged outcomes
+    map_file: str     -- filename of the snapshot graph was loaded from
+    session: int      -- session of the snapshot that is replayed, None: the last one
+    **parameters      -- update parameters passed to replay_outcomes
+    """
+    edge_parameters = replay_outcomes(graph, records, map_file=map_file, session=session, **parameters)
+    graph = graph.copy()
+    for (p, q), parameters in edge_parameters.items():
+        if p not in graph or q not in graph:
+            continue
+        if parameters["removed"]:
+            graph.remove_edges_from([(p, q), (q, p)])
+            continue
+        values = {name: value for name, value in parameters.items() if name != "removed"}
+        graph.add_edge(p, q, **values)
+        graph.add_edge(q, p, **values)
+    return graph
+
+
+if __name__ == "__main__":
+    """ Replay the navigation outcomes logged during lifelong learning with different priors """
+    import sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+    from system.bio_model.cognitive_map_storage import load_graph
+
+    map_file = os.path.join(os.path.dirname(__file__), "..", "..", "bio_model", "data", "cognitive_map",
+                            "after_exploration.gpickle")
+    log_file = os.path.join(os.path.dirname(__file__), "..", "..", "..", "experiments", "navigation_outcomes.jsonl")
+
+    graph, _ = load_graph(map_file)
+    records = select_outcomes(load_outcomes(log_file), os.path.basename(map_file))
+    print("replaying", len(records), "outcomes")
+    for p_s_given_r, p_s_given_not_r in [(0.55, 0.15), (0.7, 0.1), (0.9, 0.05)]:
+        edge_parameters = replay_outcomes(graph, records, p_s_given_r=p_s_given_r, p_s_given_not_r=p_s_given_not_r)
+        nr_removed = sum(parameters["removed"] for parameters in edge_parameters.values())
+        mean_connectivity = np.mean([parameters["connectivity_probability"]
+                                     for parameters in edge_parameters.values()]) if edge_parameters else 0
+        print(f"P(s|r)={p_s_given_r} P(s|~r)={p_s_given_not_r}: {len(edge_parameters)} edges updated, "
+              f"{nr_removed} removed, mean connectivity {mean_connectivity:.3f}")
@@ -20,6 +20,7 @@ from system.controller.simulation.pybullet_environment import PybulletEnvironmen
 from system.bio_model.cognitive_map import LifelongCognitiveMap, CognitiveMapInterface
 from system.bio_model.place_cell_model import PlaceCellNetwork, PlaceCell
 from system.controller.local_controller.local_navigation import vector_navigation, setup_gc_network
+from system.controller.topological.navigation_outcomes import NavigationOutcomeLog
 import system.plotting.plotResults as plot
 
 # if True plot results
@@ -29,7 +30,8 @@ plotting = True
 class TopologicalNavigation(object):
     def __init__(self, env_model: str, method: str,
                  pc_network: PlaceCellNetwork, cognitive_map: CognitiveMapInterface,
-                 gc_network: GridCellNetwork, pod: PhaseOffsetDetectorNetwork):
+                 gc_network: GridCellNetwork, pod: PhaseOffsetDetectorNetwork,
+                 outcome_log: NavigationOutcomeLog = None, shortcut_paths: bool = False):
         """
         Handles interactions between local controller and cognitive_map to navigate the environment.
         Performs topological navigation
@@ -41,6 +43,8 @@ class TopologicalNavigation(object):
         cognitive_map: CognitiveMapInterface -- cognitive map object
         gc_network: GridCellNetwork -- grid cell network
         pod: PhaseOffsetDetectorNetwork -- phase offset detector object
+        outcome_log: NavigationOutcomeLog -- if given: outcomes of the edge traversals are appended to the log
+        shortcut_paths: bool -- if True: hops of planned paths that the agent can skip are removed
         """
         self.pc_network = pc_network
         self.cognitive_map = cognitive_map
@@ -50,6 +54,9 @@ class TopologicalNavigation(object):
         self.method = method
         self.path_length_limit = 30  # max number of topological navigation steps
         self.step_limit = 500  # max number of vector navigation steps
+        self.outcome_log = outcome_log
+        self.shortcut_paths = shortcut_paths
+        self.nr_navigations = 0  # number of started navigations, identifies the run in the outcome log
 
     def navigate(self, start_ind: int = None, goal_ind: int = None, cognitive_map_filename: str = None):
         """ Navigates the agent through the environment with topological navigation.
@@ -65,19 +72,16 @@ class TopologicalNavigation(object):
         int  -- index of goal node
         """
 
+        nodes = list(self.cognitive_map.node_network.nodes)
         if start_ind is None:
-            start = np.random.choice(list(self.cognitive_map.node_network.nodes))
-            start_ind = list(self.cognitive_map.node_network).index(start)
-        else:
-            start = list(self.cognitive_map.node_network.nodes)[start_ind]
+            start_ind = np.random.randint(len(nodes))
+        start = nodes[start_ind]
 
         if goal_ind is None:
-            goal = None
-            while goal is None or goal == start:
-                goal = np.random.choice(list(self.cognitive_map.node_network.nodes))
-            goal_ind = list(self.cognitive_map.node_network).index(goal)
-        else:
-            goal = list(self.cognitive_map.node_network.nodes)[goal_ind]
+            goal_ind = start_ind
+            while nodes[goal_ind] == start:
+                goal_ind = np.random.randint(len(nodes))
+        goal = nodes[goal_ind]
 
         # Plan a topological path through the environment,
         # if no such path exists choose random start and goal until a path is found
@@ -85,17 +89,19 @@ class TopologicalNavigation(object):
         if not path:
             j = 0
             while path is None and j < 10:
-                node = np.random.choice(list(self.cognitive_map.node_network.nodes))
+                node = nodes[np.random.randint(len(nodes))]
                 path = self.cognitive_map.find_path(node, goal)
                 j += 1
             if path is None:
                 path = [goal]
             path = [start] + path
+        if self.shortcut_paths:
+            path = self.cognitive_map.shortcut_path(path)
 
         for i, p in enumerate(path):
-            print("path_index", i, list(self.cognitive_map.node_network.nodes).index(p))
+            print("path_index", i, p)
 
-        src_pos = list(path[0].env_coordinates)
+        src_pos = list(self.cognitive_map.get_place_cell(path[0]).env_coordinates)
 
         dt = 1e-2
         env = PybulletEnvironment(False, dt, self.env_model, self.method, build_data_set=True, start=src_pos)
@@ -103,37 +109,46 @@ class TopologicalNavigation(object):
         if plotting:
             plot.plotTrajectoryInEnvironment(env, cognitive_map=self.cognitive_map, path=path)
 
-        self.gc_network.set_as_current_state(path[0].gc_connections)
-        last_pc = path[0]
+        self.gc_network.set_as_current_state(self.cognitive_map.get_place_cell(path[0]).gc_connections)
+        last_pc = self.cognitive_map.get_place_cell(path[0])
         i = 0
         curr_path_length = 0
         while i + 1 < len(path) and curr_path_length < self.path_length_limit:
-            goal_pos = list(path[i + 1].env_coordinates)
-            goal_spiking = path[i + 1].gc_connections
+            goal_pc = self.cognitive_map.get_place_cell(path[i + 1])
+            goal_pos = list(goal_pc.env_coordinates)
+            goal_spiking = goal_pc.gc_connections
             stop, pc = vector_navigation(env, goal_pos, self.gc_network, goal_spiking, model=self.method,
                                          obstacles=True, exploration_phase=False, pc_network=self.pc_network,
                                          pod=self.pod, cognitive_map=self.cognitive_map, plot_it=False,
                                          step_limit=self.step_limit)
-            self.cognitive_map.postprocess_vector_navigation(node_p=path[i], node_q=path[i + 1],
-                                                             observation_p=last_pc, observation_q=pc, success=stop == 1)
+            outcome = self.cognitive_map.postprocess_vector_navigation(node_p=path[i], node_q=path[i + 1],
+                                                                       observation_p=last_pc, observation_q=pc,
+                                                                       success=stop == 1)
+            if self.outcome_log is not None and outcome is not None:
+                self.outcome_log.append(outcome, run=self.nr_navigations, step=curr_path_length,
+                                        start=start, goal=goal,
+                                        observation_p=list(last_pc.env_coordinates),
+                                        observation_q=list(pc.env_coordinates) if pc is not None else None)
 
             curr_path_length += 1
             if stop != 1:
                 last_pc, new_path = self.locate_node(env, pc, goal)
                 if not last_pc:
-                    last_pc = path[i]
+                    last_pc = self.cognitive_map.get_place_cell(path[i])
 
                 # if no path to the goal exists, try to find a random node that has valid path to the goal
                 # if none is found, go straight to the goal
                 if new_path is None:
                     j = 0
                     while new_path is None and j < 10:
-                        node = np.random.choice(list(self.cognitive_map.node_network.nodes))
+                        node = nodes[np.random.randint(len(nodes))]
                         new_path = self.cognitive_map.find_path(node, goal)
                         j += 1
                     if new_path is None:
                         new_path = [path[i]] + [goal]
                     new_path = [path[i]] + new_path
+                if self.shortcut_paths:
+                    new_path = self.cognitive_map.shortcut_path(new_path)
 
                 path[i:] = new_path
             else:
@@ -146,16 +161,21 @@ class TopologicalNavigation(object):
             print("LIMIT WAS REACHED STOPPING HERE")
 
         if plotting:
-            plot.plotTrajectoryInEnvironment(env, goal=False, start=start.env_coordinates, end=goal.env_coordinates)
+            plot.plotTrajectoryInEnvironment(env, goal=False,
+                                             start=self.cognitive_map.get_place_cell(start).env_coordinates,
+                                             end=self.cognitive_map.get_place_cell(goal).env_coordinates)
             plot.plotTrajectoryInEnvironment(env, goal=False, cognitive_map=self.cognitive_map,
-                                             start=path[0].env_coordinates, end=path[-1].env_coordinates)
+                                             start=self.cognitive_map.get_place_cell(path[0]).env_coordinates,
+                                             end=self.cognitive_map.get_place_cell(path[-1]).env_coordinates)
 
         self.cognitive_map.postprocess_topological_navigation()
         if cognitive_map_filename is not None:
-            self.cognitive_map.save(filename=cognitive_map_filename)
+            # navigation is repeated many times, only the changes of this navigation are appended to the snapshot
+            self.cognitive_map.save_incremental(filename=cognitive_map_filename)
+        self.nr_navigations += 1
         return curr_path_length < self.path_length_limit, start_ind, goal_ind
 
-    def locate_node(self, env: PybulletEnvironment, pc: PlaceCell, goal: PlaceCell):
+    def locate_node(self, env: PybulletEnvironment, pc: PlaceCell, goal: int):
         """
         Maps a location of the given place cell to the node in the graph.
         Among multiple close nodes prioritize the one that has a valid path to the goal.
@@ -163,22 +183,23 @@ class TopologicalNavigation(object):
         arguments:
         env: PybulletEnvironment -- current environment of the agent
         pc: PlaceCell            -- a place cell to be located
-        goal: PlaceCell          -- goal node
+        goal: int                -- goal node
 
         returns:
-        PlaceCell          -- mapped node in the graph or the given place cell if no node was found
-        [PlaceCell] | None -- path to the goal if exists
+        PlaceCell    -- place cell of the mapped node in the graph or the given place cell if no node was found
+        [int] | None -- path to the goal if exists
         """
-        closest_node = None
+        closest_pc = None
         for node in self.cognitive_map.node_network.nodes:
+            node_pc = self.cognitive_map.get_place_cell(node)
             goal_vector = env.get_goal_vector(self.gc_network, self.pod,
-                                              goal=node.env_coordinates)  # recalculate goal_vector
+                                              goal=node_pc.env_coordinates)  # recalculate goal_vector
             if env.reached(goal_vector):
-                closest_node = node
+                closest_pc = node_pc
                 new_path = self.cognitive_map.find_path(node, goal)
                 if new_path:
-                    return node, new_path
-        return closest_node or pc, None
+                    return node_pc, new_path
+        return closest_pc or pc, None
 
 
 if __name__ == "__main__":
@@ -203,7 +224,10 @@ if __name__ == "__main__":
     gc_network = setup_gc_network(1e-2)
     pod = PhaseOffsetDetectorNetwork(16, 9, 40)
 
-    tj = TopologicalNavigation(env_model, model, pc_network, cognitive_map, gc_network, pod)
+    # outcomes can be replayed offline with navigation_outcomes.py
+    outcome_log = NavigationOutcomeLog(os.path.join(os.path.dirname(__file__), "..", "..", "..", "experiments",
+                                                    "navigation_outcomes.jsonl"), map_file=map_file)
+    tj = TopologicalNavigation(env_model, model, pc_network, cognitive_map, gc_network, pod, outcome_log=outcome_log)
 
     dt = 1e-2
     env = PybulletEnvironment(False, dt, env_model, "analytical", build_data_set=True)
@@ -0,0 +1,29 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+nx = pytest.importorskip("networkx")
+pytest.importorskip("torch")
+
+from system.bio_model.place_cell_model import PlaceCell
+from system.bio_model.cognitive_map_storage import save_compact, load_compact, load_topology
+
+
+def test_compact_snapshot_keeps_edge_attributes(tmp_path):
+    graph = nx.DiGraph()
+    place_cells = {}
+    for node in range(3):
+        place_cells[node] = PlaceCell(np.zeros((6, 4)), [np.zeros((4, 8, 8))], np.array([float(node), 1.0]))
+        graph.add_node(node, pos=tuple(place_cells[node].env_coordinates))
+    graph.add_edge(0, 1, weight=0.5, successes=2, blocked=True, label="door", mixed=1.0)
+    graph.add_edge(1, 0, weight=0.7, blocked=False, mixed=False)
+    graph.add_edge(1, 2, weight=1.5)
+
+    directory = str(tmp_path / "map.cmap")
+    save_compact(graph, place_cells, directory)
+    loaded, _ = load_compact(directory)
+
+    assert sorted(loaded.edges) == sorted(graph.edges)
+    for p, q, data in graph.edges(data=True):
+        assert loaded.edges[p, q] == data
+        assert type(loaded.edges[p, q].get("blocked", False)) is bool
+    assert "edge_length" not in load_topology(directory)
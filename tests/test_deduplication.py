@@ -0,0 +1,58 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("networkx")
+pytest.importorskip("scipy")
+pytest.importorskip("torch")
+
+from system.bio_model.place_cell_model import PlaceCell
+from system.bio_model.cognitive_map import LifelongCognitiveMap
+from system.controller.reachability_estimator.reachability_estimation import DistanceReachabilityEstimator
+
+
+def random_map(seed: int, nr_nodes: int = 16) -> LifelongCognitiveMap:
+    """ Helper function, map with random bidirectional and directed edges """
+    rng = np.random.default_rng(seed)
+    density = rng.uniform(0.2, 0.8)
+    cognitive_map = LifelongCognitiveMap(reachability_estimator=DistanceReachabilityEstimator())
+    for i in range(nr_nodes):
+        cognitive_map.add_node_to_map(PlaceCell(None, None, np.array([float(i), 0.0])))
+    for p in range(nr_nodes):
+        for q in range(p + 1, nr_nodes):
+            if rng.random() < density:
+                if rng.random() < 0.8:
+                    cognitive_map.add_bidirectional_edge_to_map_no_weight(p, q, weight=1.0)
+                else:
+                    cognitive_map.add_edge_to_map(*(rng.permutation([p, q]).tolist()))
+    return cognitive_map
+
+
+def baseline_deduplicate(cognitive_map: LifelongCognitiveMap):
+    """ Node cleanup testing every ordered pair of nodes on the changing graph """
+    nodes = list(cognitive_map.node_network.nodes)
+    deleted = []
+    for node_p in nodes:
+        for node_q in nodes:
+            if (node_p in deleted or node_q in deleted or node_q == node_p or
+                    node_p not in cognitive_map.node_network[node_q]):
+                continue
+            if cognitive_map.are_duplicates(node_p, node_q):
+                for neighbor in cognitive_map.node_network[node_p]:
+                    if neighbor not in cognitive_map.node_network[node_q] and neighbor != node_q:
+                        edge_attributes_dict = cognitive_map.node_network.edges[node_p, neighbor]
+                        cognitive_map.add_bidirectional_edge_to_map_no_weight(node_q, neighbor,
+                                                                              **edge_attributes_dict)
+                deleted.append(node_p)
+    for node in deleted:
+        cognitive_map.remove_node_from_map(node)
+
+
+@pytest.mark.parametrize("seed", range(320))
+def test_deduplication_matches_baseline(seed):
+    expected = random_map(seed)
+    baseline_deduplicate(expected)
+    cognitive_map = random_map(seed)
+    cognitive_map.deduplicate_nodes()
+
+    assert set(cognitive_map.node_network.nodes) == set(expected.node_network.nodes)
+    assert set(cognitive_map.node_network.edges) == set(expected.node_network.edges)
@@ -0,0 +1,75 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+
+from system.bio_model.place_cell_model import PlaceCell
+from system.controller.reachability_estimator import networks
+from system.controller.reachability_estimator.reachability_estimation import NetworkReachabilityEstimator
+
+
+@pytest.fixture
+def weights_folder(tmp_path):
+    """ Snapshot of a randomly initialized res_net model """
+    torch.manual_seed(0)
+    nets = networks.initialize_network('res_net', 'pair_conv', pretrained=False)
+    state = {'global_args': {'backbone': 'res_net', 'model_variant': 'pair_conv', 'batch_size': 4},
+             'nets': {name: spec['net'].state_dict() for name, spec in nets.items()}}
+    torch.save(state, tmp_path / "res_net_weights")
+    return str(tmp_path)
+
+
+def place_cells(rng, n):
+    cells = []
+    for node in range(n):
+        pc = PlaceCell(np.zeros((6, 1600)), [rng.uniform(0, 1, (4, 64, 64)).astype(np.float32) for _ in range(2)],
+                       np.array([float(node), 0.0]))
+        if node % 2 == 0:
+            pc.node_id = node
+        cells.append(pc)
+    return cells
+
+
+def test_factored_and_joint_predictions_agree(weights_folder):
+    joint = NetworkReachabilityEstimator(weights_file="res_net_weights", weights_folder=weights_folder, debug=False,
+                                         factored=False)
+    factored = NetworkReachabilityEstimator(weights_file="res_net_weights", weights_folder=weights_folder,
+                                            debug=False, factored=True)
+    assert factored.factored and not joint.factored
+
+    cells = place_cells(np.random.default_rng(0), 5)
+    pairs = [(p, q) for p in cells for q in cells if p is not q]
+    expected = joint.predict_reachability_pairs(pairs)
+    np.testing.assert_allclose(factored.predict_reachability_pairs(pairs), expected, rtol=1e-4, atol=1e-5)
+    assert factored.predict_reachability(cells[0], cells[3]) == pytest.approx(joint.predict_reachability(
+        cells[0], cells[3]), rel=1e-4, abs=1e-5)
+
+    # embeddings of changed observations are recomputed
+    cells[0].observations[0][...] = 1 - cells[0].observations[0]
+    cells[0].observation_changed()
+    np.testing.assert_allclose(factored.predict_reachability_pairs(pairs), joint.predict_reachability_pairs(pairs),
+                               rtol=1e-4, atol=1e-5)
+    assert not hasattr(cells[0], 'reachability_embeddings')
+
+
+def test_embeddings_of_removed_and_reloaded_nodes_are_dropped(weights_folder, tmp_path, monkeypatch):
+    pytest.importorskip("networkx")
+    import system.bio_model.cognitive_map as cognitive_map_module
+    from system.bio_model.cognitive_map import LifelongCognitiveMap
+
+    monkeypatch.setattr(cognitive_map_module, "get_path_top", lambda: str(tmp_path))
+    factored = NetworkReachabilityEstimator(weights_file="res_net_weights", weights_folder=weights_folder,
+                                            debug=False, factored=True)
+    cognitive_map = LifelongCognitiveMap(reachability_estimator=factored)
+    for pc in place_cells(np.random.default_rng(1), 4):
+        cognitive_map.add_node_to_map(pc)
+    cells = list(cognitive_map.place_cells.values())
+    factored.predict_reachability_pairs([(p, q) for p in cells for q in cells if p is not q])
+    assert {node for node, _ in factored.embeddings} == {0, 1, 2, 3}
+
+    cognitive_map.remove_node_from_map(1)
+    assert {node for node, _ in factored.embeddings} == {0, 2, 3}
+
+    cognitive_map.save(filename="map.gpickle")
+    LifelongCognitiveMap(reachability_estimator=factored).load("map.gpickle")
+    assert factored.embeddings == {}
@@ -0,0 +1,59 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+
+from system.bio_model.place_cell_model import PlaceCell, compute_image_descriptor
+from system.controller.reachability_estimator.reachability_estimation import ShortcutReachabilityEstimator
+
+
+def camera_image(rng, shift: int = 0) -> np.ndarray:
+    """ Helper function, smooth RGBA image of the camera size, shifted by some columns """
+    x = np.linspace(0, 4 * np.pi, 224 + 8)
+    rows = 127 + 60 * np.sin(x[:, None] * 0.7) + 60 * np.cos(x[None, :] + np.arange(3)[:, None, None])
+    image = np.transpose(rows, (1, 2, 0))[:224, shift:shift + 224]
+    image = np.clip(image + rng.normal(0, 2, image.shape), 0, 255)
+    return np.concatenate([image, np.full((224, 224, 1), 255.0)], axis=2).astype(np.uint8)
+
+
+def test_near_duplicate_images_are_similar():
+    rng = np.random.default_rng(0)
+    estimator = ShortcutReachabilityEstimator()
+    image = camera_image(rng)
+    near_duplicate = camera_image(rng, shift=2)
+    other = 255 - image
+
+    similarity = estimator.compute_image_similarity(compute_image_descriptor(image),
+                                                    compute_image_descriptor(near_duplicate))
+    assert similarity > 0.5
+    assert estimator.compute_image_similarity(compute_image_descriptor(image), compute_image_descriptor(other)) == 0
+
+    start = PlaceCell(None, None, np.array([0.0, 0.0]), image, 0.0)
+    goal = PlaceCell(None, None, np.array([0.5, 0.0]), near_duplicate, 0.0)
+    assert estimator.predict_reachability(start, goal) > estimator.threshold_reachable
+
+
+def test_calibrated_alpha_is_distance_quantile():
+    rng = np.random.default_rng(0)
+    images = [camera_image(rng, shift) for shift in range(0, 8, 2)] + [255 - camera_image(rng)]
+    estimator = ShortcutReachabilityEstimator()
+    alpha = estimator.calibrate_image_alpha(images, quantile=0.5)
+
+    descriptors = np.array([compute_image_descriptor(image) for image in images])
+    distances = [np.linalg.norm(descriptors[i] - descriptors[j]) for i in range(5) for j in range(i + 1, 5)]
+    assert alpha == pytest.approx(np.median(distances))
+    assert estimator.image_alpha == alpha
+
+
+def test_batched_pairs_match_single_pairs():
+    rng = np.random.default_rng(1)
+    estimator = ShortcutReachabilityEstimator()
+    cells = []
+    for i in range(4):
+        pc = PlaceCell(None, None, np.array([float(i), 0.0]), camera_image(rng, shift=2 * i), 0.3 * i)
+        pc.egocentric_coordinates = np.array([0.8 * i, 0.0])
+        cells.append(pc)
+    pairs = [(p, q) for p in cells for q in cells]
+
+    expected = [estimator.predict_reachability(p, q) for p, q in pairs]
+    np.testing.assert_allclose(estimator.predict_reachability_pairs(pairs), expected, atol=1e-5)
@@ -0,0 +1,39 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("networkx")
+pytest.importorskip("scipy")
+pytest.importorskip("torch")
+
+from system.bio_model.place_cell_model import PlaceCell
+import system.bio_model.cognitive_map as cognitive_map_module
+from system.bio_model.cognitive_map import LifelongCognitiveMap
+from system.controller.reachability_estimator.reachability_estimation import DistanceReachabilityEstimator
+
+
+def line_map(nr_nodes: int) -> LifelongCognitiveMap:
+    """ Helper function, map of nodes on a line connected to their successors """
+    cognitive_map = LifelongCognitiveMap(reachability_estimator=DistanceReachabilityEstimator())
+    for i in range(nr_nodes):
+        cognitive_map.add_node_to_map(PlaceCell(None, None, np.array([float(i), 0.0])))
+    for i in range(nr_nodes - 1):
+        cognitive_map.add_bidirectional_edge_to_map_no_weight(i, i + 1, weight=1.0)
+    return cognitive_map
+
+
+def test_saving_another_snapshot_keeps_the_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(cognitive_map_module, "get_path_top", lambda: str(tmp_path))
+    cognitive_map = line_map(3)
+    cognitive_map.save_incremental("A.gpickle")
+
+    cognitive_map.add_node_to_map(PlaceCell(None, None, np.array([3.0, 0.0])))
+    cognitive_map.add_bidirectional_edge_to_map_no_weight(2, 3, weight=1.0)
+    cognitive_map.save(filename="B.gpickle")
+    cognitive_map.node_network.remove_edge(0, 1)
+    cognitive_map.edges_changed([(0, 1)])
+    cognitive_map.save_incremental("A.gpickle")
+
+    loaded = LifelongCognitiveMap(reachability_estimator=DistanceReachabilityEstimator())
+    loaded.load("A.gpickle")
+    assert sorted(loaded.node_network.nodes) == sorted(cognitive_map.node_network.nodes)
+    assert sorted(loaded.node_network.edges) == sorted(cognitive_map.node_network.edges)
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+
+from system.bio_model.place_cell_model import PlaceCell
+from system.controller.reachability_estimator.reachability_estimation import DistanceReachabilityEstimator
+from system.controller.reachability_estimator.micro_batching import MicroBatchingReachabilityEstimator
+
+
+class CountingReachabilityEstimator(DistanceReachabilityEstimator):
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self.nr_calls = 0
+        self.delay = delay
+
+    def predict_reachability_pairs(self, pairs):
+        self.nr_calls += 1
+        time.sleep(self.delay)
+        return super().predict_reachability_pairs(pairs)
+
+
+def place_cell(x: float) -> PlaceCell:
+    return PlaceCell(None, None, np.array([x, 0.0]))
+
+
+def test_concurrent_single_pair_queries_are_batched():
+    estimator = CountingReachabilityEstimator(delay=0.01)
+    batcher = MicroBatchingReachabilityEstimator(estimator, max_latency=0.05)
+    n = 16
+    goal = place_cell(0.0)
+    results = [None] * n
+    barrier = threading.Barrier(n)
+
+    def query(i):
+        barrier.wait()
+        results[i] = batcher.predict_reachability(place_cell(float(i)), goal)
+
+    threads = [threading.Thread(target=query, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == pytest.approx([float(i) for i in range(n)])
+    assert estimator.nr_calls < n
+    assert batcher.mean_batch_size() > 1
+
+
+def test_map_evaluates_full_batches():
+    estimator = CountingReachabilityEstimator()
+    batcher = MicroBatchingReachabilityEstimator(estimator, max_batch_size=4, max_latency=None)
+    goal = place_cell(0.0)
+    values = batcher.map((place_cell(float(i)), goal) for i in range(10))
+
+    assert values == pytest.approx([float(i) for i in range(10)])
+    assert estimator.nr_calls == 3
+
+
+def test_single_caller_does_not_wait():
+    estimator = CountingReachabilityEstimator()
+    batcher = MicroBatchingReachabilityEstimator(estimator, max_latency=1.0)
+    goal = place_cell(0.0)
+    start = time.perf_counter()
+    values = [batcher.predict_reachability(place_cell(float(i)), goal) for i in range(5)]
+
+    assert time.perf_counter() - start < 0.5
+    assert values == pytest.approx([float(i) for i in range(5)])
+    assert estimator.nr_calls == 5
+
+
+def test_is_mergeable_is_batched():
+    from system.bio_model.cognitive_map import LifelongCognitiveMap
+
+    estimator = CountingReachabilityEstimator()
+    cognitive_map = LifelongCognitiveMap(reachability_estimator=estimator)
+    for i in range(6):
+        cognitive_map.add_node_to_map(place_cell(float(i)))
+    estimator.nr_calls = 0
+    mergeable, values = cognitive_map.is_mergeable(place_cell(2.1))
+
+    assert mergeable
+    assert values == [False, False, True, False, False, False]
+    assert estimator.nr_calls == 1
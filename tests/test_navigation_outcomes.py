@@ -0,0 +1,30 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+nx = pytest.importorskip("networkx")
+
+from system.controller.topological.navigation_outcomes import NavigationOutcomeLog, apply_replay, replay_outcomes
+
+
+def test_replay_only_uses_the_session_of_the_snapshot(tmp_path):
+    filepath = str(tmp_path / "outcomes.jsonl")
+    graph = nx.DiGraph()
+    graph.add_edge(0, 1, connectivity_probability=0.8, mu=0.5, sigma=0.015, weight=0.5)
+    graph.add_edge(1, 0, connectivity_probability=0.8, mu=0.5, sigma=0.015, weight=0.5)
+
+    first = NavigationOutcomeLog(filepath, map_file="a.gpickle")
+    first.append({"node_p": 0, "node_q": 1, "success": True, "observed_weight": 0.6}, run=0)
+    second = NavigationOutcomeLog(filepath, map_file="a.gpickle")
+    for _ in range(3):
+        second.append({"node_p": 0, "node_q": 1, "success": False, "observed_weight": None}, run=0)
+    other = NavigationOutcomeLog(filepath, map_file="b.gpickle")
+    other.append({"node_p": 0, "node_q": 1, "success": True, "observed_weight": 0.6}, run=0)
+    assert (first.session, second.session, other.session) == (0, 1, 0)
+
+    records = other.read()
+    assert replay_outcomes(graph, records, map_file="a.gpickle", session=0)[(0, 1)]["successes"] == 1
+    last = replay_outcomes(graph, records, map_file="a.gpickle")[(0, 1)]
+    assert (last["successes"], last["failures"], last["removed"]) == (0, 3, True)
+
+    assert apply_replay(graph, records, "a.gpickle", session=0).has_edge(0, 1)
+    assert not apply_replay(graph, records, "a.gpickle").has_edge(0, 1)
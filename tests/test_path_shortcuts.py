@@ -0,0 +1,25 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("networkx")
+pytest.importorskip("scipy")
+pytest.importorskip("torch")
+
+from system.bio_model.place_cell_model import PlaceCell
+from system.bio_model.cognitive_map import LifelongCognitiveMap
+from system.controller.reachability_estimator.reachability_estimation import DistanceReachabilityEstimator
+
+
+def test_shortcuts_follow_existing_edges():
+    cognitive_map = LifelongCognitiveMap(reachability_estimator=DistanceReachabilityEstimator())
+    for i in range(4):
+        cognitive_map.add_node_to_map(PlaceCell(None, None, np.array([0.2 * i, 0.0])))
+    for i in range(3):
+        cognitive_map.add_bidirectional_edge_to_map(i, i + 1, 1.0)
+    cognitive_map.add_edge_to_map(0, 2, 1.0)
+
+    # all nodes are reachable from each other, but only the edge 0 -> 2 skips a hop
+    path = cognitive_map.shortcut_path([0, 1, 2, 3])
+
+    assert path == [0, 2, 3]
+    assert all(cognitive_map.node_network.has_edge(p, q) for p, q in zip(path[:-1], path[1:]))
@@ -0,0 +1,89 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+nx = pytest.importorskip("networkx")
+pytest.importorskip("scipy")
+pytest.importorskip("torch")
+
+from system.bio_model.place_cell_model import PlaceCell
+from system.bio_model.cognitive_map import LifelongCognitiveMap
+from system.controller.reachability_estimator.reachability_estimation import DistanceReachabilityEstimator
+
+
+def random_map(backend: str, seed: int = 0, nr_nodes: int = 40, nr_edges: int = 70) -> LifelongCognitiveMap:
+    """ Helper function, map with random weighted directed edges, several components and isolated nodes """
+    rng = np.random.default_rng(seed)
+    cognitive_map = LifelongCognitiveMap(reachability_estimator=DistanceReachabilityEstimator(), backend=backend)
+    for i in range(nr_nodes):
+        cognitive_map.add_node_to_map(PlaceCell(None, None, np.array([float(i), 0.0])))
+    for _ in range(nr_edges):
+        p, q = rng.choice(nr_nodes, 2, replace=False)
+        if rng.random() < 0.5:
+            cognitive_map.add_bidirectional_edge_to_map(int(p), int(q), float(rng.uniform(0.1, 2.0)))
+        else:
+            cognitive_map.add_edge_to_map(int(p), int(q), float(rng.uniform(0.1, 2.0)))
+    return cognitive_map
+
+
+def path_cost(graph: nx.DiGraph, path: [int]) -> float:
+    return sum(graph.edges[p, q]["weight"] for p, q in zip(path[:-1], path[1:]))
+
+
+@pytest.fixture
+def maps():
+    return random_map("networkx"), random_map("sparse")
+
+
+def test_find_path(maps):
+    reference, sparse_map = maps
+    graph = reference.node_network
+    for start in graph.nodes:
+        for goal in graph.nodes:
+            path = sparse_map.find_path(start, goal)
+            if not nx.has_path(graph, start, goal):
+                assert path is None and reference.find_path(start, goal) is None
+                continue
+            assert path[0] == start and path[-1] == goal
+            assert all(graph.has_edge(p, q) for p, q in zip(path[:-1], path[1:]))
+            expected = nx.dijkstra_path_length(graph, start, goal, weight="weight")
+            assert path_cost(graph, path) == pytest.approx(expected)
+            assert path_cost(graph, reference.find_path(start, goal)) == pytest.approx(expected)
+
+
+def test_path_lengths_from(maps):
+    reference, sparse_map = maps
+    sources = [0, 5, 17]
+    expected = nx.multi_source_dijkstra_path_length(reference.node_network, set(sources), weight="weight")
+    for cognitive_map in maps:
+        lengths = cognitive_map.path_lengths_from(sources)
+        assert set(lengths) == set(expected)
+        for node, length in expected.items():
+            assert lengths[node] == pytest.approx(length)
+
+
+def test_components_and_reachability(maps):
+    reference, sparse_map = maps
+    graph = reference.node_network
+    for strongly, components in [(True, nx.strongly_connected_components(graph)),
+                                 (False, nx.weakly_connected_components(graph))]:
+        expected = {frozenset(component) for component in components}
+        for cognitive_map in maps:
+            result = cognitive_map.connected_components(strongly)
+            assert {frozenset(component) for component in result} == expected
+            assert [len(component) for component in result] == sorted(map(len, expected), reverse=True)
+    for node in graph.nodes:
+        expected = nx.descendants(graph, node) | {node}
+        assert sparse_map.reachable_nodes(node) == expected
+        assert reference.reachable_nodes(node) == expected
+        for goal in (0, 13, 39):
+            assert sparse_map.is_reachable(node, goal) == (goal in expected)
+
+
+def test_sparse_backend_follows_changes(maps):
+    reference, sparse_map = maps
+    for cognitive_map in maps:
+        cognitive_map.add_edge_to_map(3, 39, 0.01)
+        cognitive_map.remove_node_from_map(20)
+    assert sparse_map.find_path(3, 39) == [3, 39]
+    assert sparse_map.reachable_nodes(3) == reference.reachable_nodes(3)
+    assert 20 not in sparse_map.path_lengths_from([3])